@@ -1,53 +1,70 @@
-from colorama import Fore, Style, init
-from pyrekordbox import Rekordbox6Database
-from pyrekordbox.db6 import tables
+from colorama import Fore, init
 
 from lib.colours import *
-
-from collections import defaultdict
-import os
-
-def get_major_location(filepath):
-    # Split the path into parts and get the major directory
-        parts = filepath.split('/')
-        if len(parts) > 3:  # Ensure there are enough parts
-            return '/'.join(parts[:4])  # Major locations are in the first four parts
-        print(filepath)
-        return '/'.join(filepath.split("/")[:-1])
+from lib.extract import count_songs
+from lib.locations import DEFAULT_DEPTH, DEFAULT_WORKERS, PathTrie, check_exists, export_csv, export_json, iter_folder_paths
+from lib.session import database_opener
+
+from alive_progress import alive_bar
+import sys
+
+def get_option(name, default=None):
+    """Return the value of a --name=value argument, or the default."""
+    prefix = f"--{name}="
+    for arg in sys.argv:
+        if arg.startswith(prefix):
+            return arg[len(prefix):]
+    return default
+
+def format_size(size):
+    for unit in ("B", "KB", "MB", "GB"):
+        if size < 1024:
+            return f"{size:.1f} {unit}"
+        size /= 1024
+    return f"{size:.1f} TB"
 
 if __name__ == "__main__":
     init(autoreset=True)
 
-    db = Rekordbox6Database()
+    depth = int(get_option("depth", DEFAULT_DEPTH))
+    workers = int(get_option("workers", DEFAULT_WORKERS))
+    export_path = get_option("export")
+
+    db = database_opener()()
+
+    # Stream only FolderPath and FileSize, aggregating counts and sizes at every directory depth
+    check = "--check-exists" in sys.argv
+    trie = PathTrie()
+    paths = []
+    with alive_bar(count_songs(db), title="Loading song paths") as bar:
+        for path, size in iter_folder_paths(db):
+            trie.add(path, size)
+            if check:
+                paths.append(path)
+            bar()
+    db.close()
 
-    songs = [x.FolderPath for x in db.query(tables.DjmdContent).all()]
+    print(f"Loaded {trie.root.count} songs")
 
-    print(f"Loaded {len(songs)} songs")
-    
-    # Dictionary to count songs in each major location
-    location_counts = defaultdict(int)
+    # Check which files still exist, one directory listing per folder
+    if check:
+        exists = check_exists(paths, workers)
+        trie.mark_missing(path for path in paths if not exists.get(path, False))
 
-    # Count songs in each location
-    for path in songs:
-        major_location = get_major_location(path)
-        location_counts[major_location] += 1
-    
     # Sort the location counts by song count (lowest to highest)
-    sorted_location_counts = sorted(location_counts.items(), key=lambda x: x[1])
+    locations = sorted(trie.at_depth(depth), key=lambda stat: stat.count)
 
     # Output the results
     print(f"{Fore.GREEN}Song counts by major location:")
-    for location, count in sorted_location_counts:
-        print(f"{Fore.CYAN}{location}: {Fore.YELLOW}{count} songs")
-
-
-
-
-
-
-
-
-
-
-
-
+    for stat in locations:
+        missing = f" {Fore.RED}({stat.missing} missing)" if stat.missing else ""
+        print(f"{Fore.CYAN}{stat.path}: {Fore.YELLOW}{stat.count} songs, {format_size(stat.size)}{missing}")
+
+    # Export every depth if requested
+    if export_path:
+        stats = list(trie.walk())
+        if export_path.lower().endswith(".csv"):
+            export_csv(stats, export_path)
+        else:
+            export_json(stats, export_path)
+        print(f"Exported {len(stats)} locations to {export_path}")
@@ -0,0 +1,155 @@
+import json
+import logging
+import os
+import platform
+import subprocess
+import sys
+import time
+import tracemalloc
+from contextlib import contextmanager
+from datetime import datetime
+from functools import partial
+from pathlib import Path
+
+from lib.colours import *
+from lib.matching import get_matcher
+from lib.session import PipelineSession, open_database
+from lib.synthetic import SyntheticSpec, generate_database
+
+import deduplicate
+
+logger = logging.getLogger()
+
+DEFAULT_SIZES = "10000,100000,500000"
+BENCH_FOLDER = "./data/bench"
+
+
+def get_option(name, default=None):
+    """Return the value of a --name=value argument, or the default."""
+    prefix = f"--{name}="
+    for arg in sys.argv:
+        if arg.startswith(prefix):
+            return arg[len(prefix):]
+    return default
+
+
+def git_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            cwd=os.path.dirname(os.path.abspath(__file__)), capture_output=True, text=True, check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+class StageRecorder:
+    """Time stages and record their peak traced memory."""
+
+    def __init__(self, trace_memory=True):
+        self.trace_memory = trace_memory
+        self.results = {}
+
+    @contextmanager
+    def stage(self, name):
+        if self.trace_memory:
+            tracemalloc.reset_peak()
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            seconds = time.perf_counter() - start
+            peak = tracemalloc.get_traced_memory()[1] if self.trace_memory else None
+            self.results[name] = {
+                "seconds": round(seconds, 4),
+                "peak_mb": round(peak / 2 ** 20, 2) if peak is not None else None,
+            }
+            logger.info(f"{name}: {seconds:.3f}s" + (f", peak {peak / 2 ** 20:.1f} MB" if peak is not None else ""))
+
+
+def run_benchmark(spec, trace_memory=True):
+    """Generate a library of the given shape and time every pipeline stage on it."""
+    folder = Path(BENCH_FOLDER) / f"{spec.tracks}"
+    folder.mkdir(parents=True, exist_ok=True)
+    db_path = str(folder / "master.db")
+
+    recorder = StageRecorder(trace_memory)
+    with recorder.stage("generate"):
+        counts = generate_database(db_path, spec)
+
+    session = PipelineSession(partial(open_database, db_path, plain=True))
+    with session:
+        db = session.db
+        with recorder.stage("dump_song_data"):
+            content_list = deduplicate.dump_song_data(db, str(folder / "song_dump.yaml"), str(folder / "song_data.json"))
+
+        with recorder.stage("dump_playlist_data"):
+            deduplicate.dump_playlist_data(db, str(folder / "playlist_data.yaml"), str(folder / "playlist_data.json"), collect=False)
+
+        with recorder.stage("match"):
+            groups = get_matcher().group(content_list)
+
+        with recorder.stage("deduplicate"):
+            best_songs = deduplicate.deduplicate(content_list, groups)
+
+        with recorder.stage("replace_songs"):
+            deduplicate.replace_songs(db, best_songs)
+
+        with recorder.stage("merge_songs"):
+            deduplicate.merge_songs(db, best_songs)
+
+        remove_list = [song_id for duplicates in best_songs.values() for song_id in duplicates]
+        with recorder.stage("remove_songs"):
+            deduplicate.remove_songs(db, remove_list)
+
+    return {
+        "tracks": spec.tracks,
+        "duplicate_ratio": spec.duplicate_ratio,
+        "playlists": spec.playlists,
+        "playlist_size": spec.playlist_size,
+        "rows": counts,
+        "groups": len(groups),
+        "removed": len(remove_list),
+        "stages": recorder.results,
+    }
+
+
+if __name__ == "__main__":
+    sizes = [int(size) for size in get_option("sizes", DEFAULT_SIZES).split(",")]
+    duplicate_ratio = float(get_option("duplicate-ratio", 0.2))
+    playlists = int(get_option("playlists", 200))
+    playlist_size = int(get_option("playlist-size", 100))
+    output_path = get_option("output", "./data/bench_results.json")
+    trace_memory = "--no-memory" not in sys.argv
+
+    Path("./data").mkdir(parents=True, exist_ok=True)
+
+    # tracemalloc slows down Python-heavy stages; use --no-memory for timings only
+    if trace_memory:
+        tracemalloc.start()
+
+    results = []
+    for size in sizes:
+        spec = SyntheticSpec(size, duplicate_ratio=duplicate_ratio, playlists=playlists, playlist_size=playlist_size)
+        logger.info(f"Benchmarking {size} tracks ({duplicate_ratio:.0%} duplicates, {playlists} playlists of {playlist_size})")
+        results.append(run_benchmark(spec, trace_memory))
+
+    # Append to earlier runs so results can be compared between commits
+    history = []
+    if os.path.exists(output_path):
+        with open(output_path, "r", encoding="utf-8") as f:
+            history = json.load(f)
+
+    history.append({
+        "commit": git_commit(),
+        "timestamp": datetime.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "memory_traced": trace_memory,
+        "results": results,
+    })
+
+    with open(output_path, "w", encoding="utf-8") as f:
+        json.dump(history, f, indent=4)
+
+    print(f"Wrote benchmark results to {output_path}")
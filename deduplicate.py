@@ -5,24 +5,38 @@ import sys
 import os
 import shutil
 import sys
-import warnings
-import itertools
-import inspect
-from collections import defaultdict
-from datetime import datetime
+import time
 from pathlib import Path
-from typing import Any, Dict, List, Optional
+from typing import Any, Dict, List, Optional, Set
 
+import numpy as np
 from alive_progress import alive_bar
-from pyrekordbox import Rekordbox6Database, show_config
+from pyrekordbox import show_config
 from pyrekordbox.db6 import tables
-from contextlib import redirect_stdout
+from contextlib import nullcontext, redirect_stdout
 from rich.console import Console
 from rich.table import Table
 
 from sqlalchemy.exc import SQLAlchemyError
 
+from lib.bulk import SQLITE_MAX_VARIABLES, bulk_delete_content, chunked, drop_song_map, load_song_map, mapped_playlist_entries, remap_playlist_content
 from lib.colours import *
+from lib.columnar import RULES, SongTable, select_best
+from lib.dump import DEFAULT_DUMP_DEPTH, PLAYLIST_DUMP_COLUMNS, SONG_DUMP_COLUMNS, YamlRecordWriter, dump_depth, dump_enabled, dump_table
+from lib.extract import count_playlists, count_songs, format_song_record, iter_playlist_records, iter_song_records
+from lib.jsonstream import JsonArrayWriter
+from lib.fingerprint import FingerprintIndex
+from lib.journal import Journal, PlanEntry
+from lib.matching import get_matcher, merge_groups
+from lib.merge import delete_merged_rows, merge_metadata, restore_merged_fields, select_merged_fields
+from lib.playlists import compact_playlists, restore_playlist_rows, select_mapped_playlist_rows, select_playlist_rows
+from lib.profiling import get_profiler
+from lib.quality import QualityProbe, quality_score
+from lib.relocate import MoveResult, Relocator
+from lib.scan_cache import RefreshResult, ScanCache
+from lib.scanner import Scanner, write_reports
+from lib.session import PipelineSession, database_opener
+from lib.verify import ByteVerifier, write_report
 
 # Set up logging configuration
 logger = logging.getLogger()
@@ -41,7 +55,7 @@ ch.setFormatter(formatter)
 # Add the console handler to the logger
 logger.addHandler(ch)
 
-def remove_songs(idlist):
+def remove_songs(db, idlist):
     if not idlist:
         logging.error("idlist is empty. No songs to remove.")
         return
@@ -49,153 +63,472 @@ def remove_songs(idlist):
     logging.info(f"Preparing to remove {len(idlist)} songs from Rekordbox DB")
 
     try:
-        db = Rekordbox6Database()  # Attempt to initialize the database connection
-    except Exception as e:
-        logging.critical(f"Failed to connect to the database: {e}")
-        return  # Exit early if we can't even connect to the DB
+        start = time.perf_counter()
 
-    try:
+        # Delete in ID IN (...) batches, together with cues, playlist entries and tag links
         with alive_bar(len(idlist), title="Deleting songs") as bar:
-            for song_id in idlist:
-                try:
-                    # Delete operation
-                    row_deleted = db.query(tables.DjmdContent).filter(tables.DjmdContent.ID == song_id).delete(synchronize_session=False)
-
-                    if row_deleted:
-                        bar()  # Increment progress bar
-                except SQLAlchemyError as e:
-                    logging.warning(f"Error deleting song ID {song_id}: {e}")
-                    db.rollback()  # Rollback only the failed operation (not the entire batch)
+            rows_deleted = bulk_delete_content(db, idlist, progress_bar=bar)
 
         db.commit()  # Commit only once at the end
-        logging.info("Deletion process completed successfully.")
+        elapsed = time.perf_counter() - start
+        logging.info(f"Deletion process completed successfully: {rows_deleted} songs removed in {elapsed:.2f}s.")
 
     except Exception as e:
         logging.error(f"Unexpected error: {e}")
         db.rollback()  # Rollback if a major unexpected error happens
 
-    finally:
-        db.close()
+    
+# Replace all occurrences of a song in a playlist with another song
+def replace_songs(db, best_songs: Dict[int, List[int]], mode: str = "temp_table") -> Set[str]:
+    """
+    Point playlist entries of duplicate songs at the best song of their group.
+
+    Playlists that held a duplicate are then compacted: entries that now repeat a
+    song are collapsed and TrackNo is renumbered, in those playlists only.
+
+    Args:
+        db (Rekordbox6Database): The run's database handle.
+        best_songs (Dict[int, List[int]]): Mapping of best song ID to duplicate IDs.
+        mode (str): "temp_table" loads the whole mapping into a temporary table and
+            rewrites all entries with one UPDATE; "loop" issues one UPDATE per group.
+
+    Returns:
+        Set[str]: IDs of the playlists that were changed.
+    """
+    if not best_songs:
+        logger.warning("No song replacements provided. Exiting function.")
+        return set()
+
+    if mode not in ("temp_table", "loop"):
+        raise ValueError(f"Unknown replacement mode: {mode}")
+
+    logger.info(f"Starting song replacements in Rekordbox DB ({mode} mode)")
+
+    try:
+        total_rows_updated = 0  # Track the total number of rows updated
+        timings = {}
+        remapped_entries = []
+
+        if mode == "temp_table":
+            start = time.perf_counter()
+            mapped = load_song_map(db, best_songs)
+            remapped_entries = mapped_playlist_entries(db)
+            timings["load_mapping"] = time.perf_counter() - start
+
+            start = time.perf_counter()
+            total_rows_updated = remap_playlist_content(db)
+            timings["update"] = time.perf_counter() - start
+
+            drop_song_map(db)
+            logger.info(f"Loaded {mapped} duplicate IDs into the mapping table")
+        else:
+            start = time.perf_counter()
+            with alive_bar(len(best_songs), title="Replacing songs") as bar:
+                for new_song_id, old_song_ids in best_songs.items():
+                    try:
+                        new_song_id = int(new_song_id)  # Ensure it's an integer
+
+                        remapped_entries.extend(
+                            db.query(tables.DjmdSongPlaylist.ID, tables.DjmdSongPlaylist.PlaylistID, tables.DjmdSongPlaylist.ContentID)
+                            .filter(tables.DjmdSongPlaylist.ContentID.in_(old_song_ids))
+                        )
+
+                        # Update rows where ContentID is in old_song_ids
+                        rows_updated = db.query(tables.DjmdSongPlaylist)\
+                            .filter(tables.DjmdSongPlaylist.ContentID.in_(old_song_ids))\
+                            .update({tables.DjmdSongPlaylist.ContentID: new_song_id}, synchronize_session=False)
+
+                        total_rows_updated += rows_updated
+                        bar()  # Update progress bar
+                    except SQLAlchemyError as e:
+                        logger.error(f"Error updating song {new_song_id}: {e}")
+                        db.rollback()  # Rollback only failed updates
+            timings["update"] = time.perf_counter() - start
+
+        # Collapse entries that now repeat a song and close the TrackNo gaps
+        start = time.perf_counter()
+        touched_playlists = {playlist_id for _, playlist_id, _ in remapped_entries}
+        compact_playlists(db, touched_playlists, {entry_id: content_id for entry_id, _, content_id in remapped_entries})
+        timings["compact"] = time.perf_counter() - start
+
+        start = time.perf_counter()
+        db.commit()  # Commit changes after all updates
+        timings["commit"] = time.perf_counter() - start
+
+        logger.info(f"{total_rows_updated} rows updated successfully.")
+        logger.info("Replacement timings: " + ", ".join(f"{step} {seconds:.3f}s" for step, seconds in timings.items()))
+        return touched_playlists
+
+    except SQLAlchemyError as e:
+        logger.error(f"Critical error occurred while updating songs: {e}")
+        db.rollback()
+        return set()
 
     
-def get_filepaths(idlist: List[int]) -> List[str]:
-    if not idlist:
-        logger.warning("idlist is empty. No filepaths to retrieve.")
-        return []
 
-    logger.info("Retrieving filepaths of songs to be deleted")
+def merge_songs(db, best_songs: Dict[int, List[int]]) -> bool:
+    """
+    Carry cues, MyTags, play counts, ratings and comments of duplicates over to the best song.
+
+    The whole mapping is merged with set-based statements and committed as one
+    transaction. Run it before remove_songs, which deletes the duplicates' cues and tags.
 
+    Args:
+        db (Rekordbox6Database): The run's database handle.
+        best_songs (Dict[int, List[int]]): Mapping of best song ID to duplicate IDs.
+
+    Returns:
+        bool: True if the merge was committed.
+    """
     try:
-        db = Rekordbox6Database()
+        load_song_map(db, best_songs)
+        merge_metadata(db)
+        drop_song_map(db)
+        db.commit()
+        return True
+
+    except SQLAlchemyError as e:
+        logger.error(f"Error while merging metadata: {e}")
+        db.rollback()
+        return False
+
+
+def build_plan(db, best_songs: Dict[int, List[int]]) -> List[PlanEntry]:
+    """
+    Resolve the file of every duplicate song, giving the plan stored in the journal.
 
-        # Query to get file paths based on IDs
-        filepathlist = db.query(tables.DjmdContent.FolderPath).filter(tables.DjmdContent.ID.in_(idlist)).all()
+    Args:
+        db (Rekordbox6Database): The run's database handle.
+        best_songs (Dict[int, List[int]]): Mapping of best song ID to duplicate IDs.
 
-        if not filepathlist:
-            logger.info("No filepaths found for the provided IDs.")
-            return []
+    Returns:
+        List[PlanEntry]: One entry per duplicate song, grouped by best song.
+    """
+    old_to_new = {str(old_id): str(new_id) for new_id, old_ids in best_songs.items() for old_id in old_ids}
 
-        # Extract folder paths with progress bar
-        with alive_bar(len(filepathlist), title="Extracting file paths") as bar:
-            flatlist = []
-            for row in filepathlist:
-                flatlist.append(row[0])  # Assuming row is a tuple with the path as the first element
-                bar()  # Update progress bar
+    paths = {}
+    for batch in chunked(list(old_to_new) + [str(new_id) for new_id in best_songs], SQLITE_MAX_VARIABLES):
+        paths.update(
+            db.query(tables.DjmdContent.ID, tables.DjmdContent.FolderPath)
+            .filter(tables.DjmdContent.ID.in_(batch))
+            .all()
+        )
 
-        logger.info(f"Found {len(flatlist)} filepaths")
+    # A duplicate entry of the kept song's own file leaves the file where it is
+    return [
+        PlanEntry(old_id, new_id, paths.get(old_id) if paths.get(old_id) != paths.get(new_id) else None)
+        for old_id, new_id in old_to_new.items()
+    ]
 
-        return flatlist
+
+def _plan_best_songs(entries: List[PlanEntry]) -> Dict[str, List[str]]:
+    """Group plan entries into best song ID -> duplicate IDs."""
+    best_songs = {}
+    for entry in entries:
+        best_songs.setdefault(entry.new_id, []).append(entry.old_id)
+    return best_songs
+
+
+def _remap_batch(db, batch: List[PlanEntry]) -> int:
+    """Point the playlist entries of one journal batch at their best songs with one UPDATE per group."""
+    rows_updated = 0
+    for new_song_id, old_song_ids in _plan_best_songs(batch).items():
+        rows_updated += db.query(tables.DjmdSongPlaylist)\
+            .filter(tables.DjmdSongPlaylist.ContentID.in_(old_song_ids))\
+            .update({tables.DjmdSongPlaylist.ContentID: new_song_id}, synchronize_session=False)
+    return rows_updated
+
+
+def journaled_replace(db, journal: Journal, run_id: int, mode: str = "temp_table") -> bool:
+    """
+    Rewrite playlist entries, recording each row before it changes.
+
+    Batches already completed by an earlier attempt of the run are skipped. In
+    temp_table mode the remaining batches are remapped together with one UPDATE,
+    so djmdSongPlaylist is scanned once however many batches the plan has; every
+    batch is still marked done on its own. In loop mode each batch is committed
+    separately.
+
+    Returns:
+        bool: True if every batch completed.
+    """
+    if mode not in ("temp_table", "loop"):
+        raise ValueError(f"Unknown replacement mode: {mode}")
+
+    batches = journal.batches(run_id)
+    pending = [number for number in range(len(batches)) if not journal.is_done(run_id, "replace", number)]
+    total_rows_updated = 0
+
+    try:
+        with alive_bar(len(batches), title="Replacing songs") as bar:
+            bar(len(batches) - len(pending))
+
+            if mode == "loop":
+                for number in pending:
+                    old_ids = [entry.old_id for entry in batches[number]]
+                    journal.record_playlist_rows(run_id, select_playlist_rows(db, "ContentID", old_ids))
+
+                    total_rows_updated += _remap_batch(db, batches[number])
+                    db.commit()
+                    journal.mark_done(run_id, "replace", number)
+                    bar()
+            elif pending:
+                load_song_map(db, _plan_best_songs([entry for number in pending for entry in batches[number]]))
+                journal.record_playlist_rows(run_id, select_mapped_playlist_rows(db))
+                total_rows_updated = remap_playlist_content(db)
+                drop_song_map(db)
+                db.commit()
+                for number in pending:
+                    journal.mark_done(run_id, "replace", number)
+                bar(len(pending))
+
+        logger.info(f"{total_rows_updated} rows updated successfully.")
+        return True
 
     except SQLAlchemyError as e:
-        logger.error(f"Error retrieving filepaths from the database: {e}")
-        return []
+        logger.error(f"Error while replacing songs, run {run_id} can be continued with --resume: {e}")
+        db.rollback()
+        return False
 
-    finally:
-        db.close()
-        logger.info("Database connection closed.")
 
-def move_files_and_export_to_json(file_paths, destination_folder, json_file_path="./data/destination_files.json"):
-    # Check if file_paths is None or not a list
-    if file_paths is None or not isinstance(file_paths, list):
-        print("Error: file_paths is None or not a list.")
-        return
+def journaled_compact(db, journal: Journal, run_id: int) -> bool:
+    """
+    Collapse repeated songs and renumber TrackNo in the playlists the run rewrote.
+
+    All rows of those playlists are journaled first, so rollback can restore the
+    removed entries and the original numbering.
+
+    Returns:
+        bool: True if the step completed.
+    """
+    if journal.is_done(run_id, "compact", 0):
+        return True
 
-    # Ensure the destination folder exists
-    Path(destination_folder).mkdir(parents=True, exist_ok=True)
+    try:
+        touched_playlists = sorted(journal.touched_playlists(run_id))
+        remapped_entries = journal.remapped_entries(run_id)
+        journal.record_playlist_rows(run_id, select_playlist_rows(db, "PlaylistID", touched_playlists))
 
-    moved_files = []  # List to store successfully moved file paths
+        compact_playlists(db, touched_playlists, remapped_entries)
+        db.commit()
+        journal.mark_done(run_id, "compact", 0)
+        return True
 
-    with alive_bar(len(file_paths), title="Moving files") as bar:
-        for file_path in file_paths:
-            try:
-                # Define the destination path
-                original_filename = os.path.basename(file_path)
-                destination_path = os.path.join(destination_folder, original_filename)
+    except SQLAlchemyError as e:
+        logger.error(f"Error while compacting playlists, run {run_id} can be continued with --resume: {e}")
+        db.rollback()
+        return False
+
+
+def journaled_merge(db, journal: Journal, run_id: int) -> bool:
+    """
+    Merge the metadata of every duplicate into its kept song in one transaction.
 
-                # Ensure unique filename if a file with the same name exists
-                counter = 1
-                while os.path.exists(destination_path):
-                    name, extension = os.path.splitext(original_filename)
-                    destination_path = os.path.join(destination_folder, f"{name} ({counter}){extension}")
-                    counter += 1
+    The kept songs' merged fields are journaled first and reset to those values
+    before merging, so redoing the step after a crash does not add play counts twice.
+    The IDs of copied cues and MyTag links are journaled for rollback.
 
-                # Move the file
-                shutil.move(file_path, destination_path)
-                moved_files.append(destination_path)
+    Returns:
+        bool: True if the step completed.
+    """
+    if journal.is_done(run_id, "merge", 0):
+        return True
 
-            except FileNotFoundError:
-                print(f"File not found: {file_path}")
-            except Exception as e:
-                print(f"Error moving {file_path}: {e}")
+    best_songs = _plan_best_songs(journal.load_plan(run_id))
 
-            bar()  # Update progress bar after processing each file
+    try:
+        journal.record_merged_songs(run_id, select_merged_fields(db, list(best_songs)))
+        restore_merged_fields(db, journal.merged_songs(run_id))
 
-    # Save moved file paths to JSON
-    with open(json_file_path, 'w') as json_file:
-        json.dump(moved_files, json_file, indent=4)
-        print(f"Exported moved file paths to {json_file_path}")
+        load_song_map(db, best_songs)
+        result = merge_metadata(db)
+        drop_song_map(db)
 
+        journal.record_merged_rows(run_id, "djmdCue", result.cue_ids)
+        journal.record_merged_rows(run_id, "djmdSongMyTag", result.tag_ids)
+        db.commit()
+        journal.mark_done(run_id, "merge", 0)
+        return True
 
-# Replace all occurrences of a song in a playlist with another song
-def replace_songs(best_songs: Dict[int, List[int]]):
-    if not best_songs:
-        logger.warning("No song replacements provided. Exiting function.")
-        return
+    except SQLAlchemyError as e:
+        logger.error(f"Error while merging metadata, run {run_id} can be continued with --resume: {e}")
+        db.rollback()
+        return False
 
-    logger.info("Starting song replacements in Rekordbox DB")
+
+def journaled_move(journal: Journal, run_id: int, backup_folder: str, manifest_path: str = "./data/destination_files.jsonl") -> bool:
+    """
+    Move the files of duplicate songs batch by batch, journaling every completed move.
+
+    Files the journal already records as moved are not touched again on resume.
+
+    Returns:
+        bool: True if every batch completed.
+    """
+    batches = journal.batches(run_id)
+    moved = journal.moves(run_id)
+    relocator = Relocator(backup_folder)
+
+    def record(result: MoveResult):
+        if result.error == "not found":
+            print(f"File not found: {result.source}")
+        elif result.error:
+            print(f"Error moving {result.source}: {result.error}")
+        else:
+            journal.record_move(run_id, result.source, result.destination)
+
+    with alive_bar(sum(len(batch) for batch in batches), title="Moving files") as bar:
+        for number, batch in enumerate(batches):
+            if journal.is_done(run_id, "move", number):
+                bar(len(batch))
+                continue
+
+            sources = list(dict.fromkeys(entry.path for entry in batch if entry.path and entry.path not in moved))
+            relocator.move_all(sources, manifest_path, on_result=record, append=bool(moved) or number > 0)
+            bar(len(batch))
+            journal.mark_done(run_id, "move", number)
+
+    logger.info(f"{len(journal.moves(run_id))} files moved to {backup_folder}, manifest in {manifest_path}")
+    return True
+
+
+def journaled_remove(db, journal: Journal, run_id: int) -> bool:
+    """
+    Delete the duplicate songs batch by batch, committing and journaling each batch.
+
+    Returns:
+        bool: True if every batch completed.
+    """
+    batches = journal.batches(run_id)
+    rows_deleted = 0
 
     try:
-        db = Rekordbox6Database()  # Initialize the database session
+        with alive_bar(sum(len(batch) for batch in batches), title="Deleting songs") as bar:
+            for number, batch in enumerate(batches):
+                if not journal.is_done(run_id, "remove", number):
+                    rows_deleted += bulk_delete_content(db, [entry.old_id for entry in batch])
+                    db.commit()
+                    journal.mark_done(run_id, "remove", number)
+                bar(len(batch))
 
-        total_rows_updated = 0  # Track the total number of rows updated
+        logging.info(f"Deletion process completed successfully: {rows_deleted} songs removed.")
+        return True
 
-        with alive_bar(len(best_songs), title="Replacing songs") as bar:
-            for new_song_id, old_song_ids in best_songs.items():
-                try:
-                    new_song_id = int(new_song_id)  # Ensure it's an integer
+    except SQLAlchemyError as e:
+        logger.error(f"Error while removing songs, run {run_id} can be continued with --resume: {e}")
+        db.rollback()
+        return False
 
-                    # Update rows where ContentID is in old_song_ids
-                    rows_updated = db.query(tables.DjmdSongPlaylist)\
-                        .filter(tables.DjmdSongPlaylist.ContentID.in_(old_song_ids))\
-                        .update({tables.DjmdSongPlaylist.ContentID: new_song_id}, synchronize_session=False)
 
-                    total_rows_updated += rows_updated
-                    bar()  # Update progress bar
-                except SQLAlchemyError as e:
-                    logger.error(f"Error updating song {new_song_id}: {e}")
-                    db.rollback()  # Rollback only failed updates
+def execute_run(session: PipelineSession, journal: Journal, run_id: int, backup_folder: str, mode: str = "temp_table", confirm: bool = True):
+    """
+    Run the journaled steps of a deduplication run, resuming where it stopped.
 
-        db.commit()  # Commit changes after all updates
-        logger.info(f"{total_rows_updated} rows updated successfully.")
+    Args:
+        session (PipelineSession): The run's shared database session.
+        journal (Journal): The run journal.
+        run_id (int): The run to execute.
+        backup_folder (str): Folder the duplicate files are moved into.
+        mode (str): Playlist replacement mode, see replace_songs.
+        confirm (bool): Ask before relocating files.
+    """
+    # An in-memory copy only reaches master.db when written back, so batches count as done from then on
+    if session.working_copy is not None:
+        journal.hold_marks()
+
+    def write_back():
+        session.write_back()
+        journal.release_marks()
+
+    with session.stage("replace"):
+        if not journaled_replace(session.db, journal, run_id, mode):
+            return
+
+    with session.stage("compact"):
+        if not journaled_compact(session.db, journal, run_id):
+            return
+
+    if "--no-merge" in sys.argv:
+        journal.mark_done(run_id, "merge", 0)
+    with session.stage("merge"):
+        if not journaled_merge(session.db, journal, run_id):
+            return
+
+    # Playlists must point at the kept songs on disk before any file is moved
+    write_back()
+
+    if confirm:
+        input("Proceed with relocation of duplicate song files? Press Ctrl+C to exit if not >> ")
+
+    with session.stage("move"):
+        if not journaled_move(journal, run_id, backup_folder):
+            return
+    journal.release_marks()
+
+    with session.stage("remove"):
+        if not journaled_remove(session.db, journal, run_id):
+            return
+
+    write_back()
+    journal.set_status(run_id, "completed")
+    logger.info(f"Run {run_id} completed")
+
+
+def rollback_run(session: PipelineSession, journal: Journal):
+    """
+    Undo the playlist rewrites, metadata merge and file moves of the latest run.
+
+    Runs that already removed songs cannot be rolled back, since the deleted
+    djmdContent rows are not journaled.
+    """
+    db = session.db
+    run = journal.latest_run()
+    if run is None or run[1] == "rolled_back":
+        print("No run to roll back")
+        return
+
+    run_id = run[0]
+    if journal.completed_batches(run_id, "remove"):
+        logger.error(f"Run {run_id} already removed songs from the database and cannot be rolled back")
+        return
+
+    # Move files back to where they came from
+    moves = journal.moves(run_id)
+    restored = []
+    with alive_bar(len(moves), title="Restoring files") as bar:
+        for source, destination in moves.items():
+            try:
+                Path(source).parent.mkdir(parents=True, exist_ok=True)
+                shutil.move(destination, source)
+                restored.append(source)
+            except OSError as e:
+                print(f"Error restoring {destination}: {e}")
+            bar()
+    journal.forget_moves(run_id, restored)
+
+    if len(restored) < len(moves):
+        logger.error(f"{len(moves) - len(restored)} files could not be restored, run --rollback again once fixed")
+        return
+
+    # Restore the recorded playlist rows, re-creating the ones that were collapsed,
+    # and undo the metadata merge
+    entries = journal.playlist_rows(run_id)
+    try:
+        restore_playlist_rows(db, entries)
+        for table, row_ids in journal.merged_rows(run_id).items():
+            delete_merged_rows(db, table, row_ids)
+        restore_merged_fields(db, journal.merged_songs(run_id))
+        db.commit()
+        session.write_back()
 
     except SQLAlchemyError as e:
-        logger.error(f"Critical error occurred while updating songs: {e}")
+        logger.error(f"Error restoring playlist entries: {e}")
         db.rollback()
+        return
 
-    finally:
-        db.close()
+    journal.set_status(run_id, "rolled_back")
+    logger.info(f"Run {run_id} rolled back: {len(restored)} files and {len(entries)} playlist entries restored")
 
-    
 
 def index_to_id(index: int, li: List[Dict[str, int]]) -> Optional[int]:
     """
@@ -226,333 +559,285 @@ def index_to_id(index: int, li: List[Dict[str, int]]) -> Optional[int]:
         return None
 
 
-def transpose_dicts(list_of_dicts: List[Dict[str, Any]]) -> Dict[str, List[Any]]:
+def dump_song_data(db, yaml_file_path: str = "./data/song_dump.yaml", json_file_path: str = "./data/song_data.json") -> List[Dict[str, Any]]:
     """
-    Transpose a list of dictionaries, aggregating values by their keys.
+    Dumps song data from the database to a JSON file and optionally to a YAML file.
 
     Args:
-        list_of_dicts (List[Dict[str, Any]]): A list of dictionaries to be transposed.
+        db (Rekordbox6Database): The run's database handle.
+        yaml_file_path (str): The path to the YAML file for dumping song data.
+        json_file_path (str): The path to the JSON file for dumping song data.
 
     Returns:
-        Dict[str, List[Any]]: A dictionary with keys from the input dictionaries and values as lists of corresponding values.
+        List[Dict[str, Any]]: A list of dictionaries containing song data.
     """
-    # Initialize a defaultdict to hold the transposed data
-    transposed = defaultdict(list)
+    try:
+        total_songs = count_songs(db)
+    except Exception as e:
+        print(f"Error retrieving content from the database: {e}")
+        return []
 
-    # Iterate through each dictionary in the list
-    for d in list_of_dicts:
-        if not isinstance(d, dict):
-            raise ValueError("All elements of the input list must be dictionaries.")
-        for key, value in d.items():
-            # Append the value to the corresponding list in the transposed dictionary
-            transposed[key].append(value)
+    content_list = []
 
-    return dict(transposed)  # Convert defaultdict back to a regular dict before returning
+    # Stream only the needed columns instead of loading full DjmdContent objects
+    try:
+        # Dump to YAML if "--dump" is in command line arguments, one record per song
+        yaml_dump = YamlRecordWriter(yaml_file_path, SONG_DUMP_COLUMNS, formatter=format_song_record) if dump_enabled("songs") else nullcontext()
 
-def all_equal(iterable):
-    g = itertools.groupby(iterable)
-    return next(g, True) and not next(g, False)
+        with alive_bar(total_songs, title="Dumping song data") as bar, yaml_dump as dumper:
+            for json_formatted in iter_song_records(db):
+                if dumper is not None:
+                    dumper.write(json_formatted)
 
-def dump_object(obj, indent=0, visited=None, file=None, skip_recurse={}, progress_bar=None, total_items=None):
-    """
-    Recursively prints string attributes and values from an object,
-    avoiding infinite recursion by tracking visited objects.
-    Handles SQLAlchemy-related attribute access issues.
-    Outputs the results to a file if provided.
-    Uses a single alive-progress bar for tracking.
-    """
+                content_list.append(json_formatted)
+                bar()  # Update progress bar after processing each song
 
-    if visited is None:
-        visited = set()
-    
-    if id(obj) in visited:
-        return  # Avoid infinite recursion
-    visited.add(id(obj))
+        if dumper is not None and dumper.error is not None:
+            print(f"Error writing to YAML file: {dumper.error}")
+    except SQLAlchemyError as e:
+        print(f"Error retrieving content from the database: {e}")
+        return []
 
-    def output(text):
-        if file:
-            file.write(text + "\n")
-        else:
-            print(text)
-
-    # Initialize progress bar only at the top level
-    if progress_bar is None:
-        total_items = count_items(obj)  # Count total items for progress tracking
-        with alive_bar(total_items, title="Dumping object") as bar:
-            dump_object(obj, indent, visited, file, skip_recurse, progress_bar=bar, total_items=total_items)
-        return  # Prevent further execution after the initial call
-
-    # Update the progress bar when processing a new object
-    progress_bar()
-
-    if isinstance(obj, str):
-        output(" " * indent + obj)
-    elif isinstance(obj, (list, tuple, set)):
-        for item in obj:
-            dump_object(item, indent + 2, visited, file, skip_recurse, progress_bar, total_items)
-    elif isinstance(obj, dict):
-        for key, value in obj.items():
-            output(f"{' ' * indent}{key}: ")
-            if key in skip_recurse:
-                output(f"{' ' * (indent + 2)}{value}")
-            else:
-                dump_object(value, indent + 2, visited, file, skip_recurse, progress_bar, total_items)
-    else:
-        # Suppress SQLAlchemy deprecation warnings
-        with warnings.catch_warnings():
-            warnings.simplefilter("ignore", category=DeprecationWarning)
-            
-            # Inspect object attributes safely
-            for name, value in inspect.getmembers(obj, lambda a: not inspect.isroutine(a)):
-                if name.startswith("_"):
-                    continue  # Skip private and built-in attributes
-                
-                try:
-                    if isinstance(value, str):
-                        output(f"{' ' * indent}{name}: {value}")
-                    elif name in skip_recurse:
-                        output(f"{' ' * indent}{name}: {value}")
-                    else:
-                        output(f"{' ' * indent}{name}:")
-                        dump_object(value, indent + 2, visited, file, skip_recurse, progress_bar, total_items)
-                except Exception:
-                    continue  # Skip attributes that raise exceptions when accessed
-
-def count_items(obj):
-    """Helper function to estimate the total number of items for progress tracking."""
-    if isinstance(obj, (list, tuple, set)):
-        return sum(count_items(item) for item in obj) + len(obj)
-    elif isinstance(obj, dict):
-        return sum(count_items(value) for value in obj.values()) + len(obj)
-    elif hasattr(obj, '__dict__'):
-        return sum(count_items(value) for value in vars(obj).values()) + 1
-    return 1  # Base case for single objects
-
-def grouped_non_unique_indexes(strings):
-    # Step 1: Count occurrences of each string and store their indexes
-    count = {}
-    indexes = {}
+    # Write to JSON file, formatting dates only at serialization time
+    try:
+        with JsonArrayWriter(json_file_path, formatter=format_song_record) as writer:
+            for record in content_list:
+                writer.write(record)
+    except Exception as e:
+        print(f"Error writing to JSON file: {e}")
     
-    for index, string in enumerate(strings):
-        # Count occurrences
-        count[string] = count.get(string, 0) + 1
-        # Store the indexes of each string
-        if string in indexes:
-            indexes[string].append(index)
-        else:
-            indexes[string] = [index]
-
-    # Step 2: Collect groups of non-unique string indexes
-    grouped_indexes = [index_list for string, index_list in indexes.items() if count[string] > 1]
-
-    return grouped_indexes
-
+    return content_list
 
-def dump_song_data(yaml_file_path: str = "./data/song_dump.yaml", json_file_path: str = "./data/song_data.json") -> List[Dict[str, Any]]:
+def load_song_data_incremental(db, json_file_path: str = "./data/song_data.json", cache_path: str = "./data/song_cache.db") -> RefreshResult:
     """
-    Dumps song data from the database to a JSON file and optionally to a YAML file.
+    Refresh the local scan cache and return the song data from it.
+
+    Only songs whose rb_local_usn or updated_at changed since the last run are
+    re-extracted. The JSON file is rewritten only when something changed.
 
     Args:
-        yaml_file_path (str): The path to the YAML file for dumping song data.
+        db (Rekordbox6Database): The run's database handle.
         json_file_path (str): The path to the JSON file for dumping song data.
+        cache_path (str): The path to the scan cache.
 
     Returns:
-        List[Dict[str, Any]]: A list of dictionaries containing song data.
+        RefreshResult: The song data and what changed since the last refresh.
     """
-    db = Rekordbox6Database()
-    
-    try:
-        dbcontent = db.get_content().all()
-    except Exception as e:
-        print(f"Error retrieving content from the database: {e}")
-        return []
+    with ScanCache(cache_path) as cache:
+        result = cache.refresh(db)
 
-    content_list = []
+    if result.changed_ids or result.deleted_ids or not os.path.exists(json_file_path):
+        try:
+            with JsonArrayWriter(json_file_path, formatter=format_song_record) as writer:
+                for record in result.content_list:
+                    writer.write(record)
+        except Exception as e:
+            print(f"Error writing to JSON file: {e}")
 
-    # Initialize progress bar for the number of songs in dbcontent
-    with alive_bar(len(dbcontent), title="Dumping song data") as bar:
-        for index, content in enumerate(dbcontent):
-            # Dump to YAML if "--dump" is in command line arguments
-            if "--dump" in sys.argv:
-                try:
-                    with open(yaml_file_path, "w", encoding="utf-8") as f:
-                        dump_object(content, file=f, skip_recurse={"imag", "MixerParams", "Cues", "created_at", "updated_at", "MyTags", "MyTagIDs", "MyTagNames", "Artist", "Genre", "Key", "Album", "Analysed"})
-                except Exception as e:
-                    print(f"Error writing to YAML file: {e}")
-
-            # Create a JSON-formatted dictionary for each content
-            json_formatted = {
-                "ID": content.ID,
-                "index": index,
-                "created_at": str(content.created_at),
-                "Title": content.Title,
-                "AlbumID": content.AlbumID,
-                "AlbumName": content.AlbumName,
-                "ArtistName": content.ArtistName,
-                "ArtistID": content.ArtistID,
-                "FolderPath": content.FolderPath,
-                "BPM": content.BPM,
-                "BitRate": content.BitRate,
-                "FullName": f"{content.ArtistName} - {content.Title}",
-                "MyTagIDs": list(content.MyTagIDs),
-                "MyTagNames": list(content.MyTagNames)
-            }
-
-            content_list.append(json_formatted)
-            bar()  # Update progress bar after processing each song
-
-    # Write to JSON file
-    try:
-        with open(json_file_path, "w", encoding="utf-8") as f:
-            json.dump(content_list, f, indent=4)
-    except Exception as e:
-        print(f"Error writing to JSON file: {e}")
-    
-    return content_list
+    return result
 
-def dump_playlist_data(yaml_file_path: str = "./data/playlist_data.yaml", json_file_path: str = "./data/playlist_data.json") -> List[Dict[str, Any]]:
+def dump_playlist_data(db, yaml_file_path: str = "./data/playlist_data.yaml", json_file_path: str = "./data/playlist_data.json", collect: bool = True) -> List[Dict[str, Any]]:
     """
     Dumps playlist data from the database to a JSON file and optionally to a YAML file.
 
     Args:
+        db (Rekordbox6Database): The run's database handle.
         yaml_file_path (str): The path to the YAML file for dumping playlist data.
         json_file_path (str): The path to the JSON file for dumping playlist data.
+        collect (bool): Whether to also return the records. The JSON file is written
+            as a stream either way, so pass False to keep memory use flat.
 
     Returns:
-        List[Dict[str, Any]]: A list of dictionaries containing playlist data.
+        List[Dict[str, Any]]: A list of dictionaries containing playlist data, empty if collect is False.
     """
-    db = Rekordbox6Database()
-    
     try:
-        dbcontent = db.get_playlist().all()
+        total_playlists = count_playlists(db)
     except Exception as e:
         print(f"Error retrieving playlists from the database: {e}")
         return []
 
     content_list = []
 
-    # Initialize progress bar for the number of playlists in dbcontent
-    with alive_bar(len(dbcontent), title="Dumping playlist data") as bar:
-        for index, content in enumerate(dbcontent):
-            # Dump to YAML if "--dump" is in command line arguments
-            if "--dump" in sys.argv:
-                try:
-                    with open(yaml_file_path, "w", encoding="utf-8") as f:
-                        dump_object(content, file=f, skip_recurse={"imag", "MixerParams", "Cues", "created_at", "updated_at", "MyTagIDs", "MyTagNames", "MyTags", "Artist", "Genre", "Key", "Album", "Analysed", "Parent"})
-                except Exception as e:
-                    print(f"Error writing to YAML file: {e}")
-
-            # Create a JSON-formatted dictionary for each playlist
-            json_formatted = {
-                "ID": content["ID"],
-                "index": index,
-                "Name": content.Name,
-                "Attribute": content.Attribute,
-                "SongIDs": [getattr(x.Content, "ID", "No ID") for x in content.Songs]
-            }
-
-            content_list.append(json_formatted)
-            bar()  # Update progress bar after processing each playlist
-
-    # Write to JSON file
     try:
-        with open(json_file_path, "w", encoding="utf-8") as f:
-            json.dump(content_list, f, indent=4)
+        # Initialize progress bar for the number of playlists
+        # Dump to YAML if "--dump" is in command line arguments, one record per playlist
+        yaml_dump = YamlRecordWriter(yaml_file_path, PLAYLIST_DUMP_COLUMNS) if dump_enabled("playlists") else nullcontext()
+
+        with alive_bar(total_playlists, title="Dumping playlist data") as bar, \
+                JsonArrayWriter(json_file_path) as writer, yaml_dump as dumper:
+            for json_formatted in iter_playlist_records(db):
+                if dumper is not None:
+                    dumper.write(json_formatted)
+
+                writer.write(json_formatted)
+                if collect:
+                    content_list.append(json_formatted)
+                bar()  # Update progress bar after processing each playlist
+
+        if dumper is not None and dumper.error is not None:
+            print(f"Error writing to YAML file: {dumper.error}")
+    except SQLAlchemyError as e:
+        print(f"Error retrieving playlists from the database: {e}")
     except Exception as e:
         print(f"Error writing to JSON file: {e}")
-    
+
     return content_list
 
-def deduplicate(content_list: List[Dict[str, Any]], non_unique_indexes: List[List[int]]) -> Dict[int, List[int]]:
+def dump_full_objects(db, max_depth: int = DEFAULT_DUMP_DEPTH):
+    """
+    Dump every song and playlist with their relationships for debugging.
+
+    Args:
+        db (Rekordbox6Database): The run's database handle.
+        max_depth (int): How many relationship levels to follow per row.
     """
-    Deduplicates a list of songs based on multiple criteria: bitrate, imported from device, created date, and index.
+    try:
+        dump_table(db, tables.DjmdContent, "./data/song_dump_full.yaml", max_depth, skip_recurse={"MixerParams", "Cues"})
+        dump_table(db, tables.DjmdPlaylist, "./data/playlist_dump_full.yaml", max_depth, skip_recurse={"Parent", "Children"})
+    except (SQLAlchemyError, OSError) as e:
+        logger.error(f"Error dumping full objects: {e}")
+
+def scan_files(content_list: List[Dict[str, Any]], roots: List[str]) -> Dict[str, bool]:
+    """
+    Check which library files exist and find audio files the library does not reference.
+
+    Writes ./data/missing_files.json and ./data/orphan_files.json.
 
     Args:
         content_list (List[Dict[str, Any]]): List of song data as dictionaries.
-        non_unique_indexes (List[List[int]]): List of index groups that are considered duplicates.
+        roots (List[str]): Music folders to look for orphans in, `music_roots` in config.json.
 
     Returns:
-        Dict[int, List[int]]: Dictionary mapping the best song ID to the list of duplicate IDs to be removed.
+        Dict[str, bool]: FolderPath -> whether the file exists.
     """
-    stats = {
-        "highest_bitrate": 0,
-        "remove_imported": 0,
-        "created_at": 0,
-        "first_index": 0
-    }
+    with Scanner(roots) as scanner:
+        report = scanner.scan(song["FolderPath"] for song in content_list)
 
-    best_indexes = []
+    write_reports(report)
+    logger.info(
+        f"Scanned {len(roots)} music roots ({report.directories_listed} folders listed, "
+        f"{report.directories_cached} unchanged): {len(report.missing)} missing files, {len(report.orphans)} orphans"
+    )
+    return report.exists
 
-    # Initialize the progress bar for non_unique_indexes
-    with alive_bar(len(non_unique_indexes), title="Deduplicating songs") as bar:
-        for group in non_unique_indexes:
-            songs = [content_list[songindex] for songindex in group]
-            songs_transposed = transpose_dicts(songs)
-
-            # Check bitrate
-            bitrates = songs_transposed["BitRate"]
-            if not all_equal(bitrates):
-                best_index = bitrates.index(max(bitrates))
-                best_indexes.append(best_index)
-                stats["highest_bitrate"] += 1
-                bar()  # Update progress bar
-                continue
+def fingerprint_groups(content_list: List[Dict[str, Any]], index_path: str = "./data/fingerprints.db") -> List[List[int]]:
+    """
+    Group songs whose audio fingerprints match, regardless of their tags.
 
-            # Check FolderPath for imported from device
-            imported_bools = ["/Imported from Device/" in x for x in songs_transposed["FolderPath"]]
-            if False in imported_bools and True in imported_bools:
-                best_index = imported_bools.index(False)
-                best_indexes.append(best_index)
-                stats["remove_imported"] += 1
-                bar()  # Update progress bar
-                continue
+    Args:
+        content_list (List[Dict[str, Any]]): List of song data as dictionaries.
+        index_path (str): The persistent fingerprint index.
 
-            # Check created_at for oldest file
-            dates = songs_transposed["created_at"]
-            if not all_equal(dates):
+    Returns:
+        List[List[int]]: Groups of content_list indexes with matching audio.
+    """
+    paths = [song["FolderPath"] for song in content_list]
 
-                # Define potential date formats
-                date_formats = [
-                    "%Y-%m-%d %H:%M:%S.%f",  # Handles microseconds
-                    "%Y-%m-%d %H:%M:%S",      # Handles seconds only
-                ]
-        
-                datetimes = []
-                for date_str in dates:
-                    for date_format in date_formats:
-                        try:
-                            # Attempt to parse the date string
-                            datetimes.append(datetime.strptime(date_str, date_format))
-                            break  # Exit the format loop if parsing is successful
-                        except ValueError:
-                            continue  # Try the next format
-                        except Exception as e:
-                            logging.error(f"An unknown exception occurred: {e}")
-                
-                best_index = datetimes.index(min(datetimes))
-                best_indexes.append(best_index)
-                stats["created_at"] += 1
-                bar()  # Update progress bar
-                continue
+    with FingerprintIndex(index_path) as index:
+        stale = index.stale_paths(paths)
+        logger.info(f"Fingerprinting {len(stale)} new or changed files")
+
+        with alive_bar(len(stale), title="Fingerprinting files") as bar:
+            index.update(paths, progress_bar=bar, stale=stale)
 
-            # If all criteria are the same, choose the first index
-            best_indexes.append(min(group))
-            stats["first_index"] += 1
-            bar()  # Update progress bar
+        return index.group_paths(paths)
+
+def exact_copy_groups(content_list: List[Dict[str, Any]]) -> List[List[int]]:
+    """
+    Group songs whose files have identical bytes, regardless of their tags.
+
+    Args:
+        content_list (List[Dict[str, Any]]): List of song data as dictionaries.
+
+    Returns:
+        List[List[int]]: Groups of content_list indexes with byte-identical files.
+    """
+    paths = [song["FolderPath"] for song in content_list]
+    with ByteVerifier() as verifier, alive_bar(title="Hashing files") as bar:
+        return verifier.identical_groups(paths, progress_bar=bar)
 
+def verify_groups(content_list: List[Dict[str, Any]], non_unique_indexes: List[List[int]], strict: bool = False) -> List[List[int]]:
+    """
+    Compare the files of every duplicate group byte for byte.
+
+    Groups whose files differ, e.g. other versions of a track that share its name,
+    are written to ./data/verify_report.json.
+
+    Args:
+        content_list (List[Dict[str, Any]]): List of song data as dictionaries.
+        non_unique_indexes (List[List[int]]): Groups of content_list indexes.
+        strict (bool): Keep only the groups whose files are all byte-identical.
+
+    Returns:
+        List[List[int]]: The groups to deduplicate.
+    """
+    groups = [[content_list[index]["FolderPath"] for index in group] for group in non_unique_indexes]
+    with ByteVerifier() as verifier, alive_bar(title="Verifying files") as bar:
+        checks = verifier.check_groups(groups, progress_bar=bar)
+
+    write_report(groups, checks)
+    identical = sum(check.identical for check in checks)
+    logger.info(
+        f"{identical} of {len(checks)} duplicate groups are byte-identical copies, "
+        f"the others are listed in ./data/verify_report.json"
+    )
+
+    if strict:
+        return [group for group, check in zip(non_unique_indexes, checks) if check.identical]
+    return non_unique_indexes
+
+def probe_quality(content_list: List[Dict[str, Any]], non_unique_indexes: List[List[int]]) -> Dict[str, float]:
+    """
+    Read the audio headers of every song in a duplicate group and score its quality.
+
+    Args:
+        content_list (List[Dict[str, Any]]): List of song data as dictionaries.
+        non_unique_indexes (List[List[int]]): Groups of content_list indexes.
+
+    Returns:
+        Dict[str, float]: FolderPath -> quality score, for the files that could be probed.
+    """
+    paths = list(dict.fromkeys(content_list[index]["FolderPath"] for group in non_unique_indexes for index in group))
+    with QualityProbe() as probe, alive_bar(len(paths), title="Probing audio headers") as bar:
+        qualities = probe.probe_all(paths, progress_bar=bar)
+
+    lossless = sum(quality.lossless for quality in qualities.values())
+    logger.info(f"Probed {len(qualities)} of {len(paths)} files, {lossless} lossless")
+    return {path: quality_score(quality) for path, quality in qualities.items()}
+
+def deduplicate(content_list: List[Dict[str, Any]], non_unique_indexes: List[List[int]], file_exists: Optional[Dict[str, bool]] = None, quality: Optional[Dict[str, float]] = None) -> Dict[int, List[int]]:
+    """
+    Deduplicates a list of songs based on multiple criteria: file on disk, probed quality, bitrate, imported from device, created date, and index.
+
+    Args:
+        content_list (List[Dict[str, Any]]): List of song data as dictionaries.
+        non_unique_indexes (List[List[int]]): List of index groups that are considered duplicates.
+        file_exists (Optional[Dict[str, bool]]): FolderPath -> file found on disk, from scan_files.
+        quality (Optional[Dict[str, float]]): FolderPath -> quality score, from probe_quality.
+
+    Returns:
+        Dict[int, List[int]]: Dictionary mapping the best song ID to the list of duplicate IDs to be removed.
+    """
+    if not non_unique_indexes:
+        return {}
+
+    # Evaluate the rules for every group at once on column arrays
+    table = SongTable.from_records(content_list, file_exists, quality)
+    with alive_bar(len(non_unique_indexes), title="Deduplicating songs") as bar:
+        best_rows, decided_by = select_best(table, non_unique_indexes)
+        bar(len(non_unique_indexes))
+
+    counts = np.bincount(decided_by, minlength=len(RULES))
+    stats = {name: int(count) for name, count in zip(RULES, counts)}
     print_rich_stats(stats)
 
-    # Construct final deduplicated list
+    # Map each best song to the other songs of its group
     best_songs = {}
-    for i, index in enumerate(best_indexes):
-        best_id = index_to_id(non_unique_indexes[i][index], content_list)
-        duplicate_ids = [index_to_id(a, content_list) for a in non_unique_indexes[i]]
-        best_songs[best_id] = duplicate_ids
+    for group, best_row in zip(non_unique_indexes, best_rows.tolist()):
+        best_id = index_to_id(best_row, content_list)
+        best_songs[best_id] = [index_to_id(a, content_list) for a in group if a != best_row]
 
-    # Clean up the data by removing duplicates from the lists
-    cleaned_data = {key: [v for v in values if v != key] for key, values in best_songs.items()}
-
-    return cleaned_data
+    return best_songs
 
 def print_rich_stats(stats):
     console = Console()
@@ -603,69 +888,131 @@ def config_output_col():
     # Print the color-coded output
     print(colored_output)
 
-if __name__ == "__main__":
-    #Output config with colour coding
-    config_output_col()
+def run_pipeline(session: PipelineSession, journal: Journal):
+    """
+    Scan, deduplicate and apply the plan, or resume or roll back a journaled run.
 
-    # Create data folder if it doesn't exist
-    Path("./data").mkdir(parents=True, exist_ok=True)
+    Args:
+        session (PipelineSession): The open database session shared by every stage.
+        journal (Journal): The run journal.
+    """
+    db = session.db
+    replace_mode = "loop" if "--replace-loop" in sys.argv else "temp_table"
+
+    # Undo the playlist rewrites and file moves of the latest run
+    if "--rollback" in sys.argv:
+        with session.stage("rollback"):
+            rollback_run(session, journal)
+        return
+
+    # Continue an interrupted run from its last completed batch
+    if "--resume" in sys.argv:
+        run = journal.latest_run("running")
+        if run is None:
+            print("No interrupted run to resume, exiting")
+            exit(1)
+
+        run_id, _, backup_folder = run
+        logger.info(f"Resuming run {run_id}")
+        execute_run(session, journal, run_id, backup_folder, mode=replace_mode, confirm=False)
+        return
+
+    # Load backup folder and music root configuration
+    with open("./config.json", "r") as f:
+        config = json.load(f)
 
-    # Retrieve song data and output to JSON
-    content_list = dump_song_data()
+    # Retrieve song data and output to JSON, reusing the scan cache if requested
+    with session.stage("dump_songs"):
+        if "--incremental" in sys.argv:
+            content_list = load_song_data_incremental(db).content_list
+        else:
+            content_list = dump_song_data(db)
 
     # Retrieve playlists
-    dump_playlist_data()
+    with session.stage("dump_playlists"):
+        dump_playlist_data(db, collect=False)
+
+    # Dump complete song and playlist objects with their relationships if requested
+    if "--dump-full" in sys.argv:
+        with session.stage("dump_full"):
+            dump_full_objects(db, dump_depth())
+
+    # Find indexes of non-unique items, by default on full name (Song title and artist name combined)
+    with session.stage("match"):
+        matcher = get_matcher()
+        non_unique_indexes = matcher.group(content_list)
 
-    # Transpose the content list for easier searching/filtering
-    transposed_list = transpose_dicts(content_list)
+        # Add groups of songs with identical audio if requested
+        if "--fingerprint" in sys.argv:
+            non_unique_indexes = merge_groups(len(content_list), non_unique_indexes, fingerprint_groups(content_list))
+
+        # Add groups of songs whose files are byte-identical copies if requested
+        if "--exact-copies" in sys.argv:
+            non_unique_indexes = merge_groups(len(content_list), non_unique_indexes, exact_copy_groups(content_list))
 
-    # Find indexes of non-unique items based on full name (Song title and artist name combined)
-    non_unique_indexes = grouped_non_unique_indexes(transposed_list["FullName"])
     logging.info(f"{len(non_unique_indexes)} duplicate tracks found")
 
     if len(non_unique_indexes) == 0:
         print("No duplicates were found, exiting")
         exit(1)
 
+    # Check the files on disk if requested, so songs whose file exists are kept
+    file_exists = None
+    if "--scan" in sys.argv:
+        with session.stage("scan_files"):
+            file_exists = scan_files(content_list, config.get("music_roots", []))
+
+    # Compare the files of each group byte for byte if requested, keeping only exact copies with --verify-strict
+    if "--verify" in sys.argv or "--verify-strict" in sys.argv:
+        with session.stage("verify"):
+            non_unique_indexes = verify_groups(content_list, non_unique_indexes, strict="--verify-strict" in sys.argv)
+
+    # Rank by the audio headers of the files rather than the stored BitRate, unless disabled
+    quality = None
+    if "--no-probe" not in sys.argv:
+        with session.stage("probe"):
+            quality = probe_quality(content_list, non_unique_indexes)
+
     # Identify the best member of each group and format as a list of dicts
-    best_songs = deduplicate(content_list, non_unique_indexes)
+    with session.stage("deduplicate"):
+        best_songs = deduplicate(content_list, non_unique_indexes, file_exists, quality)
 
     # Dump the best IDs to JSON if requested
     if "--dump" in sys.argv:
         with open("./data/best_ids.json", "w", encoding="utf-8") as f:
             json.dump(best_songs, f, indent=4)
 
-    input("Proceed with Deduplication? Press Ctrl+C to exit if not >> ")
-
-    # Replace songs in playlists with the best selections
-    replace_songs(best_songs)
-
-    # Create a list of IDs for songs to remove
-    remove_songs_list = [item for sublist in best_songs.values() for item in sublist]
-
     # Dump the list of songs to remove if requested
     if "--dump" in sys.argv:
+        remove_songs_list = [item for sublist in best_songs.values() for item in sublist]
         print(f"Songs to remove: {remove_songs_list}")
 
-    input("Proceed with relocation of duplicate song files? Press Ctrl+C to exit if not >> ")
-
-    # Get filepaths of songs to remove
-    filepaths = get_filepaths(remove_songs_list)
+    input("Proceed with Deduplication? Press Ctrl+C to exit if not >> ")
 
-    # Load backup folder configuration
-    with open("./config.json", "r") as f:
-        config = json.load(f)
-    
     backup_folder = config.get("move_files_folder")
 
-    # Move files to backup directory and export the list to JSON
-    move_files_and_export_to_json(filepaths, backup_folder)
+    # Journal the plan, then replace songs in playlists, move the duplicate files and remove their entries
+    with session.stage("plan"):
+        run_id = journal.start_run(build_plan(db, best_songs), backup_folder)
+    logger.info(f"Started run {run_id}, continue it with --resume or undo it with --rollback if it is interrupted")
+    execute_run(session, journal, run_id, backup_folder, mode=replace_mode)
 
-    # Remove song entries from the database
-    remove_songs(remove_songs_list)
-    
-   
 
+if __name__ == "__main__":
+    #Output config with colour coding
+    config_output_col()
 
+    # Create data folder if it doesn't exist
+    Path("./data").mkdir(parents=True, exist_ok=True)
 
-    
\ No newline at end of file
+    # Open the database once and share it between all stages, in RAM with --in-memory
+    profiler = get_profiler()
+    session = PipelineSession(database_opener(), in_memory="--in-memory" in sys.argv, profiler=profiler)
+    try:
+        with session, Journal() as journal:
+            run_pipeline(session, journal)
+    finally:
+        session.log_timings()
+        if profiler is not None:
+            profiler.finish()
+            profiler.print_summary()
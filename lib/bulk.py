@@ -0,0 +1,199 @@
+import logging
+import time
+from typing import Dict, Iterable, Iterator, List, Sequence, Tuple
+
+from pyrekordbox.db6 import tables
+from sqlalchemy import text
+from sqlalchemy.exc import SQLAlchemyError
+
+logger = logging.getLogger(__name__)
+
+# Default SQLITE_MAX_VARIABLE_NUMBER for SQLite builds older than 3.32. Newer builds
+# allow 32766, but staying under the old limit keeps every bound statement valid.
+SQLITE_MAX_VARIABLES = 999
+
+# Tables holding rows that reference djmdContent.ID and must go with the song
+CONTENT_DEPENDENT_TABLES = (
+    tables.DjmdCue,
+    tables.DjmdSongPlaylist,
+    tables.DjmdSongMyTag,
+)
+
+
+def chunked(items: Iterable, size: int) -> Iterator[List]:
+    """
+    Split an iterable into lists of at most `size` items.
+
+    Args:
+        items (Iterable): The items to split.
+        size (int): The maximum number of items per chunk.
+
+    Yields:
+        List: The next chunk of items.
+    """
+    if size < 1:
+        raise ValueError("Chunk size must be at least 1.")
+
+    chunk = []
+    for item in items:
+        chunk.append(item)
+        if len(chunk) == size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def delete_content_rows(db, content_ids: Sequence) -> int:
+    """
+    Delete songs and every row depending on them with one statement per table.
+
+    Args:
+        db (Rekordbox6Database): An open database handle.
+        content_ids (Sequence): IDs of the songs to delete, at most SQLITE_MAX_VARIABLES.
+
+    Returns:
+        int: The number of djmdContent rows deleted.
+    """
+    for table in CONTENT_DEPENDENT_TABLES:
+        db.query(table).filter(table.ContentID.in_(content_ids)).delete(synchronize_session=False)
+
+    return db.query(tables.DjmdContent)\
+        .filter(tables.DjmdContent.ID.in_(content_ids))\
+        .delete(synchronize_session=False)
+
+
+def begin_transaction(db):
+    """
+    Open the session's outer transaction with an explicit BEGIN if none is open yet.
+
+    pysqlite and sqlcipher3 only emit BEGIN before a DML statement. A SAVEPOINT sent
+    first starts a transaction of its own, and its RELEASE then commits the batch.
+    """
+    connection = db.session.connection()
+    if not connection.connection.driver_connection.in_transaction:
+        connection.exec_driver_sql("BEGIN")
+
+
+def _delete_rows_individually(db, content_ids: Sequence) -> int:
+    """Fallback for a failed batch: delete each song in its own savepoint."""
+    deleted = 0
+    for content_id in content_ids:
+        try:
+            with db.session.begin_nested():
+                deleted += delete_content_rows(db, [content_id])
+        except SQLAlchemyError as e:
+            logger.warning(f"Error deleting song ID {content_id}: {e}")
+    return deleted
+
+
+def bulk_delete_content(db, idlist: Sequence, batch_size: int = SQLITE_MAX_VARIABLES, progress_bar=None) -> int:
+    """
+    Delete songs and their cues, playlist entries and tag links in chunked batches.
+
+    Every batch runs inside a savepoint of the caller's transaction, which is opened
+    first if needed, so nothing is visible until the caller commits and a rollback
+    undoes every batch. If a batch fails, only that batch is retried one row at a time.
+
+    Args:
+        db (Rekordbox6Database): An open database handle.
+        idlist (Sequence): IDs of the songs to delete.
+        batch_size (int): Number of IDs bound per statement.
+        progress_bar: Optional alive-progress bar, advanced by the size of each batch.
+
+    Returns:
+        int: The total number of djmdContent rows deleted.
+    """
+    batch_size = min(batch_size, SQLITE_MAX_VARIABLES)
+    total_deleted = 0
+    begin_transaction(db)
+
+    for batch_number, batch in enumerate(chunked(idlist, batch_size), start=1):
+        start = time.perf_counter()
+
+        try:
+            with db.session.begin_nested():
+                deleted = delete_content_rows(db, batch)
+        except SQLAlchemyError as e:
+            logger.warning(f"Batch {batch_number} failed ({e}), retrying its {len(batch)} songs one by one")
+            deleted = _delete_rows_individually(db, batch)
+
+        elapsed = time.perf_counter() - start
+        rate = deleted / elapsed if elapsed > 0 else float("inf")
+        logger.info(f"Batch {batch_number}: deleted {deleted}/{len(batch)} songs in {elapsed:.3f}s ({rate:.0f} songs/s)")
+
+        total_deleted += deleted
+        if progress_bar is not None:
+            progress_bar(len(batch))
+
+    return total_deleted
+
+
+SONG_MAP_TABLE = "dedup_song_map"
+
+
+def load_song_map(db, best_songs: Dict[int, List[int]]) -> int:
+    """
+    Load the best song -> duplicates mapping into a temporary table.
+
+    The table lives on the session's connection as `dedup_song_map(old_id, new_id)`
+    with old_id as its primary key, so lookups by duplicate ID use the index.
+
+    Args:
+        db (Rekordbox6Database): An open database handle.
+        best_songs (Dict[int, List[int]]): Mapping of best song ID to duplicate IDs.
+
+    Returns:
+        int: The number of duplicate IDs loaded.
+    """
+    connection = db.session.connection()
+    connection.execute(text(
+        f"CREATE TEMP TABLE IF NOT EXISTS {SONG_MAP_TABLE} "
+        "(old_id TEXT PRIMARY KEY, new_id TEXT NOT NULL)"
+    ))
+    connection.execute(text(f"DELETE FROM {SONG_MAP_TABLE}"))
+
+    rows = [
+        {"old_id": str(old_id), "new_id": str(new_id)}
+        for new_id, old_ids in best_songs.items()
+        for old_id in old_ids
+        if str(old_id) != str(new_id)
+    ]
+    if rows:
+        connection.execute(text(f"INSERT OR REPLACE INTO {SONG_MAP_TABLE} (old_id, new_id) VALUES (:old_id, :new_id)"), rows)
+
+    return len(rows)
+
+
+def drop_song_map(db):
+    """Drop the temporary mapping table created by load_song_map."""
+    db.session.connection().execute(text(f"DROP TABLE IF EXISTS {SONG_MAP_TABLE}"))
+
+
+def remap_playlist_content(db) -> int:
+    """
+    Point every playlist entry of a duplicate at its best song in one statement.
+
+    Requires the mapping table from load_song_map. The correlated UPDATE makes a
+    single pass over djmdSongPlaylist and resolves each entry by primary key lookup.
+
+    Args:
+        db (Rekordbox6Database): An open database handle.
+
+    Returns:
+        int: The number of playlist entries rewritten.
+    """
+    result = db.session.connection().execute(text(
+        "UPDATE djmdSongPlaylist "
+        f"SET ContentID = (SELECT m.new_id FROM {SONG_MAP_TABLE} AS m WHERE m.old_id = djmdSongPlaylist.ContentID) "
+        f"WHERE ContentID IN (SELECT old_id FROM {SONG_MAP_TABLE})"
+    ))
+    return result.rowcount
+
+
+def mapped_playlist_entries(db) -> List[Tuple[str, str, str]]:
+    """Return (ID, PlaylistID, ContentID) of the playlist entries of songs in the mapping table created by load_song_map."""
+    rows = db.session.connection().execute(text(
+        f"SELECT ID, PlaylistID, ContentID FROM djmdSongPlaylist WHERE ContentID IN (SELECT old_id FROM {SONG_MAP_TABLE})"
+    ))
+    return [tuple(row) for row in rows]
@@ -0,0 +1,198 @@
+from typing import Any, Dict, List, NamedTuple, Optional, Sequence, Tuple
+
+import numpy as np
+
+IMPORTED_FROM_DEVICE = "/Imported from Device/"
+
+# Rules applied to every duplicate group, in priority order
+RULES = ("file_exists", "highest_quality", "highest_bitrate", "remove_imported", "created_at", "first_index")
+
+
+class SongTable:
+    """
+    Column arrays for the fields the dedup rules look at.
+
+    Row i of every column belongs to content_list[i], so duplicate groups can be
+    used directly as row indexes.
+    """
+
+    __slots__ = ("ids", "exists", "quality", "bitrate", "imported", "created_at", "has_created_at")
+
+    def __init__(self, ids: np.ndarray, exists: np.ndarray, quality: np.ndarray, bitrate: np.ndarray, imported: np.ndarray, created_at: np.ndarray, has_created_at: np.ndarray):
+        self.ids = ids
+        self.exists = exists
+        self.quality = quality
+        self.bitrate = bitrate
+        self.imported = imported
+        self.created_at = created_at
+        self.has_created_at = has_created_at
+
+    def __len__(self):
+        return len(self.ids)
+
+    @classmethod
+    def from_records(cls, content_list: List[Dict[str, Any]], file_exists: Optional[Dict[str, bool]] = None,
+                     quality: Optional[Dict[str, float]] = None) -> "SongTable":
+        """
+        Build the columns from `content_list` records in one pass per field.
+
+        `file_exists` maps FolderPath to whether the file is on disk; songs not in
+        it, or every song when it is None, count as existing.
+
+        `quality` maps FolderPath to a probed quality score (see lib.quality).
+        Songs that were not probed score their BitRate instead, and without any
+        scores the column is all zeros, so only the BitRate rule ranks.
+        """
+        created_at = [song["created_at"] for song in content_list]
+        file_exists = file_exists or {}
+        if quality:
+            scores = [quality.get(song["FolderPath"], song["BitRate"] or 0) for song in content_list]
+        else:
+            scores = [0] * len(content_list)
+
+        return cls(
+            ids=np.array([song["ID"] for song in content_list], dtype=object),
+            exists=np.array([file_exists.get(song["FolderPath"], True) for song in content_list], dtype=bool),
+            quality=np.array(scores, dtype=np.float64),
+            bitrate=np.array([song["BitRate"] or 0 for song in content_list], dtype=np.int64),
+            imported=np.array([IMPORTED_FROM_DEVICE in (song["FolderPath"] or "") for song in content_list], dtype=bool),
+            created_at=np.array([value or 0 for value in created_at], dtype=np.int64),
+            has_created_at=np.array([value is not None for value in created_at], dtype=bool),
+        )
+
+
+def group_by_key(keys: Sequence[Any]) -> List[List[int]]:
+    """
+    Group row indexes that share a key, keeping only keys that occur more than once.
+
+    Keys are integer-encoded with np.unique and grouped with one stable sort.
+    Groups are ordered by their first row, and rows inside a group ascend, the
+    shape every matcher returns.
+
+    Args:
+        keys (Sequence[Any]): One key per row, e.g. every FullName.
+
+    Returns:
+        List[List[int]]: The groups of row indexes.
+    """
+    if len(keys) == 0:
+        return []
+
+    _, codes = np.unique(np.asarray(keys, dtype=str), return_inverse=True)
+    order = np.argsort(codes, kind="stable")
+    sorted_codes = codes[order]
+
+    starts = np.flatnonzero(np.r_[True, sorted_codes[1:] != sorted_codes[:-1]])
+    sizes = np.diff(np.r_[starts, len(order)])
+    duplicate = sizes > 1
+
+    groups = np.split(order, starts[1:])
+    groups = [groups[i] for i in np.flatnonzero(duplicate)]
+    groups.sort(key=lambda group: group[0])
+
+    return [group.tolist() for group in groups]
+
+
+class Flattened(NamedTuple):
+    """Duplicate groups concatenated into one array with segment offsets."""
+    rows: np.ndarray
+    starts: np.ndarray
+    group_of: np.ndarray
+
+
+def flatten_groups(groups: List[List[int]]) -> Flattened:
+    sizes = np.array([len(group) for group in groups], dtype=np.int64)
+    rows = np.concatenate([np.asarray(group, dtype=np.int64) for group in groups])
+    starts = np.r_[0, np.cumsum(sizes)[:-1]]
+    group_of = np.repeat(np.arange(len(groups)), sizes)
+    return Flattened(rows, starts, group_of)
+
+
+def _first_where(mask: np.ndarray, flat: Flattened) -> np.ndarray:
+    """Position in the flattened array of the first True per group, len(mask) if none."""
+    positions = np.where(mask, np.arange(len(mask)), len(mask))
+    return np.minimum.reduceat(positions, flat.starts)
+
+
+def _extremes(values: np.ndarray, candidate: np.ndarray, flat: Flattened) -> Tuple[np.ndarray, np.ndarray]:
+    """Highest and lowest value among the candidate rows of every group."""
+    if values.dtype == bool:
+        low, high = False, True
+    elif np.issubdtype(values.dtype, np.floating):
+        low, high = -np.inf, np.inf
+    else:
+        low, high = np.iinfo(values.dtype).min, np.iinfo(values.dtype).max
+    highest = np.maximum.reduceat(np.where(candidate, values, low), flat.starts)
+    lowest = np.minimum.reduceat(np.where(candidate, values, high), flat.starts)
+    return highest, lowest
+
+
+def select_best(table: SongTable, groups: List[List[int]]) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Pick the song to keep in every duplicate group with segmented reductions.
+
+    The rules are evaluated for all groups at once, in priority order: file
+    exists on disk, highest probed quality, highest bitrate, not imported from a device, earliest
+    creation date and finally the lowest content_list index.
+
+    Missing files only narrow the candidates: when a group has files on disk, the
+    later rules rank just those, and file_exists decides a group only when a
+    single song is left.
+
+    Args:
+        table (SongTable): Columns of the whole content_list.
+        groups (List[List[int]]): Duplicate groups of row indexes.
+
+    Returns:
+        Tuple[np.ndarray, np.ndarray]: The row kept per group, and the index into
+        RULES of the rule that decided each group.
+    """
+    if not groups:
+        return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+
+    flat = flatten_groups(groups)
+    rule = np.full(len(groups), RULES.index("first_index"))
+    best = np.full(len(groups), -1)
+    undecided = np.ones(len(groups), dtype=bool)
+
+    def decide(applies, positions, name):
+        chosen = undecided & applies
+        best[chosen] = flat.rows[positions[chosen]]
+        rule[chosen] = RULES.index(name)
+        undecided[chosen] = False
+
+    # Only songs whose file exists on disk stay candidates, unless none of the group's files exist
+    exists = table.exists[flat.rows]
+    any_exists, all_exist = _extremes(exists, np.ones(len(exists), dtype=bool), flat)
+    some_missing = any_exists & ~all_exist
+    candidate = exists | ~some_missing[flat.group_of]
+    remaining = np.add.reduceat(candidate.astype(np.int64), flat.starts)
+    decide(some_missing & (remaining == 1), _first_where(candidate, flat), "file_exists")
+
+    # Highest quality score from the file headers
+    quality = table.quality[flat.rows]
+    best_quality, worst_quality = _extremes(quality, candidate, flat)
+    decide(best_quality != worst_quality, _first_where(candidate & (quality == best_quality[flat.group_of]), flat), "highest_quality")
+
+    # Highest bitrate
+    bitrate = table.bitrate[flat.rows]
+    highest, lowest = _extremes(bitrate, candidate, flat)
+    decide(highest != lowest, _first_where(candidate & (bitrate == highest[flat.group_of]), flat), "highest_bitrate")
+
+    # Prefer songs that were not imported from a device
+    imported = table.imported[flat.rows]
+    some_imported, all_imported = _extremes(imported, candidate, flat)
+    decide(some_imported & ~all_imported, _first_where(candidate & ~imported, flat), "remove_imported")
+
+    # Earliest creation date, ignoring unparseable dates
+    created = table.created_at[flat.rows]
+    valid = candidate & table.has_created_at[flat.rows]
+    latest, earliest = _extremes(created, valid, flat)
+    has_dates = np.add.reduceat(valid.astype(np.int64), flat.starts) > 0
+    decide(has_dates & (earliest != latest), _first_where(valid & (created == earliest[flat.group_of]), flat), "created_at")
+
+    # Lowest content_list index
+    _, first = _extremes(flat.rows, candidate, flat)
+    best[undecided] = first[undecided]
+
+    return best, rule
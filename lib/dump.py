@@ -0,0 +1,275 @@
+import json
+import logging
+import queue
+import sys
+import threading
+from functools import lru_cache
+from typing import Any, Callable, Dict, Iterable, List, NamedTuple, Optional, Sequence, Tuple
+
+from alive_progress import alive_bar
+from sqlalchemy import inspect as sqlalchemy_inspect
+
+logger = logging.getLogger(__name__)
+
+# Columns written to the debug dumps, per table
+SONG_DUMP_COLUMNS = (
+    "ID", "index", "created_at", "Title", "AlbumID", "AlbumName", "ArtistName", "ArtistID",
+    "FolderPath", "BPM", "BitRate", "Length", "FullName", "MyTagIDs", "MyTagNames",
+)
+PLAYLIST_DUMP_COLUMNS = ("ID", "index", "Name", "Attribute", "SongIDs")
+
+# Relationship depth followed by the full object dumps unless --dump-depth=N is given
+DEFAULT_DUMP_DEPTH = 1
+
+
+def dump_enabled(table: str, argv: Optional[List[str]] = None) -> bool:
+    """
+    Check whether the debug dump for a table was requested on the command line.
+
+    `--dump` turns dumping on for every table, `--no-dump-<table>` skips one.
+
+    Args:
+        table (str): The table name used in the flag, e.g. "songs" or "playlists".
+        argv (Optional[List[str]]): Arguments to check, defaults to sys.argv.
+
+    Returns:
+        bool: True if the table should be dumped.
+    """
+    argv = sys.argv if argv is None else argv
+    return "--dump" in argv and f"--no-dump-{table}" not in argv
+
+
+def dump_depth(argv: Optional[List[str]] = None) -> int:
+    """
+    Read the relationship depth for full object dumps from `--dump-depth=N`.
+
+    A value that is not a whole number of at least 0 is reported and replaced by
+    DEFAULT_DUMP_DEPTH.
+    """
+    argv = sys.argv if argv is None else argv
+    for arg in argv:
+        if arg.startswith("--dump-depth="):
+            value = arg.split("=", 1)[1]
+            try:
+                depth = int(value)
+            except ValueError:
+                depth = -1
+            if depth < 0:
+                logger.warning(f"Invalid --dump-depth '{value}', using the default depth of {DEFAULT_DUMP_DEPTH}")
+                return DEFAULT_DUMP_DEPTH
+            return depth
+    return DEFAULT_DUMP_DEPTH
+
+
+def format_yaml_record(record: Dict[str, Any], columns: Sequence[str]) -> str:
+    """
+    Format the declared columns of a record as one YAML sequence item.
+
+    Values are written as JSON scalars and flow collections, which are valid YAML.
+    """
+    lines = []
+    for position, column in enumerate(columns):
+        prefix = "- " if position == 0 else "  "
+        value = json.dumps(record.get(column), ensure_ascii=False, default=str)
+        lines.append(f"{prefix}{column}: {value}")
+    return "\n".join(lines) + "\n"
+
+
+class YamlRecordWriter:
+    """
+    Append records to a YAML file that is opened once for the whole dump.
+
+    Only the declared columns are serialized, after an optional `formatter` has
+    been applied to the record. With `threaded=True` formatting and
+    file writes happen on a background thread fed through a bounded queue, so the
+    caller can keep streaming rows from the database.
+
+    Usage:
+        with YamlRecordWriter("./data/song_dump.yaml", SONG_DUMP_COLUMNS) as dumper:
+            for record in records:
+                dumper.write(record)
+    """
+
+    _STOP = object()
+
+    def __init__(self, path: str, columns: Iterable[str], threaded: bool = True, queue_size: int = 1000, formatter: Optional[Callable[[Dict[str, Any]], Dict[str, Any]]] = None):
+        self.path = path
+        self.columns = tuple(columns)
+        self.formatter = formatter
+        self.threaded = threaded
+        self.count = 0
+        self.error: Optional[Exception] = None
+        self._file = None
+        self._queue = queue.Queue(maxsize=queue_size) if threaded else None
+        self._thread = None
+
+    def __enter__(self):
+        try:
+            self._file = open(self.path, "w", encoding="utf-8")
+        except OSError as e:
+            self.error = e
+            return self
+
+        if self.threaded:
+            self._thread = threading.Thread(target=self._drain, name=f"dump-{self.path}", daemon=True)
+            self._thread.start()
+        return self
+
+    def _append(self, record: Dict[str, Any]):
+        try:
+            if self.formatter is not None:
+                record = self.formatter(record)
+            self._file.write(format_yaml_record(record, self.columns))
+        except Exception as e:
+            self.error = e
+
+    def _drain(self):
+        while True:
+            record = self._queue.get()
+            if record is self._STOP:
+                return
+            if self.error is None:
+                self._append(record)
+
+    def write(self, record: Dict[str, Any]):
+        """
+        Queue or write one record.
+
+        A failed dump never interrupts the caller: after the first error further
+        records are dropped and the error is kept in `self.error`.
+        """
+        if self.error is not None:
+            return
+
+        if self.threaded:
+            self._queue.put(record)
+        else:
+            self._append(record)
+        self.count += 1
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        if self._thread is not None:
+            self._queue.put(self._STOP)
+            self._thread.join()
+            self._thread = None
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+
+class AttributePlan(NamedTuple):
+    """Column and relationship names of a mapped class, in mapper order."""
+    columns: Tuple[str, ...]
+    relationships: Tuple[str, ...]
+
+
+@lru_cache(maxsize=None)
+def attribute_plan(cls) -> AttributePlan:
+    """
+    Build (once per class) the list of attributes to serialize for a mapped class.
+
+    Only mapped columns and relationships are included, so association proxies and
+    properties that would trigger extra queries are never touched.
+
+    Args:
+        cls: A mapped class, e.g. one of the pyrekordbox.db6.tables classes.
+
+    Returns:
+        AttributePlan: The column and relationship attribute names.
+    """
+    mapper = sqlalchemy_inspect(cls, raiseerr=False)
+    if mapper is None:
+        raise TypeError(f"{cls.__name__} is not a mapped SQLAlchemy class.")
+
+    columns = tuple(attr.key for attr in mapper.column_attrs)
+    relationships = tuple(rel.key for rel in mapper.relationships)
+    return AttributePlan(columns, relationships)
+
+
+def format_scalar(value: Any) -> str:
+    """Format a column value for the object dumps."""
+    return json.dumps(value, ensure_ascii=False, default=str)
+
+
+def dump_object(obj, file=None, max_depth: int = DEFAULT_DUMP_DEPTH, skip_recurse: Iterable[str] = (), progress_bar=None, indent: int = 0, path: Tuple[int, ...] = ()):
+    """
+    Write the columns of a mapped object and follow its relationships to `max_depth`.
+
+    Relationships are only loaded while the depth allows it, and cycles are cut by
+    checking the objects on the current path instead of remembering every object seen.
+    When no progress bar is passed an indeterminate one is created, so nothing has to
+    walk the object graph beforehand just to size it.
+
+    Args:
+        obj: A mapped object, e.g. a DjmdContent row.
+        file: File to write to, prints to stdout if None.
+        max_depth (int): How many relationship levels to follow.
+        skip_recurse (Iterable[str]): Relationship names never followed.
+        progress_bar: Optional alive-progress bar, advanced once per object.
+    """
+    if progress_bar is None:
+        with alive_bar(title="Dumping object") as bar:
+            dump_object(obj, file, max_depth, frozenset(skip_recurse), bar, indent, path)
+        return
+
+    output: Callable[[str], Any] = (lambda text: file.write(text + "\n")) if file else print
+    pad = " " * indent
+    path = path + (id(obj),)
+    plan = attribute_plan(type(obj))
+
+    progress_bar()
+
+    for name in plan.columns:
+        output(f"{pad}{name}: {format_scalar(getattr(obj, name, None))}")
+
+    if max_depth <= 0:
+        return
+
+    for name in plan.relationships:
+        if name in skip_recurse:
+            continue
+
+        value = getattr(obj, name, None)
+        if value is None:
+            output(f"{pad}{name}: null")
+            continue
+
+        items = value if isinstance(value, (list, tuple, set)) else [value]
+        if not items:
+            output(f"{pad}{name}: []")
+            continue
+
+        output(f"{pad}{name}:")
+        for item in items:
+            if id(item) in path:
+                output(f"{pad}  - <cycle {type(item).__name__}>")
+                continue
+            output(f"{pad}  - {type(item).__name__}")
+            dump_object(item, file, max_depth - 1, skip_recurse, progress_bar, indent + 4, path)
+
+
+def dump_table(db, table, path: str, max_depth: int = DEFAULT_DUMP_DEPTH, skip_recurse: Iterable[str] = (), yield_per: int = 500) -> int:
+    """
+    Stream every row of a table through dump_object into one file.
+
+    Args:
+        db (Rekordbox6Database): An open database handle.
+        table: The mapped table class to dump.
+        path (str): The output file.
+        max_depth (int): How many relationship levels to follow per row.
+        skip_recurse (Iterable[str]): Relationship names never followed.
+        yield_per (int): Rows fetched from the cursor at a time.
+
+    Returns:
+        int: The number of rows dumped.
+    """
+    skip_recurse = frozenset(skip_recurse)
+    rows = 0
+
+    with open(path, "w", encoding="utf-8") as f, alive_bar(title=f"Dumping {table.__tablename__}") as bar:
+        for obj in db.query(table).yield_per(yield_per):
+            f.write(f"- {type(obj).__name__}\n")
+            dump_object(obj, file=f, max_depth=max_depth, skip_recurse=skip_recurse, progress_bar=bar, indent=2)
+            rows += 1
+
+    return rows
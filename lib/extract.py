@@ -0,0 +1,206 @@
+import logging
+from collections import defaultdict
+from typing import Any, Dict, Iterator, List, Optional, Sequence, Tuple
+
+from pyrekordbox.db6 import tables
+from sqlalchemy import Text, func, type_coerce
+
+from lib.bulk import SQLITE_MAX_VARIABLES, chunked
+from lib.timestamps import format_timestamp, parse_timestamp
+
+logger = logging.getLogger(__name__)
+
+# Number of rows fetched from the cursor at a time while streaming
+YIELD_PER = 2000
+
+
+def count_songs(db) -> int:
+    """Return the number of rows in djmdContent without loading them."""
+    return db.query(func.count(tables.DjmdContent.ID)).scalar() or 0
+
+
+def load_my_tags(db, content_ids: Optional[Sequence[str]] = None) -> Dict[str, Tuple[List[str], List[str]]]:
+    """
+    Load every MyTag link in one joined query.
+
+    Args:
+        db (Rekordbox6Database): An open database handle.
+        content_ids (Optional[Sequence[str]]): Only load the tags of these songs.
+
+    Returns:
+        Dict[str, Tuple[List[str], List[str]]]: Mapping of content ID to its
+        (MyTagIDs, MyTagNames) lists.
+    """
+    my_tags = defaultdict(lambda: ([], []))
+
+    query = db.query(
+        tables.DjmdSongMyTag.ContentID,
+        tables.DjmdSongMyTag.MyTagID,
+        tables.DjmdMyTag.Name,
+    ).outerjoin(tables.DjmdMyTag, tables.DjmdMyTag.ID == tables.DjmdSongMyTag.MyTagID)
+
+    if content_ids is None:
+        queries = [query]
+    else:
+        queries = [
+            query.filter(tables.DjmdSongMyTag.ContentID.in_(batch))
+            for batch in chunked(content_ids, SQLITE_MAX_VARIABLES)
+        ]
+
+    for batch_query in queries:
+        for content_id, tag_id, tag_name in batch_query.yield_per(YIELD_PER):
+            tag_ids, tag_names = my_tags[content_id]
+            tag_ids.append(tag_id)
+            tag_names.append(tag_name)
+
+    return dict(my_tags)
+
+
+def song_rows_query(db):
+    """
+    Build a query selecting only the djmdContent columns the dedup pipeline uses.
+
+    Artist and album names come from explicit outer joins instead of the
+    association proxies on DjmdContent, which would lazy-load per row.
+    created_at is read as the raw stored text and parsed once by song_record.
+    """
+    content = tables.DjmdContent
+
+    return db.query(
+        content.ID,
+        type_coerce(content.created_at, Text).label("created_at"),
+        content.Title,
+        content.AlbumID,
+        tables.DjmdAlbum.Name.label("AlbumName"),
+        tables.DjmdArtist.Name.label("ArtistName"),
+        content.ArtistID,
+        content.FolderPath,
+        content.BPM,
+        content.BitRate,
+        content.Length,
+    ).outerjoin(tables.DjmdArtist, tables.DjmdArtist.ID == content.ArtistID)\
+     .outerjoin(tables.DjmdAlbum, tables.DjmdAlbum.ID == content.AlbumID)
+
+
+def song_record(row, index: int, my_tags: Dict[str, Tuple[List[str], List[str]]]) -> Dict[str, Any]:
+    """
+    Build one `content_list` record from a song_rows_query row.
+
+    created_at is carried as epoch milliseconds (None if unparseable); use
+    format_song_record to turn it back into a date string for output files.
+    """
+    tag_ids, tag_names = my_tags.get(row.ID, ([], []))
+
+    return {
+        "ID": row.ID,
+        "index": index,
+        "created_at": parse_timestamp(row.created_at),
+        "Title": row.Title,
+        "AlbumID": row.AlbumID,
+        "AlbumName": row.AlbumName,
+        "ArtistName": row.ArtistName,
+        "ArtistID": row.ArtistID,
+        "FolderPath": row.FolderPath,
+        "BPM": row.BPM,
+        "BitRate": row.BitRate,
+        "Length": row.Length,
+        "FullName": f"{row.ArtistName} - {row.Title}",
+        "MyTagIDs": list(tag_ids),
+        "MyTagNames": list(tag_names)
+    }
+
+
+def iter_song_records(db, content_ids: Optional[Sequence[str]] = None) -> Iterator[Dict[str, Any]]:
+    """
+    Stream song records in the `content_list` format used by the dedup pipeline.
+
+    Args:
+        db (Rekordbox6Database): An open database handle.
+        content_ids (Optional[Sequence[str]]): Only extract these songs, queried in
+            batches. The "index" of such records is their position in the batch order.
+
+    Yields:
+        Dict[str, Any]: One record per djmdContent row, in table order.
+    """
+    my_tags = load_my_tags(db, content_ids)
+
+    if content_ids is None:
+        queries = [song_rows_query(db)]
+    else:
+        queries = [
+            song_rows_query(db).filter(tables.DjmdContent.ID.in_(batch))
+            for batch in chunked(content_ids, SQLITE_MAX_VARIABLES)
+        ]
+
+    index = 0
+    unparseable = 0
+    for query in queries:
+        for row in query.yield_per(YIELD_PER):
+            record = song_record(row, index, my_tags)
+            if record["created_at"] is None:
+                unparseable += 1
+            yield record
+            index += 1
+
+    if unparseable:
+        logger.warning(f"{unparseable} songs have no parseable created_at and are ignored by the date rule")
+
+
+def format_song_record(record: Dict[str, Any]) -> Dict[str, Any]:
+    """Return a copy of a song record with created_at formatted for JSON/YAML output."""
+    return dict(record, created_at=format_timestamp(record["created_at"]))
+
+
+def count_playlists(db) -> int:
+    """Return the number of rows in djmdPlaylist without loading them."""
+    return db.query(func.count(tables.DjmdPlaylist.ID)).scalar() or 0
+
+
+def iter_playlist_records(db) -> Iterator[Dict[str, Any]]:
+    """
+    Stream playlist records with their song IDs in track order.
+
+    Playlists and all playlist memberships are read with one query each, both
+    sorted by playlist ID, and merged in a single pass. Content objects are never
+    loaded; entries pointing at a missing song are reported as "No ID".
+
+    Args:
+        db (Rekordbox6Database): An open database handle.
+
+    Yields:
+        Dict[str, Any]: One record per djmdPlaylist row, ordered by playlist ID.
+    """
+    song_playlist = tables.DjmdSongPlaylist
+
+    playlists = db.query(
+        tables.DjmdPlaylist.ID,
+        tables.DjmdPlaylist.Name,
+        tables.DjmdPlaylist.Attribute,
+    ).order_by(tables.DjmdPlaylist.ID)
+
+    memberships = db.query(
+        song_playlist.PlaylistID,
+        tables.DjmdContent.ID,
+    ).outerjoin(tables.DjmdContent, tables.DjmdContent.ID == song_playlist.ContentID)\
+     .order_by(song_playlist.PlaylistID, song_playlist.TrackNo, song_playlist.ID)
+
+    membership_rows = iter(memberships.yield_per(YIELD_PER))
+    pending = next(membership_rows, None)
+
+    for index, playlist in enumerate(playlists.yield_per(YIELD_PER)):
+        # Skip memberships of playlists that no longer exist
+        while pending is not None and (pending.PlaylistID is None or pending.PlaylistID < playlist.ID):
+            pending = next(membership_rows, None)
+
+        song_ids = []
+        while pending is not None and pending.PlaylistID == playlist.ID:
+            song_ids.append(pending.ID if pending.ID is not None else "No ID")
+            pending = next(membership_rows, None)
+
+        yield {
+            "ID": playlist.ID,
+            "index": index,
+            "Name": playlist.Name,
+            "Attribute": playlist.Attribute,
+            "SongIDs": song_ids
+        }
@@ -0,0 +1,277 @@
+import logging
+import os
+import shutil
+import sqlite3
+import subprocess
+import wave
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from typing import Dict, Iterable, List, Optional
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+SAMPLE_RATE = 11025
+WINDOW_SECONDS = 30
+FRAME_SIZE = 4096
+HOP_SIZE = FRAME_SIZE // 3
+# Band edges in Hz for the 33 bands that give 32 bits per frame
+BAND_EDGES = np.geomspace(300, 2000, 34)
+
+# Lookup and verification settings
+MIN_SHARED_HASHES = 3
+MAX_BIT_ERROR_RATE = 0.35
+MAX_OFFSET_FRAMES = 8
+# Sub-fingerprints shared by more files than this carry no information (silence)
+MAX_HASH_POSTINGS = 50
+
+
+def decode_window(path: str, seconds: int = WINDOW_SECONDS) -> Optional[np.ndarray]:
+    """
+    Decode the first `seconds` of a file to mono 11025 Hz floats.
+
+    ffmpeg is used when it is on the PATH. Without it only WAV files can be read.
+
+    Args:
+        path (str): The audio file.
+        seconds (int): Length of the decoded window.
+
+    Returns:
+        Optional[np.ndarray]: The samples, or None if the file could not be decoded.
+    """
+    if shutil.which("ffmpeg"):
+        command = [
+            "ffmpeg", "-v", "quiet", "-t", str(seconds), "-i", path,
+            "-ac", "1", "-ar", str(SAMPLE_RATE), "-f", "s16le", "-",
+        ]
+        try:
+            raw = subprocess.run(command, capture_output=True, check=True).stdout
+        except (OSError, subprocess.CalledProcessError):
+            return None
+        return np.frombuffer(raw, dtype="<i2").astype(np.float32) / 32768
+
+    if not path.lower().endswith(".wav"):
+        return None
+
+    try:
+        with wave.open(path, "rb") as w:
+            if w.getsampwidth() != 2:
+                return None
+            channels, rate = w.getnchannels(), w.getframerate()
+            raw = w.readframes(rate * seconds)
+    except (OSError, wave.Error, EOFError):
+        return None
+
+    samples = np.frombuffer(raw, dtype="<i2").astype(np.float32) / 32768
+    samples = samples[: len(samples) - len(samples) % channels].reshape(-1, channels).mean(axis=1)
+
+    # Nearest-sample resampling is enough for band energies
+    positions = np.arange(0, len(samples), rate / SAMPLE_RATE).astype(np.int64)
+    return samples[positions[positions < len(samples)]]
+
+
+def compute_fingerprint(samples: np.ndarray) -> np.ndarray:
+    """
+    Compute a compact fingerprint of 32-bit sub-fingerprints, one per frame.
+
+    Each bit encodes the sign of the energy difference between neighbouring
+    frequency bands, compared with the previous frame (Haitsma-Kalker scheme).
+    Volume changes and re-encoding leave most bits unchanged.
+
+    Args:
+        samples (np.ndarray): Mono samples at SAMPLE_RATE.
+
+    Returns:
+        np.ndarray: uint32 sub-fingerprints, empty for very short input.
+    """
+    if samples is None or len(samples) < FRAME_SIZE + HOP_SIZE:
+        return np.zeros(0, dtype=np.uint32)
+
+    frame_count = 1 + (len(samples) - FRAME_SIZE) // HOP_SIZE
+    indexes = np.arange(FRAME_SIZE)[None, :] + HOP_SIZE * np.arange(frame_count)[:, None]
+    spectrum = np.abs(np.fft.rfft(samples[indexes] * np.hanning(FRAME_SIZE), axis=1)) ** 2
+
+    bins = np.fft.rfftfreq(FRAME_SIZE, 1 / SAMPLE_RATE)
+    band_of_bin = np.digitize(bins, BAND_EDGES) - 1
+    energies = np.zeros((frame_count, len(BAND_EDGES) - 1))
+    for band in range(len(BAND_EDGES) - 1):
+        energies[:, band] = spectrum[:, band_of_bin == band].sum(axis=1)
+
+    band_differences = energies[:, :-1] - energies[:, 1:]
+    bits = (band_differences[1:] - band_differences[:-1]) > 0
+
+    weights = (1 << np.arange(32, dtype=np.uint64))
+    return (bits.astype(np.uint64) * weights).sum(axis=1).astype(np.uint32)
+
+
+def fingerprint_file(path: str) -> Optional[bytes]:
+    """Decode and fingerprint one file; runs in worker processes."""
+    fingerprint = compute_fingerprint(decode_window(path))
+    return fingerprint.tobytes() if len(fingerprint) else None
+
+
+def bit_error_rate(a: np.ndarray, b: np.ndarray, max_offset: int = MAX_OFFSET_FRAMES) -> float:
+    """
+    Return the lowest fraction of differing bits between two fingerprints over small offsets.
+    """
+    best = 1.0
+    for offset in range(-max_offset, max_offset + 1):
+        x = a[max(offset, 0):]
+        y = b[max(-offset, 0):]
+        length = min(len(x), len(y))
+        if length < 16:
+            continue
+        differing = np.unpackbits((x[:length] ^ y[:length]).view(np.uint8)).sum()
+        best = min(best, differing / (length * 32))
+    return best
+
+
+class FingerprintIndex:
+    """
+    Persistent fingerprint store keyed by path, size and modification time.
+
+    Fingerprints live in a local SQLite file, so a rerun only decodes files that
+    are new or changed since the last run.
+
+    Args:
+        path (str): The SQLite index file.
+    """
+
+    def __init__(self, path: str = "./data/fingerprints.db"):
+        self.connection = sqlite3.connect(path)
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS fingerprints ("
+            "path TEXT PRIMARY KEY, size INTEGER NOT NULL, mtime_ns INTEGER NOT NULL, fingerprint BLOB)"
+        )
+
+    def close(self):
+        self.connection.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def stale_paths(self, paths: Iterable[str]) -> Dict[str, os.stat_result]:
+        """Return the existing files whose stored fingerprint is missing or outdated; songs without a path are skipped."""
+        stored = {
+            path: (size, mtime_ns)
+            for path, size, mtime_ns in self.connection.execute("SELECT path, size, mtime_ns FROM fingerprints")
+        }
+
+        stale = {}
+        for path in paths:
+            if not path:
+                continue
+            try:
+                stat = os.stat(path)
+            except (OSError, ValueError):
+                continue
+            if stored.get(path) != (stat.st_size, stat.st_mtime_ns):
+                stale[path] = stat
+        return stale
+
+    def update(self, paths: Iterable[str], workers: Optional[int] = None, progress_bar=None,
+               stale: Optional[Dict[str, os.stat_result]] = None) -> int:
+        """
+        Fingerprint new or changed files in a process pool and store the results.
+
+        Args:
+            paths (Iterable[str]): Files that should be in the index.
+            workers (Optional[int]): Worker processes, defaults to the CPU count.
+            progress_bar: Optional alive-progress bar, advanced once per file.
+            stale (Optional[Dict[str, os.stat_result]]): The result of stale_paths for
+                `paths` if the caller already has it, so no file is stat'ed twice.
+
+        Returns:
+            int: The number of files fingerprinted.
+        """
+        if stale is None:
+            stale = self.stale_paths(paths)
+        if not stale:
+            return 0
+
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            futures = {executor.submit(fingerprint_file, path): path for path in stale}
+            for future in as_completed(futures):
+                path = futures[future]
+                try:
+                    fingerprint = future.result()
+                except Exception as e:
+                    logger.warning(f"Could not fingerprint {path}: {e}")
+                    fingerprint = None
+
+                stat = stale[path]
+                self.connection.execute(
+                    "INSERT OR REPLACE INTO fingerprints (path, size, mtime_ns, fingerprint) VALUES (?, ?, ?, ?)",
+                    (path, stat.st_size, stat.st_mtime_ns, fingerprint),
+                )
+                if progress_bar is not None:
+                    progress_bar()
+
+        self.connection.commit()
+        return len(stale)
+
+    def load(self, paths: Iterable[str]) -> Dict[str, np.ndarray]:
+        """Return the stored fingerprints of the given paths."""
+        wanted = set(paths)
+        return {
+            path: np.frombuffer(blob, dtype=np.uint32)
+            for path, blob in self.connection.execute("SELECT path, fingerprint FROM fingerprints WHERE fingerprint IS NOT NULL")
+            if path in wanted
+        }
+
+    def group_paths(self, paths: List[str]) -> List[List[int]]:
+        """
+        Group paths whose audio matches, as lists of positions in `paths`.
+
+        Candidates are found through an inverted index of exact sub-fingerprint
+        values, so only files sharing at least MIN_SHARED_HASHES of them are
+        compared bit by bit.
+
+        Args:
+            paths (List[str]): The paths to group, e.g. FolderPath of every song.
+
+        Returns:
+            List[List[int]]: Groups of positions with matching audio.
+        """
+        fingerprints = self.load(paths)
+        positions = defaultdict(list)
+        for position, path in enumerate(paths):
+            if path in fingerprints:
+                positions[path].append(position)
+
+        items = list(fingerprints.items())
+        postings = defaultdict(list)
+        for item, (_, fingerprint) in enumerate(items):
+            for value in set(fingerprint.tolist()):
+                postings[value].append(item)
+
+        shared = defaultdict(int)
+        for posting in postings.values():
+            if 1 < len(posting) <= MAX_HASH_POSTINGS:
+                for i, a in enumerate(posting):
+                    for b in posting[i + 1:]:
+                        shared[(a, b)] += 1
+
+        parent = list(range(len(items)))
+
+        def find(i):
+            while parent[i] != i:
+                parent[i] = parent[parent[i]]
+                i = parent[i]
+            return i
+
+        for (a, b), count in shared.items():
+            if count >= MIN_SHARED_HASHES and find(a) != find(b):
+                if bit_error_rate(items[a][1], items[b][1]) <= MAX_BIT_ERROR_RATE:
+                    parent[find(b)] = find(a)
+
+        # Files listed under several songs are duplicates of each other as well
+        groups = defaultdict(list)
+        for item, (path, _) in enumerate(items):
+            groups[find(item)].extend(positions[path])
+
+        return sorted(sorted(group) for group in groups.values() if len(group) > 1)
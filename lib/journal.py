@@ -0,0 +1,230 @@
+import json
+import logging
+import sqlite3
+from collections import defaultdict
+from datetime import datetime
+from typing import Any, Dict, Iterable, List, NamedTuple, Optional, Set, Tuple
+
+from lib.bulk import chunked
+
+logger = logging.getLogger(__name__)
+
+# Number of duplicate songs handled per journaled batch
+JOURNAL_BATCH_SIZE = 500
+
+# Steps of a deduplication run, in execution order
+STEPS = ("replace", "compact", "merge", "move", "remove")
+
+
+class PlanEntry(NamedTuple):
+    """One duplicate song of a run: its ID, the song replacing it and its file."""
+    old_id: str
+    new_id: str
+    path: Optional[str]
+
+
+class Journal:
+    """
+    Write-ahead journal of deduplication runs in a local SQLite file.
+
+    A run stores the planned mapping up front. Each step (see STEPS) then works
+    through the plan in fixed batches of JOURNAL_BATCH_SIZE entries and marks a
+    batch complete only after its changes are committed, so an interrupted run
+    can resume at the first unfinished batch. Complete djmdSongPlaylist rows are
+    recorded before they are rewritten, renumbered or collapsed, the merged fields
+    of kept songs before the metadata merge, and file moves as they happen, which
+    is what rollback undoes.
+
+    When the database is an in-memory working copy, `hold_marks` keeps completed
+    batches out of the file until `release_marks`, which is called once the copy
+    has been written back; a crash in between then redoes the batches instead of
+    skipping changes that never reached master.db.
+
+    Args:
+        path (str): The SQLite journal file.
+    """
+
+    def __init__(self, path: str = "./data/journal.db"):
+        self.connection = sqlite3.connect(path)
+        self.connection.executescript(
+            "CREATE TABLE IF NOT EXISTS runs ("
+            "id INTEGER PRIMARY KEY AUTOINCREMENT, created_at TEXT NOT NULL, status TEXT NOT NULL, backup_folder TEXT);"
+            "CREATE TABLE IF NOT EXISTS plan ("
+            "run_id INTEGER NOT NULL, position INTEGER NOT NULL, old_id TEXT NOT NULL, new_id TEXT NOT NULL, path TEXT, "
+            "PRIMARY KEY (run_id, position));"
+            "CREATE TABLE IF NOT EXISTS batches ("
+            "run_id INTEGER NOT NULL, step TEXT NOT NULL, batch INTEGER NOT NULL, completed_at TEXT NOT NULL, "
+            "PRIMARY KEY (run_id, step, batch));"
+            "CREATE TABLE IF NOT EXISTS playlist_rows ("
+            "run_id INTEGER NOT NULL, entry_id TEXT NOT NULL, playlist_id TEXT, row TEXT NOT NULL, "
+            "PRIMARY KEY (run_id, entry_id));"
+            "CREATE TABLE IF NOT EXISTS moves ("
+            "run_id INTEGER NOT NULL, source TEXT NOT NULL, destination TEXT NOT NULL, "
+            "PRIMARY KEY (run_id, source));"
+            "CREATE TABLE IF NOT EXISTS merged_songs ("
+            "run_id INTEGER NOT NULL, content_id TEXT NOT NULL, row TEXT NOT NULL, "
+            "PRIMARY KEY (run_id, content_id));"
+            "CREATE TABLE IF NOT EXISTS merged_rows ("
+            "run_id INTEGER NOT NULL, table_name TEXT NOT NULL, row_id TEXT NOT NULL, "
+            "PRIMARY KEY (run_id, table_name, row_id));"
+        )
+        self.holding = False
+        self.held: List[Tuple[int, str, int, str]] = []
+
+    def close(self):
+        self.connection.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def start_run(self, plan: Iterable[PlanEntry], backup_folder: Optional[str]) -> int:
+        """Store a new run and its plan, returning the run ID."""
+        with self.connection:
+            cursor = self.connection.execute(
+                "INSERT INTO runs (created_at, status, backup_folder) VALUES (?, 'running', ?)",
+                (datetime.now().isoformat(timespec="seconds"), backup_folder),
+            )
+            run_id = cursor.lastrowid
+            self.connection.executemany(
+                "INSERT INTO plan (run_id, position, old_id, new_id, path) VALUES (?, ?, ?, ?, ?)",
+                ((run_id, position, *entry) for position, entry in enumerate(plan)),
+            )
+        return run_id
+
+    def latest_run(self, status: Optional[str] = None) -> Optional[Tuple[int, str, Optional[str]]]:
+        """Return (id, status, backup_folder) of the newest run, optionally with the given status."""
+        query = "SELECT id, status, backup_folder FROM runs"
+        params: tuple = ()
+        if status is not None:
+            query += " WHERE status = ?"
+            params = (status,)
+        return self.connection.execute(query + " ORDER BY id DESC LIMIT 1", params).fetchone()
+
+    def set_status(self, run_id: int, status: str):
+        with self.connection:
+            self.connection.execute("UPDATE runs SET status = ? WHERE id = ?", (status, run_id))
+
+    def load_plan(self, run_id: int) -> List[PlanEntry]:
+        rows = self.connection.execute(
+            "SELECT old_id, new_id, path FROM plan WHERE run_id = ? ORDER BY position", (run_id,)
+        )
+        return [PlanEntry(*row) for row in rows]
+
+    def batches(self, run_id: int) -> List[List[PlanEntry]]:
+        """Split the plan into the fixed batches every step works through."""
+        return list(chunked(self.load_plan(run_id), JOURNAL_BATCH_SIZE))
+
+    def is_done(self, run_id: int, step: str, batch: int) -> bool:
+        if any(held[:3] == (run_id, step, batch) for held in self.held):
+            return True
+        return self.connection.execute(
+            "SELECT 1 FROM batches WHERE run_id = ? AND step = ? AND batch = ?", (run_id, step, batch)
+        ).fetchone() is not None
+
+    def mark_done(self, run_id: int, step: str, batch: int):
+        mark = (run_id, step, batch, datetime.now().isoformat(timespec="seconds"))
+        if self.holding:
+            self.held.append(mark)
+            return
+        with self.connection:
+            self.connection.execute(
+                "INSERT OR REPLACE INTO batches (run_id, step, batch, completed_at) VALUES (?, ?, ?, ?)", mark
+            )
+
+    def hold_marks(self):
+        """Keep completed batches in memory until release_marks."""
+        self.holding = True
+
+    def release_marks(self):
+        """Store the batches completed since hold_marks, or the last release."""
+        with self.connection:
+            self.connection.executemany(
+                "INSERT OR REPLACE INTO batches (run_id, step, batch, completed_at) VALUES (?, ?, ?, ?)", self.held
+            )
+        self.held = []
+
+    def completed_batches(self, run_id: int, step: str) -> int:
+        return self.connection.execute(
+            "SELECT COUNT(*) FROM batches WHERE run_id = ? AND step = ?", (run_id, step)
+        ).fetchone()[0]
+
+    def record_playlist_rows(self, run_id: int, rows: Iterable[Dict[str, Any]]):
+        """
+        Store djmdSongPlaylist rows before they change.
+
+        Existing records win, so redoing a batch after a crash keeps the original values.
+
+        Args:
+            run_id (int): The run.
+            rows (Iterable[Dict[str, Any]]): Complete rows as column -> value.
+        """
+        with self.connection:
+            self.connection.executemany(
+                "INSERT OR IGNORE INTO playlist_rows (run_id, entry_id, playlist_id, row) VALUES (?, ?, ?, ?)",
+                ((run_id, row["ID"], row["PlaylistID"], json.dumps(row)) for row in rows),
+            )
+
+    def playlist_rows(self, run_id: int) -> List[Dict[str, Any]]:
+        return [json.loads(row) for row, in self.connection.execute("SELECT row FROM playlist_rows WHERE run_id = ?", (run_id,))]
+
+    def touched_playlists(self, run_id: int) -> Set[str]:
+        """Return the IDs of the playlists the run has recorded rows of."""
+        return {
+            playlist_id for playlist_id, in self.connection.execute(
+                "SELECT DISTINCT playlist_id FROM playlist_rows WHERE run_id = ?", (run_id,)
+            )
+        }
+
+    def remapped_entries(self, run_id: int) -> Dict[str, str]:
+        """Return entry ID -> original ContentID of the playlist entries the replace step rewrote."""
+        return dict(self.connection.execute(
+            "SELECT entry_id, json_extract(row, '$.ContentID') FROM playlist_rows WHERE run_id = ? "
+            "AND json_extract(row, '$.ContentID') IN (SELECT old_id FROM plan WHERE run_id = ?)",
+            (run_id, run_id),
+        ))
+
+    def record_move(self, run_id: int, source: str, destination: str):
+        with self.connection:
+            self.connection.execute(
+                "INSERT OR REPLACE INTO moves (run_id, source, destination) VALUES (?, ?, ?)",
+                (run_id, source, destination),
+            )
+
+    def moves(self, run_id: int) -> Dict[str, str]:
+        """Return source -> destination of every file moved by the run."""
+        return dict(self.connection.execute("SELECT source, destination FROM moves WHERE run_id = ?", (run_id,)))
+
+    def forget_moves(self, run_id: int, sources: Iterable[str]):
+        with self.connection:
+            self.connection.executemany(
+                "DELETE FROM moves WHERE run_id = ? AND source = ?", ((run_id, source) for source in sources)
+            )
+
+    def record_merged_songs(self, run_id: int, rows: Iterable[Dict[str, Any]]):
+        """Store the merged fields of kept songs before the merge changes them; existing records win."""
+        with self.connection:
+            self.connection.executemany(
+                "INSERT OR IGNORE INTO merged_songs (run_id, content_id, row) VALUES (?, ?, ?)",
+                ((run_id, row["ID"], json.dumps(row)) for row in rows),
+            )
+
+    def merged_songs(self, run_id: int) -> List[Dict[str, Any]]:
+        return [json.loads(row) for row, in self.connection.execute("SELECT row FROM merged_songs WHERE run_id = ?", (run_id,))]
+
+    def record_merged_rows(self, run_id: int, table: str, row_ids: Iterable[str]):
+        """Store the IDs of cue or MyTag rows created by the merge."""
+        with self.connection:
+            self.connection.executemany(
+                "INSERT OR IGNORE INTO merged_rows (run_id, table_name, row_id) VALUES (?, ?, ?)",
+                ((run_id, table, row_id) for row_id in row_ids),
+            )
+
+    def merged_rows(self, run_id: int) -> Dict[str, Set[str]]:
+        """Return table -> IDs of the rows created by the run's merge."""
+        rows = defaultdict(set)
+        for table, row_id in self.connection.execute("SELECT table_name, row_id FROM merged_rows WHERE run_id = ?", (run_id,)):
+            rows[table].add(row_id)
+        return dict(rows)
@@ -0,0 +1,51 @@
+import json
+from typing import Any, Callable, Optional
+
+
+class JsonArrayWriter:
+    """
+    Write a JSON array to a file one element at a time.
+
+    The output matches `json.dump(items, f, indent=indent)`, but only the element
+    being written has to be held in memory.
+
+    An optional `formatter` is applied to each element just before it is serialized.
+
+    Usage:
+        with JsonArrayWriter("./data/playlist_data.json") as writer:
+            for item in items:
+                writer.write(item)
+    """
+
+    def __init__(self, path: str, indent: Optional[int] = 4, formatter: Optional[Callable[[Any], Any]] = None):
+        self.path = path
+        self.indent = indent
+        self.formatter = formatter
+        self.count = 0
+        self._file = None
+
+    def __enter__(self):
+        self._file = open(self.path, "w", encoding="utf-8")
+        self._file.write("[")
+        return self
+
+    def write(self, item: Any):
+        """Serialize one element and append it to the array."""
+        if self.formatter is not None:
+            item = self.formatter(item)
+        text = json.dumps(item, indent=self.indent)
+
+        if self.indent is None:
+            self._file.write((", " if self.count else "") + text)
+        else:
+            pad = " " * self.indent
+            self._file.write(("," if self.count else "") + "\n" + pad + text.replace("\n", "\n" + pad))
+
+        self.count += 1
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        if self.count and self.indent is not None:
+            self._file.write("\n")
+        self._file.write("]")
+        self._file.close()
+        self._file = None
@@ -0,0 +1,186 @@
+import csv
+import json
+import os
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Iterable, Iterator, List, NamedTuple, Optional, Set, Tuple
+
+from pyrekordbox.db6 import tables
+
+from lib.extract import YIELD_PER
+
+DEFAULT_DEPTH = 4
+DEFAULT_WORKERS = 16
+
+
+class LocationStat(NamedTuple):
+    """Aggregated numbers for one directory prefix."""
+    path: str
+    depth: int
+    count: int
+    size: int
+    files: int
+    missing: Optional[int]
+
+
+class _Node:
+    __slots__ = ("children", "count", "size", "files", "missing")
+
+    def __init__(self):
+        self.children: Dict[str, "_Node"] = {}
+        self.count = 0
+        self.size = 0
+        self.files = 0
+        self.missing = 0
+
+
+def split_path(path: str) -> List[str]:
+    """
+    Split a FolderPath into its directory components, dropping the file name.
+
+    Backslashes are treated as separators. An absolute POSIX path keeps an empty
+    first component, so "/Users/me/a.mp3" has the same depths as the old
+    get_major_location split.
+    """
+    return path.replace("\\", "/").split("/")[:-1]
+
+
+def iter_folder_paths(db) -> Iterator[Tuple[str, int]]:
+    """Stream (FolderPath, FileSize) of every song without loading DjmdContent objects."""
+    query = db.query(tables.DjmdContent.FolderPath, tables.DjmdContent.FileSize)
+    for path, size in query.yield_per(YIELD_PER):
+        if path:
+            yield path, size or 0
+
+
+class PathTrie:
+    """
+    Prefix tree of directories with song counts and file sizes at every level.
+
+    Every node holds the totals of everything below it, plus the number of songs
+    directly inside it, so any depth can be reported from one pass over the paths.
+    """
+
+    def __init__(self):
+        self.root = _Node()
+        self.checked = False
+
+    def add(self, path: str, size: int = 0, exists: Optional[bool] = None):
+        if exists is not None:
+            self.checked = True
+        missing = 1 if exists is False else 0
+
+        node = self.root
+        node.count += 1
+        node.size += size
+        node.missing += missing
+        for part in split_path(path):
+            child = node.children.get(part)
+            if child is None:
+                child = node.children[part] = _Node()
+            node = child
+            node.count += 1
+            node.size += size
+            node.missing += missing
+        node.files += 1
+
+    def mark_missing(self, paths: Iterable[str]):
+        """
+        Count files already added as missing, once their existence has been checked.
+
+        Lets the trie be built while the paths stream in and the check run afterwards.
+        """
+        self.checked = True
+        for path in paths:
+            node = self.root
+            node.missing += 1
+            for part in split_path(path):
+                node = node.children[part]
+                node.missing += 1
+
+    def _stat(self, parts: Tuple[str, ...], node: _Node, count: Optional[int] = None) -> LocationStat:
+        return LocationStat(
+            path="/".join(parts) or "/",
+            depth=len(parts),
+            count=node.count if count is None else count,
+            size=node.size,
+            files=node.files,
+            missing=node.missing if self.checked else None,
+        )
+
+    def walk(self, max_depth: Optional[int] = None) -> Iterator[LocationStat]:
+        """Yield every directory down to `max_depth`, parents before children."""
+        stack = [((), self.root)]
+        while stack:
+            parts, node = stack.pop()
+            if parts:
+                yield self._stat(parts, node)
+            if max_depth is not None and len(parts) >= max_depth:
+                continue
+            for name in sorted(node.children, reverse=True):
+                stack.append((parts + (name,), node.children[name]))
+
+    def at_depth(self, depth: int) -> List[LocationStat]:
+        """
+        Partition the library at `depth`: every directory at that depth, plus the
+        shallower directories that hold songs directly (counted by those songs only).
+        """
+        result = []
+        stack = [((), self.root)]
+        while stack:
+            parts, node = stack.pop()
+            if len(parts) == depth:
+                result.append(self._stat(parts, node))
+                continue
+            if parts and node.files:
+                result.append(self._stat(parts, node, count=node.files))
+            for name, child in node.children.items():
+                stack.append((parts + (name,), child))
+        return result
+
+
+def _list_directory(directory: str) -> Optional[Set[str]]:
+    try:
+        return {os.path.normcase(name) for name in os.listdir(directory or "/")}
+    except OSError:
+        return None
+
+
+def check_exists(paths: Iterable[str], workers: int = DEFAULT_WORKERS) -> Dict[str, bool]:
+    """
+    Check which files exist, listing each directory once in a thread pool.
+
+    Grouping by directory turns one stat per file into one listdir per folder,
+    which matters most on network drives and external disks.
+
+    Args:
+        paths (Iterable[str]): File paths.
+        workers (int): Number of directories listed concurrently.
+
+    Returns:
+        Dict[str, bool]: Existence of every path.
+    """
+    by_directory = defaultdict(list)
+    for path in paths:
+        directory, _, name = path.replace("\\", "/").rpartition("/")
+        by_directory[directory].append((path, name))
+
+    directories = list(by_directory)
+    exists = {}
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        for directory, names in zip(directories, executor.map(_list_directory, directories)):
+            for path, name in by_directory[directory]:
+                exists[path] = names is not None and os.path.normcase(name) in names
+    return exists
+
+
+def export_json(stats: Iterable[LocationStat], path: str):
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump([stat._asdict() for stat in stats], f, indent=4)
+
+
+def export_csv(stats: Iterable[LocationStat], path: str):
+    with open(path, "w", encoding="utf-8", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(LocationStat._fields)
+        writer.writerows(stats)
@@ -0,0 +1,313 @@
+import bisect
+import heapq
+import re
+import sys
+import unicodedata
+from collections import defaultdict
+from typing import Any, Dict, FrozenSet, List, Optional, Sequence, Tuple
+
+from lib.columnar import group_by_key
+
+# Bracketed or dash-separated suffixes that do not make a different recording
+_IGNORED_SUFFIX = re.compile(
+    r"^(original( mix| version)?|(\d{4} )?remaster(ed)?( \d{4})?( version)?|album version|explicit|clean|dirty)$"
+)
+_FEATURING = re.compile(r"\b(?:feat|ft|featuring)\b\.?\s*(.*)$")
+# A featuring clause inside the title itself: "feat." / "ft." with their dot or
+# "featuring", after some title text and followed by a name
+_INLINE_FEATURING = re.compile(r"(?<=\S)\s+(?:feat\.|ft\.|featuring\s)\s*(\S.*)$")
+_BRACKETED = re.compile(r"[\(\[]([^\)\]]*)[\)\]]")
+_ARTIST_SEPARATORS = re.compile(r"\s*[,&/;+]\s*|\s+(?:x|and|vs\.?|with|feat\.?|ft\.?|featuring)\s+")
+_NON_WORD = re.compile(r"[^\w]+")
+
+# Songs of a title block scored against one anchor at most
+MAX_CANDIDATES = 256
+# Share of a pair score that comes from the artists
+ARTIST_WEIGHT = 0.6
+
+
+def _fold(text: Optional[str]) -> str:
+    """Lower-case and strip accents."""
+    text = unicodedata.normalize("NFKD", text or "")
+    return "".join(c for c in text if not unicodedata.combining(c)).casefold()
+
+
+def _tokens(text: str) -> str:
+    """Collapse punctuation and whitespace to single spaces."""
+    return " ".join(_NON_WORD.sub(" ", text).split())
+
+
+def split_artists(artist: Optional[str]) -> FrozenSet[str]:
+    """
+    Split an artist field into normalized artist names.
+
+    "A feat. B", "B & A" and "A, B" all give {"a", "b"}.
+    """
+    names = (_tokens(name) for name in _ARTIST_SEPARATORS.split(_fold(artist)))
+    return frozenset(name for name in names if name)
+
+
+def normalize_title(title: Optional[str]) -> Tuple[str, FrozenSet[str]]:
+    """
+    Normalize a title and pull out any featured artists it names.
+
+    Case, accents and punctuation are ignored, and suffixes such as "(Original Mix)"
+    or "- 2011 Remaster" are dropped. Mix names that mark a different recording,
+    e.g. "(Extended Mix)", are kept. A featuring clause is only taken from brackets,
+    after " - " or as "feat." / "ft." / "featuring" following the title, so titles
+    like "Feat of Clay" stay whole; a title that would end up empty is kept as is.
+
+    Args:
+        title (Optional[str]): The Rekordbox title.
+
+    Returns:
+        Tuple[str, FrozenSet[str]]: The normalized title and the featured artists.
+    """
+    title = _fold(title)
+    original = title
+    featured = set()
+    kept = []
+
+    def bracket(match):
+        inner = match.group(1).strip()
+        feat = _FEATURING.match(inner)
+        if feat:
+            featured.update(split_artists(feat.group(1)))
+        elif not _IGNORED_SUFFIX.match(_tokens(inner)):
+            kept.append(inner)
+        return " "
+
+    title = _BRACKETED.sub(bracket, title)
+
+    # "Title - Original Mix" / "Title - 2011 Remaster" / "Title - feat. Artist"
+    parts = [part.strip() for part in title.split(" - ")]
+    title = parts[0]
+    for part in parts[1:]:
+        feat = _FEATURING.match(part)
+        if feat and feat.group(1):
+            featured.update(split_artists(feat.group(1)))
+        elif not _IGNORED_SUFFIX.match(_tokens(part)):
+            title += " - " + part
+
+    feat = _INLINE_FEATURING.search(title)
+    if feat:
+        featured.update(split_artists(feat.group(1)))
+        title = title[:feat.start()]
+
+    normalized = _tokens(" ".join([title] + kept))
+    if not normalized:
+        return _tokens(original), frozenset()
+    return normalized, frozenset(featured)
+
+
+class Matcher:
+    """
+    Base class for duplicate matching engines.
+
+    A matcher turns the song records produced by dump_song_data into groups of
+    content_list indexes, in the `List[List[int]]` shape `deduplicate` consumes.
+    """
+
+    name = "base"
+
+    def group(self, content_list: List[Dict[str, Any]]) -> List[List[int]]:
+        raise NotImplementedError
+
+
+class ExactNameMatcher(Matcher):
+    """Group songs whose "Artist - Title" FullName strings are identical."""
+
+    name = "exact"
+
+    def group(self, content_list: List[Dict[str, Any]]) -> List[List[int]]:
+        return group_by_key([song["FullName"] for song in content_list])
+
+
+class NormalizedMatcher(Matcher):
+    """
+    Group songs by normalized title and artist with duration and BPM tolerances.
+
+    Songs are blocked on their normalized title, so only songs sharing a block are
+    ever compared. Inside a block they are sorted by duration and each anchor is only
+    compared with the following songs that share an artist and are within the
+    duration tolerance, which keeps the work close to linear even for very common
+    titles. Groups are not transitive: every member matches the group's anchor.
+
+    Args:
+        duration_tolerance (int): Maximum length difference in seconds.
+        bpm_tolerance (float): Maximum BPM difference.
+        min_score (float): Minimum pair score for two songs to be grouped.
+    """
+
+    name = "fuzzy"
+
+    def __init__(self, duration_tolerance: int = 2, bpm_tolerance: float = 0.5, min_score: float = 0.75):
+        self.duration_tolerance = duration_tolerance
+        self.bpm_tolerance = bpm_tolerance
+        self.min_score = min_score
+
+    def _key(self, song: Dict[str, Any]):
+        title, featured = normalize_title(song.get("Title"))
+        artists = split_artists(song.get("ArtistName")) | featured
+        length = song.get("Length") or 0
+        # Rekordbox stores BPM multiplied by 100
+        bpm = (song.get("BPM") or 0) / 100
+        return title, artists, length, bpm
+
+    def score(self, a, b) -> float:
+        """
+        Score a candidate pair from the same block, 0 if outside the tolerances.
+
+        Unknown lengths or BPMs (stored as 0) never rule a pair out.
+        """
+        _, artists_a, length_a, bpm_a = a
+        _, artists_b, length_b, bpm_b = b
+
+        length_score = 1.0
+        if length_a and length_b:
+            difference = abs(length_a - length_b)
+            if difference > self.duration_tolerance:
+                return 0.0
+            length_score = 1.0 - difference / (self.duration_tolerance + 1)
+
+        bpm_score = 1.0
+        if bpm_a and bpm_b:
+            difference = abs(bpm_a - bpm_b)
+            if difference > self.bpm_tolerance:
+                return 0.0
+            bpm_score = 1.0 - difference / (self.bpm_tolerance * 2)
+
+        if artists_a and artists_b:
+            # Overlap coefficient: "A" and "A feat. B" are the same artist credit
+            artist_score = len(artists_a & artists_b) / min(len(artists_a), len(artists_b))
+        else:
+            artist_score = 1.0 if artists_a == artists_b else 0.0
+
+        return ARTIST_WEIGHT * artist_score + 0.25 * length_score + 0.15 * bpm_score
+
+    def _group_block(self, keys: List[tuple], members: List[int]) -> List[List[int]]:
+        """
+        Group the songs of one title block around anchors.
+
+        Songs are taken in order of length; each song not yet grouped becomes an
+        anchor and collects the later songs that match it, so every member of a
+        group matches its anchor rather than being chained in through others.
+        When min_score is above what length and BPM alone can score, candidates
+        come from an index of the anchor's artists, since a pair without a shared
+        artist cannot match. At most MAX_CANDIDATES are scored per anchor.
+        """
+        members = sorted(members, key=lambda i: (keys[i][2], i))
+        by_artist = defaultdict(list)
+        for position, index in enumerate(members):
+            for artist in keys[index][1] or ("",):
+                by_artist[artist].append(position)
+
+        grouped = set()
+        groups = []
+        for position, anchor in enumerate(members):
+            if anchor in grouped:
+                continue
+            length = keys[anchor][2]
+            if self.min_score > 1.0 - ARTIST_WEIGHT:
+                postings = [by_artist[artist] for artist in keys[anchor][1] or ("",)]
+            else:
+                postings = [range(len(members))]
+            candidates = heapq.merge(*(posting[bisect.bisect_right(posting, position):] for posting in postings))
+
+            group = [anchor]
+            seen = set()
+            for candidate in candidates:
+                index = members[candidate]
+                # Later songs are only longer, unknown lengths sort first
+                if length and keys[index][2] - length > self.duration_tolerance:
+                    break
+                if index in grouped or candidate in seen:
+                    continue
+                seen.add(candidate)
+                if len(seen) > MAX_CANDIDATES:
+                    break
+                if self.score(keys[anchor], keys[index]) >= self.min_score:
+                    group.append(index)
+                    grouped.add(index)
+
+            if len(group) > 1:
+                grouped.add(anchor)
+                groups.append(sorted(group))
+        return groups
+
+    def group(self, content_list: List[Dict[str, Any]]) -> List[List[int]]:
+        keys = [self._key(song) for song in content_list]
+
+        blocks = defaultdict(list)
+        for index, key in enumerate(keys):
+            if key[0]:
+                blocks[key[0]].append(index)
+
+        groups = []
+        for members in blocks.values():
+            if len(members) > 1:
+                groups.extend(self._group_block(keys, members))
+
+        return sorted(groups)
+
+
+MATCHERS = {
+    ExactNameMatcher.name: ExactNameMatcher,
+    NormalizedMatcher.name: NormalizedMatcher,
+}
+
+
+def get_matcher(argv: Optional[Sequence[str]] = None) -> Matcher:
+    """
+    Create the matcher selected with `--matcher=<name>`, exact name matching by default.
+    """
+    argv = sys.argv if argv is None else argv
+    name = ExactNameMatcher.name
+    for arg in argv:
+        if arg.startswith("--matcher="):
+            name = arg.split("=", 1)[1]
+
+    if name not in MATCHERS:
+        raise ValueError(f"Unknown matcher '{name}', choose one of: {', '.join(MATCHERS)}")
+
+    return MATCHERS[name]()
+
+
+def merge_groups(size: int, *group_lists: List[List[int]]) -> List[List[int]]:
+    """
+    Merge several groupings of the same content_list into one.
+
+    Groups that share an index are joined, so a song matched by metadata to one
+    song and by audio to another ends up in a single group.
+
+    Args:
+        size (int): The length of content_list.
+        *group_lists (List[List[int]]): Groupings from different matchers.
+
+    Returns:
+        List[List[int]]: The merged groups, ordered by their first index.
+    """
+    parent = list(range(size))
+
+    def find(i):
+        while parent[i] != i:
+            parent[i] = parent[parent[i]]
+            i = parent[i]
+        return i
+
+    for groups in group_lists:
+        for group in groups:
+            root = find(group[0])
+            for index in group[1:]:
+                other = find(index)
+                if other != root:
+                    parent[max(root, other)] = min(root, other)
+                    root = min(root, other)
+
+    merged = defaultdict(list)
+    for groups in group_lists:
+        for group in groups:
+            for index in group:
+                merged[find(index)].append(index)
+
+    return [sorted(set(members)) for root, members in sorted(merged.items()) if len(set(members)) > 1]
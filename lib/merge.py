@@ -0,0 +1,262 @@
+import logging
+import secrets
+import uuid
+from datetime import datetime, timezone
+from typing import Any, Dict, List, NamedTuple, Sequence, Set
+
+from sqlalchemy import text
+
+from lib.bulk import SONG_MAP_TABLE, SQLITE_MAX_VARIABLES, chunked
+
+logger = logging.getLogger(__name__)
+
+MERGE_ROWS_TABLE = "dedup_merge_rows"
+STAGED_ROWS_TABLE = "dedup_merge_staged"
+MERGED_FIELDS_TABLE = "dedup_merge_fields"
+
+# djmdContent fields folded from the duplicates into the kept song
+MERGED_FIELDS = ("DJPlayCount", "Rating", "Commnt")
+
+
+class MergeResult(NamedTuple):
+    """Rows created and songs updated by merge_metadata."""
+    cue_ids: List[str]
+    tag_ids: List[str]
+    songs_updated: int
+
+
+def _timestamp() -> str:
+    """The current time in the format Rekordbox stores created_at and updated_at in."""
+    return datetime.now(timezone.utc).strftime("%Y-%m-%d %H:%M:%S.%f")[:-3] + " +00:00"
+
+
+def generate_ids(db, table: str, count: int) -> List[str]:
+    """
+    Generate unused random 28-bit IDs for a table, like Rekordbox6Database.generate_unused_id.
+
+    The table's IDs are read once, so the cost does not grow with `count` queries.
+    """
+    connection = db.session.connection()
+    used = {row[0] for row in connection.execute(text(f"SELECT ID FROM {table}"))}
+    ids = []
+    while len(ids) < count:
+        candidate = str(int.from_bytes(secrets.token_bytes(4), "big") >> 4)
+        if int(candidate) >= 100 and candidate not in used:
+            used.add(candidate)
+            ids.append(candidate)
+    return ids
+
+
+def _stage_rows(db, table: str, key: str):
+    """
+    Copy ID, ContentID and a comparison key of the rows of every mapped song into a temp table.
+
+    djmdCue and djmdSongMyTag have no index on ContentID, so one pass over the
+    table collects the few rows the merge compares, which are then indexed.
+    """
+    connection = db.session.connection()
+    connection.execute(text(f"DROP TABLE IF EXISTS {STAGED_ROWS_TABLE}"))
+    connection.execute(text(
+        f"CREATE TEMP TABLE {STAGED_ROWS_TABLE} AS SELECT ID, ContentID, {key} AS key FROM {table} "
+        f"WHERE ContentID IN (SELECT old_id FROM {SONG_MAP_TABLE} UNION SELECT new_id FROM {SONG_MAP_TABLE})"
+    ))
+    connection.execute(text(f"CREATE INDEX {STAGED_ROWS_TABLE}_content ON {STAGED_ROWS_TABLE} (ContentID, key)"))
+
+
+def _missing_rows_query(position: str = "NULL", joins: str = "") -> str:
+    """
+    Select (source_id, target_id, position) of staged duplicate rows whose key the kept song lacks.
+
+    When several duplicates of a song share a key, the row with the lowest ID is taken.
+    """
+    return (
+        f"SELECT source_id, target_id, {position} FROM ("
+        "SELECT c.ID AS source_id, m.new_id AS target_id, c.key, "
+        "ROW_NUMBER() OVER (PARTITION BY m.new_id, c.key ORDER BY c.ID) AS duplicate "
+        f"FROM {STAGED_ROWS_TABLE} AS c JOIN {SONG_MAP_TABLE} AS m ON m.old_id = c.ContentID "
+        f"WHERE NOT EXISTS (SELECT 1 FROM {STAGED_ROWS_TABLE} AS k WHERE k.ContentID = m.new_id AND k.key = c.key)"
+        f") AS missing {joins} WHERE duplicate = 1"
+    )
+
+
+def _copy_rows(db, table: str, select: str, overrides: Dict[str, str]) -> List[str]:
+    """
+    Copy the rows chosen by `select` with new IDs and UUIDs, in one INSERT ... SELECT.
+
+    `select` returns (source_id, target_id, position): the row to copy, the song it
+    is copied to and an optional number for the copy. Columns in `overrides` are
+    set to the given SQL expressions, which can refer to the source row as `s` and
+    the mapping as `r`.
+    """
+    connection = db.session.connection()
+    rows = connection.execute(text(select)).fetchall()
+    connection.execute(text(f"DROP TABLE {STAGED_ROWS_TABLE}"))
+    if not rows:
+        return []
+
+    new_ids = generate_ids(db, table, len(rows))
+    connection.execute(text(f"DROP TABLE IF EXISTS {MERGE_ROWS_TABLE}"))
+    connection.execute(text(
+        f"CREATE TEMP TABLE {MERGE_ROWS_TABLE} ("
+        "source_id TEXT PRIMARY KEY, target_id TEXT NOT NULL, position INTEGER, new_id TEXT NOT NULL, new_uuid TEXT NOT NULL)"
+    ))
+    connection.execute(
+        text(
+            f"INSERT INTO {MERGE_ROWS_TABLE} (source_id, target_id, position, new_id, new_uuid) "
+            "VALUES (:source_id, :target_id, :position, :new_id, :new_uuid)"
+        ),
+        [
+            {"source_id": source_id, "target_id": target_id, "position": position, "new_id": new_id, "new_uuid": str(uuid.uuid4())}
+            for (source_id, target_id, position), new_id in zip(rows, new_ids)
+        ],
+    )
+
+    columns = [row[1] for row in connection.execute(text(f"PRAGMA table_info({table})"))]
+    now = _timestamp()
+    values = {
+        "ID": "r.new_id",
+        "ContentID": "r.target_id",
+        "UUID": "r.new_uuid",
+        "created_at": f"'{now}'",
+        "updated_at": f"'{now}'",
+        **overrides,
+    }
+    connection.execute(text(
+        f"INSERT INTO {table} ({', '.join(columns)}) "
+        f"SELECT {', '.join(values.get(column, 's.' + column) for column in columns)} "
+        f"FROM {MERGE_ROWS_TABLE} AS r JOIN {table} AS s ON s.ID = r.source_id"
+    ))
+    connection.execute(text(f"DROP TABLE {MERGE_ROWS_TABLE}"))
+    return new_ids
+
+
+def merge_cues(db) -> List[str]:
+    """
+    Copy the cues of duplicates onto their kept song where it has no cue in that place.
+
+    A hot cue is copied if the kept song's slot (Kind) is free, a memory cue or loop
+    (Kind 0) if the kept song has none at the same position. When several duplicates
+    fill the same slot, the cue with the lowest ID wins. Requires the mapping table
+    from load_song_map.
+
+    Returns:
+        List[str]: IDs of the new djmdCue rows.
+    """
+    _stage_rows(db, "djmdCue", "CASE WHEN Kind = 0 THEN 'memory:' || InMsec ELSE 'hot:' || Kind END")
+    return _copy_rows(db, "djmdCue", _missing_rows_query(), {
+        "ContentUUID": "(SELECT UUID FROM djmdContent WHERE ID = r.target_id)",
+    })
+
+
+def merge_tags(db) -> List[str]:
+    """
+    Link the kept songs to the MyTags of their duplicates that they are missing.
+
+    New links are appended to the end of each MyTag. Requires the mapping table
+    from load_song_map.
+
+    Returns:
+        List[str]: IDs of the new djmdSongMyTag rows.
+    """
+    _stage_rows(db, "djmdSongMyTag", "MyTagID")
+    position = "last.TrackNo + ROW_NUMBER() OVER (PARTITION BY missing.key ORDER BY source_id)"
+    last = "JOIN (SELECT MyTagID, COALESCE(MAX(TrackNo), 0) AS TrackNo FROM djmdSongMyTag GROUP BY MyTagID) AS last ON last.MyTagID = missing.key"
+    return _copy_rows(db, "djmdSongMyTag", _missing_rows_query(position, last), {"TrackNo": "r.position"})
+
+
+def merge_fields(db) -> int:
+    """
+    Fold play counts, ratings and comments of duplicates into their kept song.
+
+    Play counts are summed, the highest rating is kept and an empty comment is
+    filled with the first non-empty comment of a duplicate. The totals per kept
+    song are gathered into a temporary table first, then applied with one
+    UPDATE ... FROM. Requires the mapping table from load_song_map.
+
+    Returns:
+        int: The number of kept songs that changed.
+    """
+    connection = db.session.connection()
+    connection.execute(text(f"DROP TABLE IF EXISTS {MERGED_FIELDS_TABLE}"))
+    connection.execute(text(
+        f"CREATE TEMP TABLE {MERGED_FIELDS_TABLE} (target_id TEXT PRIMARY KEY, plays INTEGER, rating INTEGER, comment TEXT)"
+    ))
+    connection.execute(text(
+        f"INSERT INTO {MERGED_FIELDS_TABLE} (target_id, plays, rating, comment) "
+        "SELECT target_id, SUM(plays), MAX(rating), MAX(CASE WHEN first_comment = 1 THEN comment END) FROM ("
+        "SELECT m.new_id AS target_id, COALESCE(CAST(c.DJPlayCount AS INTEGER), 0) AS plays, "
+        "COALESCE(c.Rating, 0) AS rating, NULLIF(c.Commnt, '') AS comment, "
+        "ROW_NUMBER() OVER (PARTITION BY m.new_id ORDER BY NULLIF(c.Commnt, '') IS NULL, c.ID) AS first_comment "
+        f"FROM {SONG_MAP_TABLE} AS m JOIN djmdContent AS c ON c.ID = m.old_id"
+        ") GROUP BY target_id"
+    ))
+
+    result = connection.execute(text(
+        "UPDATE djmdContent SET "
+        "DJPlayCount = COALESCE(CAST(djmdContent.DJPlayCount AS INTEGER), 0) + merged.plays, "
+        "Rating = MAX(COALESCE(djmdContent.Rating, 0), merged.rating), "
+        "Commnt = CASE WHEN COALESCE(djmdContent.Commnt, '') = '' THEN COALESCE(merged.comment, djmdContent.Commnt) ELSE djmdContent.Commnt END, "
+        "updated_at = :now "
+        f"FROM {MERGED_FIELDS_TABLE} AS merged "
+        "WHERE djmdContent.ID = merged.target_id AND ("
+        "merged.plays > 0 OR merged.rating > COALESCE(djmdContent.Rating, 0) "
+        "OR (COALESCE(djmdContent.Commnt, '') = '' AND merged.comment IS NOT NULL))"
+    ), {"now": _timestamp()})
+    connection.execute(text(f"DROP TABLE {MERGED_FIELDS_TABLE}"))
+    return result.rowcount
+
+
+def merge_metadata(db) -> MergeResult:
+    """
+    Carry cues, MyTags, play counts, ratings and comments of duplicates over to the kept songs.
+
+    Works on the whole mapping table from load_song_map at once. Nothing is
+    committed, so the caller can commit the merge as one transaction.
+
+    Returns:
+        MergeResult: The new cue and tag rows, and the number of songs updated.
+    """
+    result = MergeResult(merge_cues(db), merge_tags(db), merge_fields(db))
+    logger.info(
+        f"Merged metadata into the kept songs: {len(result.cue_ids)} cues, "
+        f"{len(result.tag_ids)} MyTag links, {result.songs_updated} songs updated"
+    )
+    return result
+
+
+def select_merged_fields(db, content_ids: Sequence[str]) -> List[Dict[str, Any]]:
+    """Read ID and MERGED_FIELDS of the given songs as stored, e.g. for a journal pre-image."""
+    connection = db.session.connection()
+    rows = []
+    for batch in chunked(content_ids, SQLITE_MAX_VARIABLES):
+        params = {f"v{i}": value for i, value in enumerate(batch)}
+        placeholders = ", ".join(f":{name}" for name in params)
+        result = connection.execute(text(
+            f"SELECT ID, {', '.join(MERGED_FIELDS)} FROM djmdContent WHERE ID IN ({placeholders})"
+        ), params)
+        rows.extend(dict(row) for row in result.mappings())
+    return rows
+
+
+def restore_merged_fields(db, rows: List[Dict[str, Any]]) -> int:
+    """Write fields read by select_merged_fields back. Nothing is committed."""
+    if not rows:
+        return 0
+    db.session.connection().execute(text(
+        f"UPDATE djmdContent SET {', '.join(f'{field} = :{field}' for field in MERGED_FIELDS)} WHERE ID = :ID"
+    ), rows)
+    return len(rows)
+
+
+def delete_merged_rows(db, table: str, ids: Set[str]) -> int:
+    """Delete cue or MyTag rows created by merge_metadata. Nothing is committed."""
+    if table not in ("djmdCue", "djmdSongMyTag"):
+        raise ValueError(f"Cannot delete merged rows from {table}")
+
+    connection = db.session.connection()
+    deleted = 0
+    for batch in chunked(sorted(ids), SQLITE_MAX_VARIABLES):
+        params = {f"v{i}": value for i, value in enumerate(batch)}
+        placeholders = ", ".join(f":{name}" for name in params)
+        deleted += connection.execute(text(f"DELETE FROM {table} WHERE ID IN ({placeholders})"), params).rowcount
+    return deleted
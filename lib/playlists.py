@@ -0,0 +1,261 @@
+import logging
+from typing import Any, Dict, Iterable, List, Optional, Sequence
+
+from sqlalchemy import text
+
+from lib.bulk import SONG_MAP_TABLE, SQLITE_MAX_VARIABLES, chunked
+
+logger = logging.getLogger(__name__)
+
+PLAYLIST_SCOPE_TABLE = "dedup_playlist_scope"
+REMOVED_ENTRIES_TABLE = "dedup_removed_entries"
+REMAPPED_ENTRIES_TABLE = "dedup_remapped_entries"
+
+
+def playlist_subtree_ids(db, folder_id: str) -> List[str]:
+    """
+    Return the IDs of a playlist folder and everything below it.
+
+    Args:
+        db (Rekordbox6Database): An open database handle.
+        folder_id (str): ID of the folder (or a single playlist).
+
+    Returns:
+        List[str]: The folder's own ID followed by every nested playlist and folder.
+    """
+    rows = db.session.connection().execute(text(
+        "WITH RECURSIVE subtree(ID) AS ("
+        "SELECT ID FROM djmdPlaylist WHERE ID = :folder_id "
+        "UNION SELECT p.ID FROM djmdPlaylist AS p JOIN subtree AS s ON p.ParentID = s.ID"
+        ") SELECT ID FROM subtree"
+    ), {"folder_id": str(folder_id)})
+    return [row[0] for row in rows]
+
+
+def _scope_filter(db, playlist_ids: Optional[Iterable[str]]) -> str:
+    """
+    Load the playlists to work on into a temporary table and return the matching WHERE clause.
+
+    None means every playlist, which needs no table at all.
+    """
+    if playlist_ids is None:
+        return ""
+
+    connection = db.session.connection()
+    connection.execute(text(f"CREATE TEMP TABLE IF NOT EXISTS {PLAYLIST_SCOPE_TABLE} (PlaylistID TEXT PRIMARY KEY)"))
+    connection.execute(text(f"DELETE FROM {PLAYLIST_SCOPE_TABLE}"))
+
+    rows = [{"playlist_id": str(playlist_id)} for playlist_id in set(playlist_ids)]
+    if rows:
+        connection.execute(text(f"INSERT INTO {PLAYLIST_SCOPE_TABLE} (PlaylistID) VALUES (:playlist_id)"), rows)
+
+    return f"WHERE PlaylistID IN (SELECT PlaylistID FROM {PLAYLIST_SCOPE_TABLE})"
+
+
+def remove_duplicate_entries(db, playlist_ids: Optional[Iterable[str]] = None, remapped: Optional[Dict[str, str]] = None) -> Dict[str, int]:
+    """
+    Delete repeated songs inside playlists, keeping the entry with the lowest ID.
+
+    One ROW_NUMBER() pass over djmdSongPlaylist, partitioned by playlist and song,
+    finds every surplus entry of every playlist in scope; they are then deleted with
+    a single statement. Nothing is committed.
+
+    With `remapped`, only repeats created by a replacement go: a playlist keeps as
+    many entries of a song as it had of any one song before, so repeats the user
+    added on purpose stay, and only rewritten entries are deleted.
+
+    Args:
+        db (Rekordbox6Database): An open database handle.
+        playlist_ids (Optional[Iterable[str]]): Playlists to clean, None for all of them.
+        remapped (Optional[Dict[str, str]]): Entry ID -> original ContentID of the entries
+            a replacement rewrote, None to remove every repeat.
+
+    Returns:
+        Dict[str, int]: Number of entries removed per playlist ID, only playlists that changed.
+    """
+    scope = _scope_filter(db, playlist_ids)
+    connection = db.session.connection()
+
+    connection.execute(text(f"DROP TABLE IF EXISTS {REMOVED_ENTRIES_TABLE}"))
+    if remapped is None:
+        connection.execute(text(
+            f"CREATE TEMP TABLE {REMOVED_ENTRIES_TABLE} AS "
+            "SELECT ID, PlaylistID FROM ("
+            "SELECT ID, PlaylistID, ROW_NUMBER() OVER (PARTITION BY PlaylistID, ContentID ORDER BY ID) AS position "
+            f"FROM djmdSongPlaylist {scope}"
+            ") WHERE position > 1"
+        ))
+    else:
+        connection.execute(text(
+            f"CREATE TEMP TABLE IF NOT EXISTS {REMAPPED_ENTRIES_TABLE} (ID TEXT PRIMARY KEY, ContentID TEXT NOT NULL)"
+        ))
+        connection.execute(text(f"DELETE FROM {REMAPPED_ENTRIES_TABLE}"))
+        rows = [{"entry_id": str(entry_id), "content_id": str(content_id)} for entry_id, content_id in remapped.items()]
+        if rows:
+            connection.execute(text(f"INSERT INTO {REMAPPED_ENTRIES_TABLE} (ID, ContentID) VALUES (:entry_id, :content_id)"), rows)
+
+        # Number the entries of each original song, then keep one entry per number,
+        # preferring entries that were not rewritten
+        connection.execute(text(
+            f"CREATE TEMP TABLE {REMOVED_ENTRIES_TABLE} AS "
+            "SELECT ID, PlaylistID FROM ("
+            "SELECT ID, PlaylistID, remapped, "
+            "ROW_NUMBER() OVER (PARTITION BY PlaylistID, ContentID, occurrence ORDER BY remapped, ID) AS position FROM ("
+            "SELECT p.ID, p.PlaylistID, p.ContentID, r.ID IS NOT NULL AS remapped, "
+            "ROW_NUMBER() OVER (PARTITION BY p.PlaylistID, p.ContentID, COALESCE(r.ContentID, p.ContentID) ORDER BY p.ID) AS occurrence "
+            f"FROM djmdSongPlaylist AS p LEFT JOIN {REMAPPED_ENTRIES_TABLE} AS r ON r.ID = p.ID {scope}"
+            ")) WHERE position > 1 AND remapped"
+        ))
+        connection.execute(text(f"DROP TABLE {REMAPPED_ENTRIES_TABLE}"))
+
+    removed = dict(connection.execute(text(
+        f"SELECT PlaylistID, COUNT(*) FROM {REMOVED_ENTRIES_TABLE} GROUP BY PlaylistID"
+    )).fetchall())
+
+    if removed:
+        connection.execute(text(
+            f"DELETE FROM djmdSongPlaylist WHERE ID IN (SELECT ID FROM {REMOVED_ENTRIES_TABLE})"
+        ))
+    connection.execute(text(f"DROP TABLE {REMOVED_ENTRIES_TABLE}"))
+
+    return removed
+
+
+def renumber_tracks(db, playlist_ids: Optional[Iterable[str]] = None) -> int:
+    """
+    Renumber TrackNo as 1..n inside each playlist, keeping the current order.
+
+    Uses one windowed UPDATE ... FROM and only writes entries whose number changes.
+    Nothing is committed.
+
+    Args:
+        db (Rekordbox6Database): An open database handle.
+        playlist_ids (Optional[Iterable[str]]): Playlists to renumber, None for all of them.
+
+    Returns:
+        int: The number of entries renumbered.
+    """
+    scope = _scope_filter(db, playlist_ids)
+    result = db.session.connection().execute(text(
+        "UPDATE djmdSongPlaylist SET TrackNo = numbered.position FROM ("
+        "SELECT ID, ROW_NUMBER() OVER (PARTITION BY PlaylistID ORDER BY TrackNo, ID) AS position "
+        f"FROM djmdSongPlaylist {scope}"
+        ") AS numbered "
+        "WHERE djmdSongPlaylist.ID = numbered.ID AND djmdSongPlaylist.TrackNo IS NOT numbered.position"
+    ))
+    return result.rowcount
+
+
+def deduplicate_playlists(db, playlist_ids: Optional[Iterable[str]] = None) -> Dict[str, int]:
+    """
+    Remove repeated songs from playlists and close the TrackNo gaps they leave.
+
+    Args:
+        db (Rekordbox6Database): An open database handle.
+        playlist_ids (Optional[Iterable[str]]): Playlists to clean, None for all of them.
+
+    Returns:
+        Dict[str, int]: Number of entries removed per playlist ID, only playlists that changed.
+    """
+    if playlist_ids is not None:
+        playlist_ids = list(playlist_ids)
+
+    removed = remove_duplicate_entries(db, playlist_ids)
+    if removed:
+        renumbered = renumber_tracks(db, removed.keys())
+        logger.info(f"Removed {sum(removed.values())} duplicate entries from {len(removed)} playlists, {renumbered} entries renumbered")
+
+    return removed
+
+
+def compact_playlists(db, playlist_ids: Iterable[str], remapped: Dict[str, str]) -> Dict[str, int]:
+    """
+    Collapse the repeats a replacement created and renumber TrackNo in the given playlists only.
+
+    Meant for the playlists a replacement touched, so the cost follows the size of
+    the change rather than the library. Songs the user had added to a playlist more
+    than once stay, see remove_duplicate_entries. Every given playlist is renumbered,
+    not just the ones that lost entries.
+
+    Args:
+        db (Rekordbox6Database): An open database handle.
+        playlist_ids (Iterable[str]): The touched playlists.
+        remapped (Dict[str, str]): Entry ID -> original ContentID of the entries the replacement rewrote.
+
+    Returns:
+        Dict[str, int]: Number of entries removed per playlist ID, only playlists that changed.
+    """
+    playlist_ids = list(playlist_ids)
+    if not playlist_ids:
+        return {}
+
+    removed = remove_duplicate_entries(db, playlist_ids, remapped)
+    renumbered = renumber_tracks(db, playlist_ids)
+    logger.info(
+        f"Compacted {len(playlist_ids)} playlists: {sum(removed.values())} duplicate entries removed, "
+        f"{renumbered} entries renumbered"
+    )
+    return removed
+
+def select_playlist_rows(db, column: str, values: Sequence[str]) -> List[Dict[str, Any]]:
+    """
+    Read complete djmdSongPlaylist rows as column -> value, e.g. for a journal pre-image.
+
+    Values come back as stored, without pyrekordbox's type conversions, so they can
+    be written back unchanged by restore_playlist_rows.
+
+    Args:
+        db (Rekordbox6Database): An open database handle.
+        column (str): "ContentID" or "PlaylistID".
+        values (Sequence[str]): The values of `column` to select.
+
+    Returns:
+        List[Dict[str, Any]]: The matching rows.
+    """
+    if column not in ("ContentID", "PlaylistID"):
+        raise ValueError(f"Cannot select playlist rows by {column}")
+
+    connection = db.session.connection()
+    rows = []
+    for batch in chunked(values, SQLITE_MAX_VARIABLES):
+        params = {f"v{i}": value for i, value in enumerate(batch)}
+        placeholders = ", ".join(f":{name}" for name in params)
+        result = connection.execute(text(f"SELECT * FROM djmdSongPlaylist WHERE {column} IN ({placeholders})"), params)
+        rows.extend(dict(row) for row in result.mappings())
+    return rows
+
+
+def select_mapped_playlist_rows(db) -> List[Dict[str, Any]]:
+    """
+    Read the complete djmdSongPlaylist rows of every song in the mapping table, like select_playlist_rows.
+
+    Requires the mapping table from load_song_map; one pass over djmdSongPlaylist
+    covers the whole mapping.
+    """
+    result = db.session.connection().execute(text(
+        f"SELECT * FROM djmdSongPlaylist WHERE ContentID IN (SELECT old_id FROM {SONG_MAP_TABLE})"
+    ))
+    return [dict(row) for row in result.mappings()]
+
+
+def restore_playlist_rows(db, rows: List[Dict[str, Any]]) -> int:
+    """
+    Write rows read by select_playlist_rows back, re-creating deleted ones.
+
+    Nothing is committed.
+
+    Returns:
+        int: The number of rows written.
+    """
+    if not rows:
+        return 0
+
+    columns = list(rows[0])
+    statement = text(
+        f"INSERT OR REPLACE INTO djmdSongPlaylist ({', '.join(columns)}) "
+        f"VALUES ({', '.join(':' + column for column in columns)})"
+    )
+    connection = db.session.connection()
+    for batch in chunked(rows, SQLITE_MAX_VARIABLES):
+        connection.execute(statement, batch)
+    return len(rows)
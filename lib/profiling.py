@@ -0,0 +1,235 @@
+import cProfile
+import json
+import logging
+import os
+import re
+import sys
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+from typing import Dict, List, NamedTuple, Optional, Sequence, Set
+
+from rich.console import Console
+from rich.table import Table
+from sqlalchemy import event
+
+try:
+    import psutil
+except ImportError:
+    psutil = None
+
+try:
+    import resource
+except ImportError:
+    # Not available on Windows
+    resource = None
+
+logger = logging.getLogger(__name__)
+
+# Executions of one statement within a stage from which it is reported as an N+1 pattern
+N_PLUS_ONE_THRESHOLD = 100
+# Characters of a statement shown in the summary
+STATEMENT_WIDTH = 120
+OUTPUTS = ("cprofile", "trace")
+
+
+def peak_rss() -> Optional[int]:
+    """
+    Return the peak resident set size of the process in bytes, None if it cannot be read.
+
+    psutil only reports a true peak on Windows (peak_wset); elsewhere the resource
+    module's ru_maxrss is used, falling back to psutil's current RSS.
+    """
+    info = psutil.Process().memory_info() if psutil is not None else None
+    if info is not None and hasattr(info, "peak_wset"):
+        return info.peak_wset
+    if resource is not None:
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # Bytes on macOS, kilobytes on Linux
+        return peak if sys.platform == "darwin" else peak * 1024
+    return info.rss if info is not None else None
+
+
+def normalize_statement(statement: str) -> str:
+    """Reduce a SQL statement to its shape: literals and parameter lists collapsed, whitespace folded."""
+    statement = re.sub(r"'(?:[^']|'')*'", "'?'", statement)
+    statement = re.sub(r"\b\d+\b", "N", statement)
+    statement = re.sub(r"\?(?:\s*,\s*\?)+", "?, ...", statement)
+    return re.sub(r"\s+", " ", statement).strip()
+
+
+class StageProfile(NamedTuple):
+    """Totals of every run of one stage."""
+    calls: int
+    wall: float
+    cpu: float
+    statements: int
+    sql_time: float
+    # Peak RSS of the process when the stage last ended
+    peak_rss: Optional[int]
+
+
+class Profiler:
+    """
+    Per-stage wall time, CPU time, SQL statements and peak memory of a run.
+
+    PipelineSession wraps each of its stages in `stage` and attaches the profiler
+    to the database engine, whose cursor events count the statements and time spent
+    in SQL. Statements are attributed to the innermost running stage and grouped by
+    their normalized text; one that runs N_PLUS_ONE_THRESHOLD times or more within a
+    stage is reported as a likely N+1 pattern, such as a lazy load per song or a
+    delete per ID. executemany counts as one statement.
+
+    CPU time is the process time, so it includes worker threads.
+
+    Args:
+        outputs (Set[str]): Extra outputs, any of OUTPUTS: "cprofile" writes a cProfile
+            dump and "trace" a Chrome trace (chrome://tracing, Perfetto) of the stages
+            and statements.
+        folder (str): Folder the extra outputs are written to.
+    """
+
+    def __init__(self, outputs: Set[str] = frozenset(), folder: str = "./data"):
+        unknown = set(outputs) - set(OUTPUTS)
+        if unknown:
+            raise ValueError(f"Unknown profile output '{', '.join(sorted(unknown))}', choose from: {', '.join(OUTPUTS)}")
+        self.outputs = set(outputs)
+        self.folder = folder
+        self.origin = time.perf_counter()
+        self.running: List[str] = []
+        self.stages: Dict[str, StageProfile] = {}
+        self.statements: Dict[str, Dict[str, int]] = defaultdict(lambda: defaultdict(int))
+        self.sql_stats: Dict[str, List[float]] = defaultdict(lambda: [0, 0.0])
+        self.events: List[dict] = []
+        self.profile = cProfile.Profile() if "cprofile" in self.outputs else None
+        if self.profile is not None:
+            self.profile.enable()
+
+    def _timestamp(self, seconds: float) -> float:
+        """Microseconds since the profiler started, the unit of Chrome traces."""
+        return (seconds - self.origin) * 1e6
+
+    def _trace(self, name: str, category: str, start: float, duration: float, **args):
+        if "trace" in self.outputs:
+            self.events.append({
+                "name": name, "cat": category, "ph": "X", "pid": os.getpid(), "tid": threading.get_ident(),
+                "ts": self._timestamp(start), "dur": duration * 1e6, "args": args,
+            })
+
+    @contextmanager
+    def stage(self, name: str):
+        """Measure a stage; repeated stages add up."""
+        self.running.append(name)
+        before = self.sql_stats[name][:]
+        start = time.perf_counter()
+        cpu_start = time.process_time()
+        try:
+            yield
+        finally:
+            wall = time.perf_counter() - start
+            cpu = time.process_time() - cpu_start
+            self.running.pop()
+            statements = self.sql_stats[name][0] - before[0]
+            sql_time = self.sql_stats[name][1] - before[1]
+            previous = self.stages.get(name, StageProfile(0, 0.0, 0.0, 0, 0.0, None))
+            self.stages[name] = StageProfile(
+                previous.calls + 1, previous.wall + wall, previous.cpu + cpu,
+                previous.statements + statements, previous.sql_time + sql_time, peak_rss(),
+            )
+            self._trace(name, "stage", start, wall, cpu=cpu, statements=statements)
+
+    def attach(self, engine):
+        """Count the statements run through `engine`, a fresh one after a WorkingCopy swapped it."""
+        event.listen(engine, "before_cursor_execute", self._before_execute)
+        event.listen(engine, "after_cursor_execute", self._after_execute)
+
+    def _before_execute(self, conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("profile_start", []).append(time.perf_counter())
+
+    def _after_execute(self, conn, cursor, statement, parameters, context, executemany):
+        start = conn.info["profile_start"].pop()
+        elapsed = time.perf_counter() - start
+        name = self.running[-1] if self.running else "(outside stages)"
+        stats = self.sql_stats[name]
+        stats[0] += 1
+        stats[1] += elapsed
+        shape = normalize_statement(statement)
+        self.statements[name][shape] += 1
+        self._trace(shape[:STATEMENT_WIDTH], "sql", start, elapsed, stage=name, executemany=executemany)
+
+    def repeated_statements(self, threshold: int = N_PLUS_ONE_THRESHOLD) -> List[tuple]:
+        """Return (stage, count, statement) of every statement run `threshold` times or more in one stage, most frequent first."""
+        repeated = [
+            (name, count, statement)
+            for name, statements in self.statements.items()
+            for statement, count in statements.items()
+            if count >= threshold
+        ]
+        return sorted(repeated, key=lambda item: item[1], reverse=True)
+
+    def finish(self) -> List[str]:
+        """
+        Stop profiling and write the requested outputs.
+
+        Returns:
+            List[str]: The files written.
+        """
+        written = []
+        if self.profile is not None:
+            self.profile.disable()
+            path = os.path.join(self.folder, "profile.prof")
+            self.profile.dump_stats(path)
+            self.profile = None
+            written.append(path)
+        if "trace" in self.outputs:
+            path = os.path.join(self.folder, "profile_trace.json")
+            with open(path, "w", encoding="utf-8") as f:
+                json.dump({"traceEvents": self.events, "displayTimeUnit": "ms"}, f)
+            written.append(path)
+        for path in written:
+            logger.info(f"Profile written to {path}")
+        return written
+
+    def print_summary(self):
+        """Print the stage totals and repeated statements as rich tables."""
+        console = Console()
+
+        table = Table(title="Profile Summary")
+        table.add_column("Stage", style="bold green")
+        for column in ("Calls", "Wall (s)", "CPU (s)", "SQL Statements", "SQL (s)", "Peak RSS (MB)"):
+            table.add_column(column, style="bold yellow", justify="right")
+        for name, stage in self.stages.items():
+            table.add_row(
+                name, str(stage.calls), f"{stage.wall:.3f}", f"{stage.cpu:.3f}", str(stage.statements), f"{stage.sql_time:.3f}",
+                f"{stage.peak_rss / 2 ** 20:.1f}" if stage.peak_rss is not None else "-",
+            )
+        outside = self.sql_stats.get("(outside stages)")
+        if outside:
+            table.add_row("(outside stages)", "-", "-", "-", str(outside[0]), f"{outside[1]:.3f}", "-")
+        console.print(table)
+
+        repeated = self.repeated_statements()
+        if repeated:
+            table = Table(title=f"Possible N+1 Queries (run {N_PLUS_ONE_THRESHOLD}+ times in a stage)")
+            table.add_column("Stage", style="bold green")
+            table.add_column("Count", style="bold red", justify="right")
+            table.add_column("Statement", style="bold yellow")
+            for name, count, statement in repeated:
+                table.add_row(name, str(count), statement[:STATEMENT_WIDTH])
+            console.print(table)
+
+
+def get_profiler(argv: Optional[Sequence[str]] = None, folder: str = "./data") -> Optional[Profiler]:
+    """
+    Create the profiler selected with `--profile`, None without it.
+
+    `--profile=cprofile,trace` also writes a cProfile dump and a Chrome trace.
+    """
+    argv = sys.argv if argv is None else argv
+    for arg in argv:
+        if arg == "--profile":
+            return Profiler(folder=folder)
+        if arg.startswith("--profile="):
+            return Profiler({output for output in arg.split("=", 1)[1].split(",") if output}, folder)
+    return None
@@ -0,0 +1,424 @@
+import logging
+import os
+import sqlite3
+import struct
+from concurrent.futures import ThreadPoolExecutor
+from typing import BinaryIO, Dict, Iterable, Iterator, NamedTuple, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_WORKERS = 16
+# Bytes searched for the first MPEG frame after the ID3 tag
+MPEG_SEARCH_BYTES = 64 * 1024
+
+# Every lossless file outranks every lossy one; see quality_score
+LOSSLESS_BASE_SCORE = 10000
+
+
+class AudioQuality(NamedTuple):
+    """Stream properties read from a file's container headers."""
+    codec: str
+    lossless: bool
+    sample_rate: Optional[int]
+    bit_depth: Optional[int]
+    channels: Optional[int]
+    # Average bitrate in kbps
+    bitrate: Optional[int]
+
+
+def quality_score(quality: AudioQuality) -> float:
+    """
+    Rank a file by its stream properties, higher is better.
+
+    Lossy files score their bitrate in kbps, on the same scale as DjmdContent.BitRate.
+    Lossless files score LOSSLESS_BASE_SCORE plus 100 per bit of depth and the
+    sample rate in kHz, so 24-bit beats 16-bit and 96 kHz beats 44.1 kHz.
+    """
+    if quality.lossless:
+        return LOSSLESS_BASE_SCORE + 100 * (quality.bit_depth or 16) + (quality.sample_rate or 44100) / 1000
+    return float(quality.bitrate or 0)
+
+
+def _read_at(f: BinaryIO, offset: int, size: int) -> bytes:
+    f.seek(offset)
+    return f.read(size)
+
+
+def _skip_id3(f: BinaryIO) -> int:
+    """Return the offset after a leading ID3v2 tag, 0 if there is none."""
+    header = _read_at(f, 0, 10)
+    if len(header) < 10 or header[:3] != b"ID3":
+        return 0
+    size = (header[6] & 0x7F) << 21 | (header[7] & 0x7F) << 14 | (header[8] & 0x7F) << 7 | (header[9] & 0x7F)
+    footer = 10 if header[5] & 0x10 else 0
+    return 10 + size + footer
+
+
+# Layer III bitrates in kbps by bitrate index, for MPEG-1 and for MPEG-2/2.5
+_MP3_BITRATES = {
+    True: (0, 32, 40, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320),
+    False: (0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160),
+}
+# Sample rates by version bits (0: MPEG-2.5, 2: MPEG-2, 3: MPEG-1) and index
+_MP3_SAMPLE_RATES = {0: (11025, 12000, 8000), 2: (22050, 24000, 16000), 3: (44100, 48000, 32000)}
+
+
+def probe_mp3(f: BinaryIO, file_size: int) -> Optional[AudioQuality]:
+    """Read the first MPEG Layer III frame and its Xing/Info or VBRI header for the average bitrate."""
+    start = _skip_id3(f)
+    data = _read_at(f, start, MPEG_SEARCH_BYTES)
+
+    position = data.find(b"\xff")
+    while 0 <= position < len(data) - 4:
+        header = struct.unpack(">I", data[position:position + 4])[0]
+        version = (header >> 19) & 3
+        layer = (header >> 17) & 3
+        bitrate_index = (header >> 12) & 15
+        rate_index = (header >> 10) & 3
+        if (header >> 21) == 0x7FF and version != 1 and layer == 1 and 0 < bitrate_index < 15 and rate_index != 3:
+            break
+        position = data.find(b"\xff", position + 1)
+    else:
+        return None
+
+    mpeg1 = version == 3
+    sample_rate = _MP3_SAMPLE_RATES[version][rate_index]
+    mono = (header >> 6) & 3 == 3
+    bitrate = _MP3_BITRATES[mpeg1][bitrate_index]
+    samples_per_frame = 1152 if mpeg1 else 576
+
+    # A Xing/Info header follows the side information, a VBRI header sits 32 bytes in
+    frames = stream_bytes = None
+    xing = position + 4 + (17 if mono else 32) if mpeg1 else position + 4 + (9 if mono else 17)
+    if data[xing:xing + 4] in (b"Xing", b"Info"):
+        flags = struct.unpack(">I", data[xing + 4:xing + 8])[0]
+        offset = xing + 8
+        if flags & 1:
+            frames = struct.unpack(">I", data[offset:offset + 4])[0]
+            offset += 4
+        if flags & 2:
+            stream_bytes = struct.unpack(">I", data[offset:offset + 4])[0]
+    elif data[position + 36:position + 40] == b"VBRI":
+        stream_bytes, frames = struct.unpack(">II", data[position + 46:position + 54])
+
+    if frames:
+        stream_bytes = stream_bytes or file_size - start - position
+        seconds = frames * samples_per_frame / sample_rate
+        bitrate = round(stream_bytes * 8 / seconds / 1000)
+
+    return AudioQuality("mp3", False, sample_rate, None, 1 if mono else 2, bitrate)
+
+
+def probe_flac(f: BinaryIO, file_size: int) -> Optional[AudioQuality]:
+    """Read the FLAC STREAMINFO block."""
+    start = _skip_id3(f)
+    data = _read_at(f, start, 4 + 4 + 34)
+    if data[:4] != b"fLaC" or data[4] & 0x7F != 0:
+        return None
+
+    info = data[8:42]
+    packed = int.from_bytes(info[10:18], "big")
+    sample_rate = packed >> 44
+    channels = ((packed >> 41) & 7) + 1
+    bit_depth = ((packed >> 36) & 31) + 1
+    total_samples = packed & ((1 << 36) - 1)
+
+    bitrate = None
+    if sample_rate and total_samples:
+        bitrate = round(file_size * 8 / (total_samples / sample_rate) / 1000)
+    return AudioQuality("flac", True, sample_rate, bit_depth, channels, bitrate)
+
+
+def _iter_chunks(f: BinaryIO, offset: int, end: int, byte_order: str) -> Iterator[Tuple[bytes, int, int]]:
+    """Yield (id, data offset, size) of the RIFF or IFF chunks between offset and end."""
+    while offset + 8 <= end:
+        header = _read_at(f, offset, 8)
+        if len(header) < 8:
+            return
+        size = struct.unpack(byte_order + "I", header[4:])[0]
+        yield header[:4], offset + 8, size
+        offset += 8 + size + (size & 1)
+
+
+# WAVE_FORMAT_PCM, WAVE_FORMAT_IEEE_FLOAT and WAVE_FORMAT_EXTENSIBLE
+_WAV_LOSSLESS_FORMATS = {1, 3, 0xFFFE}
+
+
+def probe_wav(f: BinaryIO, file_size: int) -> Optional[AudioQuality]:
+    """Read the fmt chunk of a RIFF/WAVE file."""
+    header = _read_at(f, 0, 12)
+    if header[:4] not in (b"RIFF", b"RF64") or header[8:12] != b"WAVE":
+        return None
+
+    for chunk_id, offset, size in _iter_chunks(f, 12, file_size, "<"):
+        if chunk_id == b"fmt ":
+            fmt = _read_at(f, offset, 16)
+            if len(fmt) < 16:
+                return None
+            format_tag, channels, sample_rate, byte_rate, _, bit_depth = struct.unpack("<HHIIHH", fmt)
+            lossless = format_tag in _WAV_LOSSLESS_FORMATS
+            return AudioQuality("wav", lossless, sample_rate, bit_depth if lossless else None, channels, round(byte_rate * 8 / 1000))
+    return None
+
+
+def _extended_to_float(data: bytes) -> float:
+    """Decode an 80-bit IEEE 754 extended float, as used for the AIFF sample rate."""
+    exponent = struct.unpack(">H", data[:2])[0]
+    mantissa = struct.unpack(">Q", data[2:10])[0]
+    sign = -1 if exponent & 0x8000 else 1
+    exponent &= 0x7FFF
+    if exponent == 0 and mantissa == 0:
+        return 0.0
+    return sign * mantissa * 2.0 ** (exponent - 16383 - 63)
+
+
+# AIFF-C compression types that store uncompressed samples
+_AIFC_LOSSLESS_TYPES = {b"NONE", b"sowt", b"twos", b"raw ", b"in24", b"in32", b"fl32", b"fl64", b"FL32", b"FL64"}
+
+
+def probe_aiff(f: BinaryIO, file_size: int) -> Optional[AudioQuality]:
+    """Read the COMM chunk of an AIFF or AIFF-C file."""
+    header = _read_at(f, 0, 12)
+    if header[:4] != b"FORM" or header[8:12] not in (b"AIFF", b"AIFC"):
+        return None
+
+    for chunk_id, offset, size in _iter_chunks(f, 12, file_size, ">"):
+        if chunk_id == b"COMM":
+            comm = _read_at(f, offset, min(size, 22))
+            if len(comm) < 18:
+                return None
+            channels, _, bit_depth = struct.unpack(">HIH", comm[:8])
+            sample_rate = round(_extended_to_float(comm[8:18]))
+            lossless = header[8:12] == b"AIFF" or comm[18:22] in _AIFC_LOSSLESS_TYPES
+            return AudioQuality(
+                "aiff", lossless, sample_rate, bit_depth if lossless else None, channels,
+                round(sample_rate * channels * bit_depth / 1000) if lossless else None,
+            )
+    return None
+
+
+# MP4 boxes on the way from the file to the sample descriptions
+_MP4_CONTAINERS = {b"moov", b"trak", b"mdia", b"minf", b"stbl"}
+
+
+def _iter_boxes(f: BinaryIO, offset: int, end: int) -> Iterator[Tuple[bytes, int, int]]:
+    """Yield (type, payload offset, payload end) of the MP4 boxes between offset and end."""
+    while offset + 8 <= end:
+        header = _read_at(f, offset, 16)
+        if len(header) < 8:
+            return
+        size, box_type = struct.unpack(">I4s", header[:8])
+        payload = offset + 8
+        if size == 1:
+            size = struct.unpack(">Q", header[8:16])[0]
+            payload += 8
+        elif size == 0:
+            size = end - offset
+        if size < payload - offset:
+            return
+        yield box_type, payload, offset + size
+        offset += size
+
+
+def _descriptor(data: bytes, position: int) -> Tuple[int, int, int]:
+    """Return (tag, payload position, payload length) of an MPEG-4 descriptor."""
+    tag = data[position]
+    position += 1
+    length = 0
+    for _ in range(4):
+        byte = data[position]
+        position += 1
+        length = length << 7 | (byte & 0x7F)
+        if not byte & 0x80:
+            break
+    return tag, position, length
+
+
+def _esds_bitrate(esds: bytes) -> Optional[int]:
+    """Return the average (or else maximum) bitrate in kbps from an esds box payload."""
+    tag, position, _ = _descriptor(esds, 4)
+    if tag != 0x03:
+        return None
+    flags = esds[position + 2]
+    position += 3
+    if flags & 0x80:
+        position += 2
+    if flags & 0x40:
+        position += 1 + esds[position]
+    if flags & 0x20:
+        position += 2
+
+    tag, position, _ = _descriptor(esds, position)
+    if tag != 0x04:
+        return None
+    max_bitrate, average_bitrate = struct.unpack(">II", esds[position + 5:position + 13])
+    bitrate = average_bitrate or max_bitrate
+    return round(bitrate / 1000) if bitrate else None
+
+
+def _find_sample_entry(f: BinaryIO, offset: int, end: int) -> Optional[Tuple[bytes, bytes]]:
+    """Find the first mp4a or alac sample entry below moov, returning (type, entry payload)."""
+    for box_type, payload, box_end in _iter_boxes(f, offset, end):
+        if box_type in _MP4_CONTAINERS:
+            found = _find_sample_entry(f, payload, box_end)
+            if found is not None:
+                return found
+        elif box_type == b"stsd":
+            for entry_type, entry_payload, entry_end in _iter_boxes(f, payload + 8, box_end):
+                if entry_type in (b"mp4a", b"alac"):
+                    return entry_type, _read_at(f, entry_payload, min(entry_end - entry_payload, 4096))
+    return None
+
+
+def _iter_boxes_in(data: bytes, offset: int) -> Iterator[Tuple[bytes, int, int]]:
+    """Yield (type, payload offset, payload end) of the MP4 boxes inside an in-memory buffer."""
+    while offset + 8 <= len(data):
+        size, box_type = struct.unpack(">I4s", data[offset:offset + 8])
+        if size < 8:
+            return
+        yield box_type, offset + 8, min(offset + size, len(data))
+        offset += size
+
+
+def probe_mp4(f: BinaryIO, file_size: int) -> Optional[AudioQuality]:
+    """Read the audio sample entry of an M4A file: esds for AAC, the alac box for Apple Lossless."""
+    header = _read_at(f, 4, 4)
+    if header != b"ftyp":
+        return None
+
+    found = _find_sample_entry(f, 0, file_size)
+    if found is None:
+        return None
+    entry_type, entry = found
+
+    # SampleEntry (8 bytes), then AudioSampleEntry: version, revision, vendor, channels, sample size, ..., rate
+    version, = struct.unpack(">H", entry[8:10])
+    channels, sample_size = struct.unpack(">HH", entry[16:20])
+    sample_rate = struct.unpack(">I", entry[24:28])[0] >> 16
+    children = 28 + {0: 0, 1: 16, 2: 36}.get(version, 0)
+
+    for box_type, payload, box_end in _iter_boxes_in(entry, children):
+        if entry_type == b"alac" and box_type == b"alac":
+            bit_depth, = struct.unpack(">B", entry[payload + 9:payload + 10])
+            channels, = struct.unpack(">B", entry[payload + 13:payload + 14])
+            average_bitrate, sample_rate = struct.unpack(">II", entry[payload + 20:payload + 28])
+            return AudioQuality("alac", True, sample_rate, bit_depth, channels, round(average_bitrate / 1000) or None)
+        if entry_type == b"mp4a" and box_type == b"esds":
+            return AudioQuality("aac", False, sample_rate, None, channels, _esds_bitrate(entry[payload:box_end]))
+
+    return AudioQuality(entry_type.decode("ascii"), entry_type == b"alac", sample_rate, sample_size if entry_type == b"alac" else None, channels, None)
+
+
+# Probes by file extension; unknown extensions try all of them
+PROBES = {
+    ".mp3": probe_mp3,
+    ".flac": probe_flac,
+    ".wav": probe_wav,
+    ".aif": probe_aiff,
+    ".aiff": probe_aiff,
+    ".m4a": probe_mp4,
+    ".mp4": probe_mp4,
+    ".aac": probe_mp4,
+    ".alac": probe_mp4,
+}
+
+
+def probe_file(path: str) -> Optional[AudioQuality]:
+    """
+    Read a file's stream properties from its container headers, without decoding audio.
+
+    Returns:
+        Optional[AudioQuality]: The properties, or None if the file is missing or not understood.
+    """
+    extension = os.path.splitext(path)[1].lower()
+    probe = PROBES.get(extension)
+    probes = [probe] if probe is not None else list(dict.fromkeys(PROBES.values()))
+
+    try:
+        file_size = os.path.getsize(path)
+        with open(path, "rb") as f:
+            for probe in probes:
+                quality = probe(f, file_size)
+                if quality is not None:
+                    return quality
+    except (OSError, struct.error, IndexError, ZeroDivisionError) as e:
+        logger.debug(f"Could not probe {path}: {e}")
+    return None
+
+
+class QualityProbe:
+    """
+    Probe files concurrently and cache the results by path, size and modification time.
+
+    Args:
+        cache_path (str): The SQLite cache file.
+        workers (int): Number of files probed concurrently.
+    """
+
+    def __init__(self, cache_path: str = "./data/quality_cache.db", workers: int = DEFAULT_WORKERS):
+        self.workers = workers
+        self.connection = sqlite3.connect(cache_path)
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS quality ("
+            "path TEXT PRIMARY KEY, size INTEGER NOT NULL, mtime_ns INTEGER NOT NULL, "
+            "codec TEXT, lossless INTEGER, sample_rate INTEGER, bit_depth INTEGER, channels INTEGER, bitrate INTEGER)"
+        )
+
+    def close(self):
+        self.connection.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def probe_all(self, paths: Iterable[str], progress_bar=None) -> Dict[str, AudioQuality]:
+        """
+        Probe every file, reusing cached results for files that did not change.
+
+        Args:
+            paths (Iterable[str]): The files.
+            progress_bar: Optional alive-progress bar, advanced once per file.
+
+        Returns:
+            Dict[str, AudioQuality]: The properties of every file that could be probed.
+        """
+        paths = list(dict.fromkeys(path for path in paths if path))
+        cached = {
+            row[0]: row[1:]
+            for row in self.connection.execute(
+                "SELECT path, size, mtime_ns, codec, lossless, sample_rate, bit_depth, channels, bitrate FROM quality"
+            )
+        }
+
+        def probe(path):
+            try:
+                stat = os.stat(path)
+            except OSError:
+                return None, None
+            key = (stat.st_size, stat.st_mtime_ns)
+            row = cached.get(path)
+            if row is not None and row[:2] == key:
+                return key, AudioQuality(row[2], bool(row[3]), *row[4:]) if row[2] is not None else None
+            return key, probe_file(path)
+
+        results = {}
+        updates = []
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            for path, (key, quality) in zip(paths, executor.map(probe, paths)):
+                if key is not None:
+                    if cached.get(path, (None, None))[:2] != key:
+                        updates.append((path, *key, *(quality or (None,) * len(AudioQuality._fields))))
+                    if quality is not None:
+                        results[path] = quality
+                if progress_bar is not None:
+                    progress_bar()
+
+        with self.connection:
+            self.connection.executemany(
+                "INSERT OR REPLACE INTO quality (path, size, mtime_ns, codec, lossless, sample_rate, bit_depth, channels, bitrate) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                updates,
+            )
+        return results
@@ -0,0 +1,173 @@
+import json
+import logging
+import os
+import shutil
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Callable, Dict, Iterable, List, NamedTuple, Optional
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_WORKERS = 8
+# Concurrent moves allowed per source device; cross-drive copies are disk bound
+DEFAULT_PER_DEVICE = 2
+# Bytes copied at a time when moving across devices
+COPY_BUFFER = 1024 * 1024
+
+
+class MoveResult(NamedTuple):
+    """Outcome of relocating one file."""
+    source: str
+    destination: Optional[str]
+    method: Optional[str]
+    error: Optional[str]
+
+
+class Relocator:
+    """
+    Move files into one folder with a bounded thread pool.
+
+    The destination folder is listed once up front and unique names are claimed
+    from that in-memory set under a lock, so collisions never need a stat call.
+    Names are compared case-folded on every platform, since NTFS and the default
+    APFS/HFS+ volumes ignore case. The final move never overwrites: a file that
+    appeared under the claimed name after the listing makes the move claim the
+    next free name instead.
+    Files on the destination's filesystem are moved with a hard link and unlink
+    (os.rename where links are not supported); the rest are copied into a newly
+    created file and then removed, with at most `per_device` copies running per
+    source device.
+
+    Args:
+        destination_folder (str): Folder the files are moved into.
+        workers (int): Size of the thread pool.
+        per_device (int): Concurrent moves allowed per source device.
+    """
+
+    def __init__(self, destination_folder: str, workers: int = DEFAULT_WORKERS, per_device: int = DEFAULT_PER_DEVICE):
+        os.makedirs(destination_folder, exist_ok=True)
+        self.destination_folder = destination_folder
+        self.workers = workers
+        self.per_device = per_device
+        self.destination_device = os.stat(destination_folder).st_dev
+
+        self._taken = {name.casefold() for name in os.listdir(destination_folder)}
+        self._lock = threading.Lock()
+        self._device_limits: Dict[int, threading.Semaphore] = {}
+
+    def reserve_name(self, filename: str) -> str:
+        """Claim a free name in the destination, appending " (n)" like the old loop did."""
+        name, extension = os.path.splitext(filename)
+        with self._lock:
+            candidate = filename
+            counter = 1
+            while candidate.casefold() in self._taken:
+                candidate = f"{name} ({counter}){extension}"
+                counter += 1
+            self._taken.add(candidate.casefold())
+        return os.path.join(self.destination_folder, candidate)
+
+    def _device_limit(self, device: int) -> threading.Semaphore:
+        with self._lock:
+            if device not in self._device_limits:
+                self._device_limits[device] = threading.Semaphore(self.per_device)
+            return self._device_limits[device]
+
+    def _release(self, destination: str):
+        with self._lock:
+            self._taken.discard(os.path.basename(destination).casefold())
+
+    @staticmethod
+    def _rename(source: str, destination: str):
+        """Rename within one filesystem, raising FileExistsError instead of replacing a file."""
+        try:
+            os.link(source, destination)
+        except FileExistsError:
+            raise
+        except OSError:
+            # No hard links on this filesystem (e.g. FAT); Windows' rename refuses to replace by itself
+            if os.path.lexists(destination):
+                raise FileExistsError(destination)
+            os.rename(source, destination)
+            return
+        os.unlink(source)
+
+    @staticmethod
+    def _copy(source: str, destination: str):
+        """Copy to another device and remove the source, raising FileExistsError instead of replacing a file."""
+        with open(source, "rb") as reader, open(destination, "xb") as writer:
+            try:
+                shutil.copyfileobj(reader, writer, COPY_BUFFER)
+            except BaseException:
+                writer.close()
+                os.remove(destination)
+                raise
+        shutil.copystat(source, destination)
+        os.remove(source)
+
+    def move(self, source: str) -> MoveResult:
+        """Move one file, returning the result instead of raising."""
+        try:
+            device = os.stat(source).st_dev
+        except FileNotFoundError:
+            return MoveResult(source, None, None, "not found")
+        except OSError as e:
+            return MoveResult(source, None, None, str(e))
+
+        while True:
+            destination = self.reserve_name(os.path.basename(source))
+            try:
+                if device == self.destination_device:
+                    self._rename(source, destination)
+                    return MoveResult(source, destination, "rename", None)
+
+                with self._device_limit(device):
+                    self._copy(source, destination)
+                return MoveResult(source, destination, "copy", None)
+            except FileExistsError:
+                # Created after the folder was listed: keep it claimed and try the next name
+                continue
+            except OSError as e:
+                self._release(destination)
+                return MoveResult(source, None, None, str(e))
+
+    def move_all(
+        self,
+        sources: Iterable[str],
+        manifest_path: str,
+        progress_bar=None,
+        on_result: Optional[Callable[[MoveResult], None]] = None,
+        append: bool = False,
+    ) -> List[MoveResult]:
+        """
+        Move every file and stream one JSON line per file to `manifest_path`.
+
+        Each line is written and flushed as soon as its move finishes, so the
+        manifest stays a usable record of what was moved if the run is interrupted.
+
+        Args:
+            sources (Iterable[str]): Files to move.
+            manifest_path (str): The JSONL manifest to write.
+            progress_bar: Optional alive-progress bar, advanced once per file.
+            on_result: Optional callback run on the calling thread after each move.
+            append (bool): Append to an existing manifest instead of replacing it.
+
+        Returns:
+            List[MoveResult]: One result per file, in completion order.
+        """
+        results = []
+        with open(manifest_path, "a" if append else "w", encoding="utf-8") as manifest, \
+                ThreadPoolExecutor(max_workers=self.workers) as executor:
+            futures = [executor.submit(self.move, source) for source in sources]
+            for future in as_completed(futures):
+                result = future.result()
+                results.append(result)
+                manifest.write(json.dumps(result._asdict()) + "\n")
+                manifest.flush()
+                if on_result is not None:
+                    on_result(result)
+                if progress_bar is not None:
+                    progress_bar()
+
+        return results
+
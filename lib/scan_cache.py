@@ -0,0 +1,149 @@
+import json
+import logging
+import sqlite3
+from typing import Any, Dict, List, NamedTuple, Set
+
+from pyrekordbox.db6 import tables
+from sqlalchemy import Text, func, type_coerce
+
+from lib.bulk import SQLITE_MAX_VARIABLES, chunked
+from lib.extract import YIELD_PER, iter_song_records
+
+logger = logging.getLogger(__name__)
+
+# Bump when the stored record format changes; older caches are rebuilt
+CACHE_VERSION = 4
+
+
+class RefreshResult(NamedTuple):
+    """Outcome of ScanCache.refresh."""
+    content_list: List[Dict[str, Any]]
+    changed_ids: Set[str]
+    deleted_ids: Set[str]
+
+
+def version_query(db):
+    """
+    Select every song ID with the change markers of all rows its record is built from.
+
+    MyTag links and tags are reduced to a count and their latest rb_local_usn and
+    updated_at per song, so adding, removing or renaming a tag shows up.
+    """
+    content = tables.DjmdContent
+    link = tables.DjmdSongMyTag
+    tag = tables.DjmdMyTag
+
+    tags = db.query(
+        link.ContentID.label("ContentID"),
+        func.count(link.ID).label("links"),
+        func.max(link.rb_local_usn).label("link_usn"),
+        func.max(type_coerce(link.updated_at, Text)).label("link_updated_at"),
+        func.max(tag.rb_local_usn).label("tag_usn"),
+        func.max(type_coerce(tag.updated_at, Text)).label("tag_updated_at"),
+    ).outerjoin(tag, tag.ID == link.MyTagID).group_by(link.ContentID).subquery()
+
+    return db.query(
+        content.ID,
+        content.rb_local_usn,
+        type_coerce(content.updated_at, Text),
+        tables.DjmdArtist.rb_local_usn,
+        type_coerce(tables.DjmdArtist.updated_at, Text),
+        tables.DjmdAlbum.rb_local_usn,
+        type_coerce(tables.DjmdAlbum.updated_at, Text),
+        tags.c.links,
+        tags.c.link_usn,
+        tags.c.link_updated_at,
+        tags.c.tag_usn,
+        tags.c.tag_updated_at,
+    ).outerjoin(tables.DjmdArtist, tables.DjmdArtist.ID == content.ArtistID)\
+        .outerjoin(tables.DjmdAlbum, tables.DjmdAlbum.ID == content.AlbumID)\
+        .outerjoin(tags, tags.c.ContentID == content.ID)
+
+
+class ScanCache:
+    """
+    Local SQLite cache of extracted song records.
+
+    Each record is stored with a version made of the `rb_local_usn` and
+    `updated_at` of its djmdContent row and of the rows its joined fields come
+    from: the artist, the album, and the song's MyTag links and tags (their count
+    and latest change). Renaming an artist or editing a song's MyTags therefore
+    re-extracts the song even though djmdContent is unchanged. A refresh reads
+    only these columns for the whole library, re-extracts the rows whose version
+    changed and drops rows that no longer exist.
+
+    The cache only saves re-extracting songs: duplicates must still be grouped over
+    the whole content_list, since a group found in an earlier run may never have
+    been deduplicated (the run was declined or aborted).
+
+    Args:
+        path (str): The SQLite cache file.
+    """
+
+    def __init__(self, path: str = "./data/song_cache.db"):
+        self.connection = sqlite3.connect(path)
+        if self.connection.execute("PRAGMA user_version").fetchone()[0] != CACHE_VERSION:
+            self.connection.execute("DROP TABLE IF EXISTS songs")
+            self.connection.execute(f"PRAGMA user_version = {CACHE_VERSION}")
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS songs ("
+            "ID TEXT PRIMARY KEY, version TEXT NOT NULL, record TEXT NOT NULL)"
+        )
+
+    def close(self):
+        self.connection.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def refresh(self, db) -> RefreshResult:
+        """
+        Bring the cache up to date with the database and return the song records.
+
+        Args:
+            db (Rekordbox6Database): An open database handle.
+
+        Returns:
+            RefreshResult: The full content_list in table order and the IDs that were
+            re-extracted or deleted.
+        """
+        cached = dict(self.connection.execute("SELECT ID, version FROM songs"))
+
+        order = []
+        changed = {}
+        for song_id, *columns in version_query(db).yield_per(YIELD_PER):
+            order.append(song_id)
+            version = "|".join(str(column) for column in columns)
+            if cached.get(song_id) != version:
+                changed[song_id] = version
+
+        deleted_ids = set(cached) - set(order)
+
+        for record in iter_song_records(db, list(changed)):
+            self.connection.execute(
+                "INSERT OR REPLACE INTO songs (ID, version, record) VALUES (?, ?, ?)",
+                (record["ID"], changed[record["ID"]], json.dumps(record)),
+            )
+
+        for batch in chunked(list(deleted_ids), SQLITE_MAX_VARIABLES):
+            self.connection.execute(f"DELETE FROM songs WHERE ID IN ({','.join('?' * len(batch))})", batch)
+
+        self.connection.commit()
+        logger.info(f"Scan cache: {len(changed)} songs re-extracted, {len(deleted_ids)} removed, {len(order) - len(changed)} reused")
+
+        records = {
+            song_id: record
+            for song_id, record in self.connection.execute("SELECT ID, record FROM songs")
+        }
+
+        content_list = []
+        for index, song_id in enumerate(order):
+            record = json.loads(records[song_id])
+            record["index"] = index
+            content_list.append(record)
+
+        return RefreshResult(content_list, set(changed), deleted_ids)
+
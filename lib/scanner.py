@@ -0,0 +1,181 @@
+import json
+import logging
+import os
+import sqlite3
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Dict, Iterable, List, NamedTuple, Optional, Set, Tuple
+
+from lib.locations import DEFAULT_WORKERS, check_exists
+
+logger = logging.getLogger(__name__)
+
+# Files under the music roots that count as tracks for the orphan report
+AUDIO_EXTENSIONS = {".mp3", ".wav", ".aif", ".aiff", ".flac", ".m4a", ".aac", ".alac", ".ogg"}
+
+# (name, is_dir) per directory entry
+Entries = List[Tuple[str, bool]]
+
+
+def normalize_path(path: str) -> str:
+    """Normalize separators and case so library paths and scanned paths compare equal."""
+    return os.path.normcase(os.path.normpath(path))
+
+
+class ScanReport(NamedTuple):
+    """Outcome of Scanner.scan."""
+    exists: Dict[str, bool]
+    missing: List[str]
+    orphans: List[str]
+    directories_listed: int
+    directories_cached: int
+
+
+def _list_directory(path: str, mtime_ns: int, cached: Optional[Tuple[int, Entries]]) -> Tuple[str, int, Optional[Entries], bool]:
+    """List one directory, or reuse the cached listing if its mtime is unchanged."""
+    if cached is not None and cached[0] == mtime_ns:
+        return path, mtime_ns, cached[1], True
+
+    try:
+        with os.scandir(path) as it:
+            entries = [(entry.name, entry.is_dir(follow_symlinks=False)) for entry in it]
+    except OSError as e:
+        logger.warning(f"Could not list {path}: {e}")
+        return path, mtime_ns, None, False
+    return path, mtime_ns, entries, False
+
+
+def _directory_mtime(path: str) -> Optional[int]:
+    try:
+        return os.stat(path).st_mtime_ns
+    except OSError:
+        return None
+
+
+class Scanner:
+    """
+    Walk the music roots in a thread pool and compare them with the library.
+
+    Directory listings are cached in a local SQLite file keyed by the directory's
+    mtime, which changes whenever an entry is added, removed or renamed, so a repeat
+    scan only lists the folders that changed.
+
+    Args:
+        roots (Iterable[str]): Music folders to walk, e.g. `music_roots` from config.json.
+        cache_path (str): The SQLite cache file.
+        workers (int): Number of directories listed concurrently.
+    """
+
+    def __init__(self, roots: Iterable[str], cache_path: str = "./data/directory_cache.db", workers: int = DEFAULT_WORKERS):
+        self.roots = [root for root in roots if root]
+        self.workers = workers
+        self.connection = sqlite3.connect(cache_path)
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS directories (path TEXT PRIMARY KEY, mtime_ns INTEGER NOT NULL, entries TEXT NOT NULL)"
+        )
+
+    def close(self):
+        self.connection.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def walk(self) -> Tuple[Set[str], int, int]:
+        """
+        List every directory below the roots.
+
+        Returns:
+            Tuple[Set[str], int, int]: Normalized paths of the audio files found, and
+            the number of directories listed and taken from the cache.
+        """
+        cached = {
+            path: (mtime_ns, json.loads(entries))
+            for path, mtime_ns, entries in self.connection.execute("SELECT path, mtime_ns, entries FROM directories")
+        }
+
+        files = set()
+        listed = reused = 0
+        updates = []
+
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            def submit(path):
+                # Stat in the worker too: the mtime decides whether the cache can be used
+                return executor.submit(lambda: _list_directory(path, _directory_mtime(path), cached.get(path)))
+
+            pending = {submit(root) for root in self.roots}
+            while pending:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    path, mtime_ns, entries, from_cache = future.result()
+                    if entries is None or mtime_ns is None:
+                        continue
+
+                    if from_cache:
+                        reused += 1
+                    else:
+                        listed += 1
+                        updates.append((path, mtime_ns, json.dumps(entries)))
+
+                    for name, is_dir in entries:
+                        child = os.path.join(path, name)
+                        if is_dir:
+                            pending.add(submit(child))
+                        elif os.path.splitext(name)[1].lower() in AUDIO_EXTENSIONS:
+                            files.add(normalize_path(child))
+
+        with self.connection:
+            self.connection.executemany(
+                "INSERT OR REPLACE INTO directories (path, mtime_ns, entries) VALUES (?, ?, ?)", updates
+            )
+
+        return files, listed, reused
+
+    def scan(self, library_paths: Iterable[str]) -> ScanReport:
+        """
+        Check the library's files against the disk.
+
+        Paths below a music root are looked up in the walked file set; any other
+        path is checked with one directory listing per folder.
+
+        Args:
+            library_paths (Iterable[str]): FolderPath of every song.
+
+        Returns:
+            ScanReport: Existence per library path, missing library files and
+            audio files under the roots that no song points to.
+        """
+        library_paths = [path for path in library_paths if path]
+        on_disk, listed, reused = self.walk() if self.roots else (set(), 0, 0)
+        roots = [normalize_path(root) for root in self.roots]
+
+        def under_root(path):
+            return any(path == root or path.startswith(root.rstrip(os.sep) + os.sep) for root in roots)
+
+        exists = {}
+        outside = []
+        for path in library_paths:
+            normalized = normalize_path(path)
+            if under_root(normalized):
+                exists[path] = normalized in on_disk
+            else:
+                outside.append(path)
+        exists.update(check_exists(outside, self.workers))
+
+        in_library = {normalize_path(path) for path in library_paths}
+        return ScanReport(
+            exists=exists,
+            missing=sorted(path for path, found in exists.items() if not found),
+            orphans=sorted(on_disk - in_library),
+            directories_listed=listed,
+            directories_cached=reused,
+        )
+
+
+def write_reports(report: ScanReport, missing_path: str = "./data/missing_files.json", orphan_path: str = "./data/orphan_files.json"):
+    """Write the missing and orphan file lists to JSON."""
+    with open(missing_path, "w", encoding="utf-8") as f:
+        json.dump(report.missing, f, indent=4)
+    with open(orphan_path, "w", encoding="utf-8") as f:
+        json.dump(report.orphans, f, indent=4)
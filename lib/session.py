@@ -0,0 +1,156 @@
+import logging
+import sys
+import time
+from contextlib import contextmanager, nullcontext
+from functools import partial
+from typing import Any, Callable, Dict, List, Optional
+
+from pyrekordbox import Rekordbox6Database
+from sqlalchemy import event
+
+from lib.profiling import Profiler
+from lib.working_copy import WorkingCopy
+
+logger = logging.getLogger(__name__)
+
+# Applied to every connection of the run: a 256 MiB page cache, temporary tables
+# and indexes in memory, and memory-mapped reads of up to 256 MiB of the file
+BULK_PRAGMAS = {
+    "cache_size": -262144,
+    "temp_store": "MEMORY",
+    "mmap_size": 268435456,
+}
+
+
+def apply_pragmas(engine, pragmas: Dict[str, Any]):
+    """Run the given PRAGMA statements on every new connection of `engine`."""
+    def on_connect(dbapi_connection, _connection_record):
+        cursor = dbapi_connection.cursor()
+        for name, value in pragmas.items():
+            cursor.execute(f"PRAGMA {name} = {value}")
+        cursor.close()
+
+    event.listen(engine, "connect", on_connect)
+    # Connections opened before the listener existed would miss the pragmas
+    engine.dispose()
+
+
+def open_database(path: Optional[str] = None, key: str = "", plain: bool = False) -> Rekordbox6Database:
+    """
+    Open a Rekordbox database, the live master.db from the Rekordbox config by default.
+
+    Args:
+        path (Optional[str]): A master.db file, e.g. a copy or a test fixture.
+        key (str): The SQLCipher key; pyrekordbox reads it from the Rekordbox config if empty.
+        plain (bool): Open `path` as an unencrypted SQLite file.
+
+    Returns:
+        Rekordbox6Database: The open database handle.
+    """
+    if plain and not path:
+        raise ValueError("--plain needs a database file given with --db=PATH")
+    return Rekordbox6Database(path, key=key, unlock=not plain)
+
+
+def database_opener(argv: Optional[List[str]] = None) -> Callable[[], Rekordbox6Database]:
+    """
+    Build the database opener selected on the command line.
+
+    `--db=PATH` opens another master.db instead of the live one, `--key=KEY` unlocks
+    it with the given key and `--plain` opens it without encryption.
+    """
+    argv = sys.argv if argv is None else argv
+    options = {}
+    for arg in argv:
+        for name in ("db", "key"):
+            if arg.startswith(f"--{name}="):
+                options[name] = arg.split("=", 1)[1]
+
+    return partial(open_database, options.get("db"), key=options.get("key", ""), plain="--plain" in argv)
+
+
+class PipelineSession:
+    """
+    One database handle shared by every stage of a run, with per-stage timings.
+
+    The Rekordbox config, the SQLCipher key and master.db are read once when the
+    session opens; stages receive `session.db` instead of opening their own. With
+    `in_memory`, the handle works on a WorkingCopy of the database in RAM, which only
+    reaches the disk through `write_back`. A Profiler, if given, measures every stage
+    and the statements run on the handle.
+
+    Usage:
+        with PipelineSession() as session:
+            with session.stage("dump_songs"):
+                content_list = dump_song_data(session.db)
+        session.log_timings()
+
+    Args:
+        opener (Callable[[], Rekordbox6Database]): Opens the database handle, see database_opener.
+        pragmas (Optional[Dict[str, Any]]): PRAGMAs for every connection, None to keep SQLite's defaults.
+        in_memory (bool): Load the database into memory and work on the copy.
+        profiler (Optional[Profiler]): Profiles the run, see get_profiler.
+    """
+
+    def __init__(self, opener: Callable[[], Rekordbox6Database] = Rekordbox6Database, pragmas: Optional[Dict[str, Any]] = BULK_PRAGMAS, in_memory: bool = False, profiler: Optional[Profiler] = None):
+        self.opener = opener
+        self.pragmas = pragmas
+        self.in_memory = in_memory
+        self.profiler = profiler
+        self.db: Optional[Rekordbox6Database] = None
+        self.working_copy: Optional[WorkingCopy] = None
+        self.timings: Dict[str, float] = {}
+
+    def open(self) -> Rekordbox6Database:
+        with self.stage("connect"):
+            self.db = self.opener()
+            if self.in_memory:
+                self.working_copy = WorkingCopy(self.db)
+                self.working_copy.load(self.pragmas)
+            elif self.pragmas:
+                apply_pragmas(self.db.engine, self.pragmas)
+            if self.profiler is not None:
+                self.profiler.attach(self.db.engine)
+        return self.db
+
+    def write_back(self):
+        """Write the in-memory working copy to disk; does nothing when working on the file directly."""
+        if self.working_copy is not None:
+            with self.stage("write_back"):
+                self.working_copy.write_back()
+
+    def close(self):
+        if self.db is not None:
+            self.db.close()
+            self.db = None
+        if self.working_copy is not None:
+            if self.working_copy.unsaved:
+                logger.warning(f"Changes to the in-memory copy of {self.working_copy.path} were not written back")
+            self.working_copy.close()
+            self.working_copy = None
+
+    def __enter__(self):
+        self.open()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    @contextmanager
+    def stage(self, name: str):
+        """Time a stage of the run; repeated stages add up."""
+        start = time.perf_counter()
+        try:
+            with self.profiler.stage(name) if self.profiler is not None else nullcontext():
+                yield
+        finally:
+            self.timings[name] = self.timings.get(name, 0.0) + time.perf_counter() - start
+
+    def log_timings(self):
+        """Log the time spent in every stage, including connection setup."""
+        if not self.timings:
+            return
+        total = sum(self.timings.values())
+        logger.info("Stage timings: " + ", ".join(
+            f"{name} {seconds:.3f}s ({seconds / total:.0%})" for name, seconds in self.timings.items()
+        ))
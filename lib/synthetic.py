@@ -0,0 +1,131 @@
+import os
+import random
+import sqlite3
+from typing import Any, Dict, Iterable, List, NamedTuple, Tuple
+
+from pyrekordbox.db6 import tables
+from sqlalchemy import create_engine
+
+TIMESTAMP = "2023-01-01 10:00:00.000 +00:00"
+
+
+class SyntheticSpec(NamedTuple):
+    """Shape of a generated library."""
+    tracks: int
+    # Fraction of tracks that repeat the artist and title of another track
+    duplicate_ratio: float = 0.2
+    playlists: int = 200
+    playlist_size: int = 100
+    artists: int = 2000
+    seed: int = 0
+
+
+class _TableWriter:
+    """Bulk insert rows into one table, filling NOT NULL columns that were not given."""
+
+    def __init__(self, connection: sqlite3.Connection, table: str, columns: Iterable[str]):
+        info = connection.execute(f"PRAGMA table_info({table})").fetchall()
+        given = list(columns)
+        filler = {
+            name: 0 if any(kind in (column_type or "").upper() for kind in ("INT", "FLOAT", "REAL")) else ""
+            for _, name, column_type, not_null, _, _ in info
+            if not_null and name not in given
+        }
+        self.connection = connection
+        self.filler = tuple(filler.values())
+        names = given + list(filler)
+        self.statement = f"INSERT INTO {table} ({', '.join(names)}) VALUES ({', '.join('?' * len(names))})"
+
+    def write(self, rows: Iterable[Tuple[Any, ...]]):
+        self.connection.executemany(self.statement, (row + self.filler for row in rows))
+
+
+def _content_rows(spec: SyntheticSpec, rng: random.Random) -> Iterable[Tuple[Any, ...]]:
+    unique_titles = max(1, int(spec.tracks * (1 - spec.duplicate_ratio)))
+    for i in range(spec.tracks):
+        # The first unique_titles tracks are distinct, the rest repeat one of them
+        title = i if i < unique_titles else rng.randrange(unique_titles)
+        imported = rng.random() < 0.1
+        created = f"2023-{1 + i % 12:02d}-{1 + i % 28:02d} {i % 24:02d}:{i % 60:02d}:{(i // 60) % 60:02d}.{i % 1000:03d} +00:00"
+        yield (
+            str(i + 1),
+            f"/Music/{'Imported from Device/' if imported else ''}Artist {title % spec.artists}/track{i}.mp3",
+            f"Title {title}",
+            str(title % spec.artists),
+            str(1 + title % 500),
+            rng.choice((128, 256, 320, 320)),
+            12000 + title % 6000,
+            180 + title % 240,
+            5_000_000 + title % 5_000_000,
+            created,
+            created,
+            i,
+            f"uuid-{i + 1}",
+        )
+
+
+def generate_database(path: str, spec: SyntheticSpec) -> Dict[str, int]:
+    """
+    Create a plain SQLite file with the pyrekordbox schema and a synthetic library.
+
+    The file opens with `Rekordbox6Database(path, unlock=False)`: it holds the
+    `localUpdateCount` registry row that commits increment, plus artists, albums,
+    tracks with duplicate titles, cues, MyTags and playlists.
+
+    Args:
+        path (str): The database file to create, replaced if it exists.
+        spec (SyntheticSpec): Library size and shape.
+
+    Returns:
+        Dict[str, int]: Number of rows written per table.
+    """
+    if os.path.exists(path):
+        os.remove(path)
+
+    engine = create_engine(f"sqlite:///{path}")
+    tables.Base.metadata.create_all(engine)
+    engine.dispose()
+
+    rng = random.Random(spec.seed)
+    connection = sqlite3.connect(path)
+    connection.execute("PRAGMA journal_mode = OFF")
+    connection.execute("PRAGMA synchronous = OFF")
+    counts = {}
+
+    def write(table: str, columns: List[str], rows: List[Tuple[Any, ...]]):
+        _TableWriter(connection, table, columns + ["created_at", "updated_at"]).write(
+            row + (TIMESTAMP, TIMESTAMP) for row in rows
+        )
+        counts[table] = len(rows)
+
+    write("agentRegistry", ["registry_id", "int_1"], [("localUpdateCount", spec.tracks)])
+    write("djmdArtist", ["ID", "Name"], [(str(i), f"Artist {i}") for i in range(spec.artists)])
+    write("djmdAlbum", ["ID", "Name"], [(str(i), f"Album {i}") for i in range(1, 501)])
+    write("djmdMyTag", ["ID", "Name"], [(str(i), f"Tag {i}") for i in range(1, 21)])
+
+    content_columns = [
+        "ID", "FolderPath", "Title", "ArtistID", "AlbumID", "BitRate", "BPM", "Length",
+        "FileSize", "created_at", "updated_at", "rb_local_usn", "UUID",
+    ]
+    _TableWriter(connection, "djmdContent", content_columns).write(_content_rows(spec, rng))
+    counts["djmdContent"] = spec.tracks
+
+    write("djmdCue", ["ID", "ContentID", "InMsec", "Kind"], [
+        (str(i), str(i + 1), 1000 * (i % 7), 0) for i in range(0, spec.tracks, 2)
+    ])
+    write("djmdSongMyTag", ["ID", "MyTagID", "ContentID"], [
+        (str(i), str(1 + i % 20), str(i + 1)) for i in range(0, spec.tracks, 3)
+    ])
+
+    write("djmdPlaylist", ["ID", "Name", "Attribute", "ParentID", "Seq"], [
+        (str(p + 1), f"Playlist {p}", 0, "root", p) for p in range(spec.playlists)
+    ])
+    entries = []
+    for p in range(spec.playlists):
+        for track_no in range(1, spec.playlist_size + 1):
+            entries.append((str(len(entries) + 1), str(p + 1), str(rng.randint(1, spec.tracks)), track_no))
+    write("djmdSongPlaylist", ["ID", "PlaylistID", "ContentID", "TrackNo"], entries)
+
+    connection.commit()
+    connection.close()
+    return counts
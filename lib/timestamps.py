@@ -0,0 +1,48 @@
+from datetime import datetime, timedelta, timezone
+from functools import lru_cache
+from typing import Optional
+
+EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+MILLISECOND = timedelta(milliseconds=1)
+
+
+@lru_cache(maxsize=65536)
+def parse_timestamp(value: Optional[str]) -> Optional[int]:
+    """
+    Parse a Rekordbox date string to epoch milliseconds.
+
+    Rekordbox writes `YYYY-MM-DD HH:MM:SS.SSS +00:00`, with a space before the
+    offset that datetime.fromisoformat does not accept. Plain ISO strings with or
+    without an offset are accepted as well; naive values are taken as UTC. Results
+    are cached because whole batches of tracks share an import timestamp.
+
+    Args:
+        value (Optional[str]): The date string as stored in the database.
+
+    Returns:
+        Optional[int]: Milliseconds since the epoch, None if the value is empty or unparseable.
+    """
+    if not value:
+        return None
+
+    text = value.strip()
+    try:
+        parsed = datetime.fromisoformat(text)
+    except ValueError:
+        head, _, offset = text.rpartition(" ")
+        try:
+            parsed = datetime.fromisoformat(head + offset)
+        except ValueError:
+            return None
+
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=timezone.utc)
+
+    return (parsed - EPOCH) // MILLISECOND
+
+
+def format_timestamp(milliseconds: Optional[int]) -> Optional[str]:
+    """Format epoch milliseconds as `YYYY-MM-DD HH:MM:SS.SSS` (UTC) for output files."""
+    if milliseconds is None:
+        return None
+    return (EPOCH + milliseconds * MILLISECOND).strftime("%Y-%m-%d %H:%M:%S.%f")[:-3]
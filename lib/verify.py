@@ -0,0 +1,209 @@
+import hashlib
+import json
+import logging
+import mmap
+import os
+import sqlite3
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Iterable, List, NamedTuple, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Bytes hashed from each end of a file for the partial hash
+PARTIAL_BYTES = 64 * 1024
+# Slice of the memory map fed to the full hash at a time
+FULL_HASH_CHUNK = 8 * 1024 * 1024
+DEFAULT_WORKERS = 8
+
+# (size, mtime_ns) of a file
+Stat = Tuple[int, int]
+
+
+class GroupCheck(NamedTuple):
+    """Byte-level comparison of the files of one duplicate group, as positions in the group."""
+    # Positions with byte-identical files, largest cluster first
+    clusters: List[List[int]]
+    missing: List[int]
+
+    @property
+    def identical(self) -> bool:
+        """True if every file of the group exists and all of them have the same bytes."""
+        return len(self.clusters) == 1 and not self.missing
+
+
+def partial_hash(path: str, size: int) -> str:
+    """Hash the first and last PARTIAL_BYTES of a file."""
+    digest = hashlib.blake2b(digest_size=16)
+    with open(path, "rb") as f:
+        digest.update(f.read(PARTIAL_BYTES))
+        if size > PARTIAL_BYTES:
+            f.seek(max(PARTIAL_BYTES, size - PARTIAL_BYTES))
+            digest.update(f.read(PARTIAL_BYTES))
+    return digest.hexdigest()
+
+
+def full_hash(path: str) -> str:
+    """Hash a whole file with BLAKE2b, reading it through a memory map."""
+    digest = hashlib.blake2b()
+    with open(path, "rb") as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return digest.hexdigest()
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            view = memoryview(mapped)
+            try:
+                for start in range(0, len(view), FULL_HASH_CHUNK):
+                    digest.update(view[start:start + FULL_HASH_CHUNK])
+            finally:
+                view.release()
+    return digest.hexdigest()
+
+
+def _stat(path: str) -> Optional[Stat]:
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return stat.st_size, stat.st_mtime_ns
+
+
+class ByteVerifier:
+    """
+    Find byte-identical files in tiers: file size, then a partial hash, then a full hash.
+
+    Only files that share a size with another file of the same group get a partial
+    hash, and only files that also share the partial hash are read in full, so most
+    files are never opened. Hashing runs in a thread pool (hashlib releases the GIL
+    on large buffers) and both hashes are cached in a local SQLite file keyed by
+    path, size and modification time.
+
+    Args:
+        cache_path (str): The SQLite hash cache.
+        workers (int): Number of files hashed concurrently.
+    """
+
+    def __init__(self, cache_path: str = "./data/hash_cache.db", workers: int = DEFAULT_WORKERS):
+        self.workers = workers
+        self.connection = sqlite3.connect(cache_path)
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS hashes ("
+            "path TEXT PRIMARY KEY, size INTEGER NOT NULL, mtime_ns INTEGER NOT NULL, partial TEXT, full TEXT)"
+        )
+
+    def close(self):
+        self.connection.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def _hashes(self, executor: ThreadPoolExecutor, kind: str, paths: Iterable[str], stats: Dict[str, Stat],
+                cached: Dict[str, Dict[str, Optional[str]]], progress_bar=None) -> Dict[str, Optional[str]]:
+        """Return the `kind` hash of every path, computing only the ones not cached for the current stat."""
+        result = {}
+        todo = []
+        for path in dict.fromkeys(paths):
+            value = cached.get(path, {}).get(kind)
+            if value is not None:
+                result[path] = value
+            else:
+                todo.append(path)
+
+        def compute(path):
+            try:
+                return partial_hash(path, stats[path][0]) if kind == "partial" else full_hash(path)
+            except (OSError, ValueError) as e:
+                logger.warning(f"Could not hash {path}: {e}")
+                return None
+
+        for path, value in zip(todo, executor.map(compute, todo)):
+            result[path] = value
+            if value is not None:
+                cached.setdefault(path, {"partial": None, "full": None})[kind] = value
+            if progress_bar is not None:
+                progress_bar()
+
+        self.connection.executemany(
+            "INSERT OR REPLACE INTO hashes (path, size, mtime_ns, partial, full) VALUES (?, ?, ?, ?, ?)",
+            ((path, *stats[path], cached[path]["partial"], cached[path]["full"]) for path in todo if path in cached),
+        )
+        self.connection.commit()
+        return result
+
+    def check_groups(self, groups: List[List[str]], progress_bar=None) -> List[GroupCheck]:
+        """
+        Compare the files inside each group byte for byte.
+
+        Args:
+            groups (List[List[str]]): File paths of every duplicate group.
+            progress_bar: Optional alive-progress bar, advanced once per hashed file.
+
+        Returns:
+            List[GroupCheck]: One result per group.
+        """
+        all_paths = list(dict.fromkeys(path for group in groups for path in group if path))
+
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            stats = {path: stat for path, stat in zip(all_paths, executor.map(_stat, all_paths)) if stat is not None}
+
+            # Cached hashes only count while the file keeps its size and modification time
+            cached = {}
+            for path, size, mtime_ns, partial, full in self.connection.execute("SELECT path, size, mtime_ns, partial, full FROM hashes"):
+                if stats.get(path) == (size, mtime_ns):
+                    cached[path] = {"partial": partial, "full": full}
+
+            def candidates(key_of):
+                """Paths sharing their group's key with another path of the group."""
+                buckets = defaultdict(set)
+                for number, group in enumerate(groups):
+                    for path in group:
+                        key = key_of(path)
+                        if key is not None:
+                            buckets[(number, key)].add(path)
+                return {path for bucket in buckets.values() if len(bucket) > 1 for path in bucket}
+
+            same_size = candidates(lambda path: stats.get(path, (None,))[0])
+            partials = self._hashes(executor, "partial", same_size, stats, cached, progress_bar)
+            same_partial = candidates(lambda path: (stats[path][0], partials[path]) if partials.get(path) else None)
+            fulls = self._hashes(executor, "full", same_partial, stats, cached, progress_bar)
+
+        checks = []
+        for group in groups:
+            clusters = defaultdict(list)
+            missing = []
+            for position, path in enumerate(group):
+                if path not in stats:
+                    missing.append(position)
+                elif fulls.get(path) is not None:
+                    clusters[fulls[path]].append(position)
+                else:
+                    # Unique size or partial hash within the group: no other file can match
+                    clusters[("unique", path)].append(position)
+            checks.append(GroupCheck(sorted(clusters.values(), key=len, reverse=True), missing))
+        return checks
+
+    def identical_groups(self, paths: List[str], progress_bar=None) -> List[List[int]]:
+        """
+        Group byte-identical files among all `paths`, as lists of positions in `paths`.
+
+        Useful to find copies of one file that were imported with different tags.
+        """
+        check = self.check_groups([paths], progress_bar)[0]
+        return [cluster for cluster in check.clusters if len(cluster) > 1]
+
+
+def write_report(groups: List[List[str]], checks: List[GroupCheck], path: str = "./data/verify_report.json"):
+    """Write the groups whose files are not all byte-identical, with their clusters and missing files."""
+    report = [
+        {
+            "paths": group,
+            "clusters": [[group[position] for position in cluster] for cluster in check.clusters],
+            "missing": [group[position] for position in check.missing],
+        }
+        for group, check in zip(groups, checks)
+        if not check.identical
+    ]
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=4)
@@ -0,0 +1,207 @@
+import logging
+import os
+import shutil
+import sqlite3
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Dict, Optional, Tuple
+
+from pyrekordbox import Rekordbox6Database
+from sqlalchemy import create_engine
+from sqlalchemy.pool import StaticPool
+
+try:
+    from sqlcipher3 import dbapi2 as sqlcipher
+except ImportError:
+    sqlcipher = None
+
+logger = logging.getLogger(__name__)
+
+# (size, mtime_ns) of master.db and its WAL file, None for a missing file
+Signature = Tuple[Optional[Tuple[int, int]], Optional[Tuple[int, int]]]
+
+
+def _file_signature(path: str) -> Optional[Tuple[int, int]]:
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return stat.st_size, stat.st_mtime_ns
+
+
+class WorkingCopy:
+    """
+    Run a pipeline against an in-memory copy of master.db and write it back atomically.
+
+    `load` copies the database of an open Rekordbox6Database into RAM and rebinds the
+    handle to it, so every later statement and commit runs at memory speed while the
+    file on disk is left alone. `write_back` checks the copy's integrity, exports it
+    next to master.db and swaps it in with os.replace, after keeping a backup of the
+    original. The file is only locked while it is read and replaced.
+
+    Plain databases are copied with the SQLite backup API. Encrypted ones are copied
+    with sqlcipher_export, since the backup API cannot change the encryption.
+
+    Args:
+        db (Rekordbox6Database): An open handle on the database file.
+        backup_folder (str): Folder the original master.db is copied to before it is first replaced.
+    """
+
+    def __init__(self, db: Rekordbox6Database, backup_folder: str = "./data/backups"):
+        url = db.engine.url
+        self.db = db
+        self.path = url.database
+        self.key = url.password or ""
+        self.encrypted = "pysqlcipher" in url.drivername
+        self.backup_folder = backup_folder
+        self.backup_path: Optional[str] = None
+        self.memory = None
+        self.journal_mode = "delete"
+        self.user_version = 0
+        self.signature: Optional[Signature] = None
+        self.saved_changes = 0
+
+    def _module(self):
+        if not self.encrypted:
+            return sqlite3
+        if sqlcipher is None:
+            raise ImportError("Could not copy the encrypted database: 'sqlcipher3' package not found")
+        return sqlcipher
+
+    def _connect(self, path: str):
+        """Open a plain connection to a database file, unlocked with the key if needed."""
+        connection = self._module().connect(path)
+        if self.encrypted:
+            connection.execute(f"PRAGMA key = '{self.key}'")
+        return connection
+
+    def _signature(self) -> Signature:
+        return _file_signature(self.path), _file_signature(f"{self.path}-wal")
+
+    def load(self, pragmas: Optional[Dict[str, Any]] = None):
+        """
+        Copy the database into memory and point `db` at the copy.
+
+        Args:
+            pragmas (Optional[Dict[str, Any]]): PRAGMAs for the in-memory connection.
+        """
+        module = self._module()
+        self.memory = module.connect(":memory:", check_same_thread=False)
+
+        source = self._connect(self.path)
+        try:
+            self.journal_mode = source.execute("PRAGMA journal_mode").fetchone()[0]
+            self.user_version = source.execute("PRAGMA user_version").fetchone()[0]
+            if self.encrypted:
+                source.close()
+                self.memory.execute("ATTACH DATABASE ? AS source KEY ?", (self.path, self.key))
+                self.memory.execute("SELECT sqlcipher_export('main', 'source')")
+                self.memory.execute("DETACH DATABASE source")
+                self.memory.execute(f"PRAGMA main.user_version = {int(self.user_version)}")
+            else:
+                source.backup(self.memory)
+        finally:
+            source.close()
+        self.signature = self._signature()
+        self.saved_changes = self.memory.total_changes
+
+        for name, value in (pragmas or {}).items():
+            self.memory.execute(f"PRAGMA {name} = {value}")
+
+        # Swap the handle's engine for one that always hands out the in-memory connection
+        memory = self.memory
+        self.db.close()
+        self.db.engine.dispose()
+        self.db.engine = create_engine("sqlite://", module=module, creator=lambda: memory, poolclass=StaticPool)
+        self.db.open()
+
+        pages = self.memory.execute("PRAGMA page_count").fetchone()[0] * self.memory.execute("PRAGMA page_size").fetchone()[0]
+        logger.info(f"Loaded {self.path} into memory ({pages / 2 ** 20:.1f} MB)")
+
+    def _export(self, path: str):
+        """Write the in-memory database to a new file."""
+        if os.path.exists(path):
+            os.remove(path)
+
+        if self.encrypted:
+            self.memory.execute("ATTACH DATABASE ? AS target KEY ?", (path, self.key))
+            try:
+                self.memory.execute("SELECT sqlcipher_export('target')")
+                self.memory.execute(f"PRAGMA target.user_version = {int(self.user_version)}")
+            finally:
+                self.memory.execute("DETACH DATABASE target")
+        else:
+            target = sqlite3.connect(path)
+            try:
+                self.memory.backup(target)
+            finally:
+                target.close()
+
+        # Verify the written file and give it the journal mode of the original
+        target = self._connect(path)
+        try:
+            result = target.execute("PRAGMA quick_check").fetchone()[0]
+            if result != "ok":
+                raise RuntimeError(f"The exported database failed its check: {result}")
+            target.execute(f"PRAGMA journal_mode = {self.journal_mode}")
+        finally:
+            target.close()
+
+    def write_back(self) -> str:
+        """
+        Replace master.db with the in-memory database.
+
+        Everything must be committed. The write is refused if the copy fails its
+        integrity check or if master.db changed on disk since it was loaded.
+
+        Returns:
+            str: The backup of the original master.db.
+        """
+        if self.memory is None:
+            raise RuntimeError("The working copy is not loaded")
+        if self.memory.in_transaction:
+            raise RuntimeError("Commit the working copy before writing it back")
+
+        result = self.memory.execute("PRAGMA integrity_check").fetchone()[0]
+        if result != "ok":
+            raise RuntimeError(f"The in-memory database failed its integrity check, {self.path} was not changed: {result}")
+
+        if self._signature() != self.signature:
+            raise RuntimeError(f"{self.path} changed on disk since it was loaded (is Rekordbox running?), not overwriting it")
+
+        temporary_path = f"{self.path}.dedup-tmp"
+        self._export(temporary_path)
+
+        # Fold any WAL content into the original so the backup and the swap see the whole file
+        source = self._connect(self.path)
+        try:
+            source.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+        finally:
+            source.close()
+
+        if self.backup_path is None:
+            Path(self.backup_folder).mkdir(parents=True, exist_ok=True)
+            name = Path(self.path)
+            self.backup_path = str(Path(self.backup_folder) / f"{name.stem}.{datetime.now():%Y%m%d-%H%M%S}{name.suffix}")
+            shutil.copy2(self.path, self.backup_path)
+
+        os.replace(temporary_path, self.path)
+        for suffix in ("-wal", "-shm"):
+            if os.path.exists(self.path + suffix):
+                os.remove(self.path + suffix)
+
+        self.signature = self._signature()
+        self.saved_changes = self.memory.total_changes
+        logger.info(f"Wrote the in-memory database back to {self.path}, original kept at {self.backup_path}")
+        return self.backup_path
+
+    @property
+    def unsaved(self) -> bool:
+        """True if the in-memory database changed since it was loaded or last written back."""
+        return self.memory is not None and self.memory.total_changes != self.saved_changes
+
+    def close(self):
+        if self.memory is not None:
+            self.db.engine.dispose()
+            self.memory.close()
+            self.memory = None
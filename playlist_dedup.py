@@ -1,14 +1,13 @@
-from colorama import init, Fore, Style
-
-from sqlalchemy.orm import aliased
-from sqlalchemy.sql import exists
+import sys
 
+from colorama import init, Fore, Style
 
 from alive_progress import alive_bar
-from pyrekordbox import Rekordbox6Database
 from pyrekordbox.db6 import tables
 
 from lib.colours import *
+from lib.playlists import deduplicate_playlists, playlist_subtree_ids
+from lib.session import database_opener
 
 
 
@@ -32,30 +31,58 @@ def get_playlist_choice(playlists):
 
 def deduplicate_playlist(db, playlist_id):
     """Deduplicate entries in the specified playlist."""
-    sp1 = aliased(tables.DjmdSongPlaylist)
-
-    # Delete duplicates within the specific playlist
-    count = (
-        db.query(tables.DjmdSongPlaylist)
-        .filter(
-            tables.DjmdSongPlaylist.PlaylistID == playlist_id,
-            exists().where(
-                (sp1.PlaylistID == tables.DjmdSongPlaylist.PlaylistID) & 
-                (sp1.ContentID == tables.DjmdSongPlaylist.ContentID) & 
-                (sp1.ID < tables.DjmdSongPlaylist.ID)  # Keep the lowest ID
-            )
-        )
-        .delete(synchronize_session=False)
-    )
+    # Keep the lowest ID of each song and renumber the remaining tracks
+    count = deduplicate_playlists(db, [playlist_id]).get(str(playlist_id), 0)
 
     db.commit()
     return count
 
+def folder_option():
+    """Return the ID given with --folder=ID, or None."""
+    for arg in sys.argv:
+        if arg.startswith("--folder="):
+            return arg.split("=", 1)[1]
+    return None
+
+def deduplicate_batch(db, folder_id=None):
+    """
+    Deduplicate every playlist, or every playlist below a folder, in one pass.
+
+    Prints the number of removed entries per playlist.
+    """
+    playlist_ids = playlist_subtree_ids(db, folder_id) if folder_id is not None else None
+    if playlist_ids == []:
+        print(f"No playlist or folder with id {folder_id}")
+        return 0
+
+    removed = deduplicate_playlists(db, playlist_ids)
+    db.commit()
+
+    names = dict(
+        db.query(tables.DjmdPlaylist.ID, tables.DjmdPlaylist.Name)
+        .filter(tables.DjmdPlaylist.ID.in_(list(removed)))
+        .all()
+    ) if removed else {}
+
+    for playlist_id, count in sorted(removed.items(), key=lambda item: -item[1]):
+        print(f"{Fore.GREEN}{names.get(playlist_id, playlist_id)}{Style.RESET_ALL}: removed {count}")
+
+    total = sum(removed.values())
+    print(f"Removed {total} duplicate entries from {len(removed)} playlists.")
+    return total
+
 if __name__ == "__main__":
     init(autoreset=True)
 
     # Get list of playlists from DB
-    db = Rekordbox6Database()
+    db = database_opener()()
+
+    # Non-interactive batch mode: every playlist, or one folder subtree
+    if "--all" in sys.argv or folder_option() is not None:
+        deduplicate_batch(db, folder_option())
+        db.close()
+        sys.exit(0)
+
     playlists = db.query(tables.DjmdPlaylist).filter(tables.DjmdPlaylist.Attribute == 0).all()
 
     # Get user choice for which playlist to deduplicate
@@ -0,0 +1,50 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from pyrekordbox.db6 import tables
+
+from lib.bulk import bulk_delete_content
+from lib.session import open_database
+from lib.synthetic import SyntheticSpec, generate_database
+
+
+def _song_count(path):
+    db = open_database(path, plain=True)
+    try:
+        return db.query(tables.DjmdContent).count()
+    finally:
+        db.close()
+
+
+def test_bulk_delete_is_undone_by_rollback(tmp_path):
+    path = str(tmp_path / "master.db")
+    generate_database(path, SyntheticSpec(tracks=200, playlists=5, playlist_size=20, artists=20))
+    before = _song_count(path)
+
+    db = open_database(path, plain=True)
+    try:
+        ids = [content.ID for content in db.query(tables.DjmdContent).limit(50)]
+        assert bulk_delete_content(db, ids, batch_size=10) == 50
+        db.rollback()
+    finally:
+        db.close()
+
+    assert _song_count(path) == before
+
+
+def test_bulk_delete_is_kept_after_commit(tmp_path):
+    path = str(tmp_path / "master.db")
+    generate_database(path, SyntheticSpec(tracks=200, playlists=5, playlist_size=20, artists=20))
+    before = _song_count(path)
+
+    db = open_database(path, plain=True)
+    try:
+        ids = [content.ID for content in db.query(tables.DjmdContent).limit(50)]
+        bulk_delete_content(db, ids, batch_size=10)
+        db.session.commit()
+    finally:
+        db.close()
+
+    assert _song_count(path) == before - 50
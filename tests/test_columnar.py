@@ -0,0 +1,66 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from lib.columnar import RULES, SongTable, group_by_key, select_best
+
+
+def _song(index, bitrate=320, path=None, created_at=1_600_000_000_000):
+    return {
+        "ID": str(100 + index),
+        "FolderPath": path or f"/music/{index}.mp3",
+        "BitRate": bitrate,
+        "created_at": created_at,
+    }
+
+
+def _select(songs, groups, file_exists=None, quality=None):
+    best, rules = select_best(SongTable.from_records(songs, file_exists, quality), groups)
+    return best.tolist(), [RULES[rule] for rule in rules]
+
+
+def test_group_by_key():
+    assert group_by_key(["a", "b", "a", "c", "b", "a"]) == [[0, 2, 5], [1, 4]]
+    assert group_by_key([]) == []
+
+
+def test_missing_file_narrows_the_candidates():
+    # Row 0: existing 128 kbps MP3 listed first, row 1: existing FLAC, row 2: missing
+    songs = [_song(0, bitrate=128), _song(1, bitrate=1411, path="/music/1.flac"), _song(2, bitrate=320)]
+    file_exists = {"/music/0.mp3": True, "/music/1.flac": True, "/music/2.mp3": False}
+    quality = {"/music/0.mp3": 128.0, "/music/1.flac": 11644.1, "/music/2.mp3": 320.0}
+
+    assert _select(songs, [[0, 1, 2]], file_exists, quality) == ([1], ["highest_quality"])
+    assert _select(songs, [[0, 1, 2]], file_exists) == ([1], ["highest_bitrate"])
+
+
+def test_missing_file_never_wins_on_a_later_rule():
+    songs = [_song(0, bitrate=128), _song(1, bitrate=320), _song(2, bitrate=128)]
+    file_exists = {"/music/1.mp3": False}
+    assert _select(songs, [[0, 1, 2]], file_exists) == ([0], ["first_index"])
+
+
+def test_file_exists_decides_when_one_file_is_left():
+    songs = [_song(0, bitrate=320), _song(1, bitrate=128)]
+    assert _select(songs, [[0, 1]], {"/music/0.mp3": False}) == ([1], ["file_exists"])
+
+
+def test_all_missing_falls_through_to_the_other_rules():
+    songs = [_song(0, bitrate=128), _song(1, bitrate=320)]
+    file_exists = {"/music/0.mp3": False, "/music/1.mp3": False}
+    assert _select(songs, [[0, 1]], file_exists) == ([1], ["highest_bitrate"])
+
+
+def test_rule_order():
+    songs = [
+        _song(0, path="/music/Imported from Device/0.mp3"),
+        _song(1, created_at=1_700_000_000_000),
+        _song(2),
+        _song(3, created_at=None),
+        _song(4),
+    ]
+    best, rules = _select(songs, [[0, 1], [1, 2], [3, 4], [2, 4]])
+    # A single valid date does not decide a group
+    assert best == [1, 2, 3, 2]
+    assert rules == ["remove_imported", "created_at", "first_index", "first_index"]
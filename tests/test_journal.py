@@ -0,0 +1,142 @@
+import os
+import sqlite3
+import sys
+from functools import partial
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import deduplicate
+from lib.journal import Journal
+from lib.matching import get_matcher
+from lib.session import PipelineSession, open_database
+from lib.synthetic import SyntheticSpec, generate_database
+
+SNAPSHOT_QUERIES = (
+    "SELECT ID, FolderPath, DJPlayCount, Rating, Commnt FROM djmdContent ORDER BY ID",
+    "SELECT * FROM djmdCue ORDER BY ID",
+    "SELECT * FROM djmdSongMyTag ORDER BY ID",
+    "SELECT * FROM djmdSongPlaylist ORDER BY ID",
+)
+
+
+def _library(path, music_folder=None):
+    """A synthetic library whose songs carry play counts, ratings, comments and hot cues to merge."""
+    generate_database(path, SyntheticSpec(tracks=600, playlists=10, playlist_size=40, artists=100))
+    connection = sqlite3.connect(path)
+    connection.execute(
+        "UPDATE djmdContent SET DJPlayCount = CAST(ID AS INTEGER) % 5, Rating = CAST(ID AS INTEGER) % 6, "
+        "Commnt = CASE WHEN CAST(ID AS INTEGER) % 7 = 0 THEN 'comment ' || ID ELSE '' END"
+    )
+    connection.execute("UPDATE djmdCue SET Kind = CAST(ID AS INTEGER) % 3")
+    if music_folder is not None:
+        os.makedirs(music_folder)
+        connection.execute("UPDATE djmdContent SET FolderPath = ? || '/' || ID || '.mp3'", (music_folder,))
+        for (path,) in connection.execute("SELECT FolderPath FROM djmdContent"):
+            with open(path, "wb") as f:
+                f.write(path.encode())
+    connection.commit()
+    connection.close()
+
+
+def _snapshot(path):
+    connection = sqlite3.connect(path)
+    try:
+        return [connection.execute(query).fetchall() for query in SNAPSHOT_QUERIES]
+    finally:
+        connection.close()
+
+
+def _outcome(path):
+    """The library as a run leaves it, without the IDs generated for copied cues and tags."""
+    connection = sqlite3.connect(path)
+    try:
+        return [
+            connection.execute(SNAPSHOT_QUERIES[0]).fetchall(),
+            connection.execute("SELECT ContentID, InMsec, Kind FROM djmdCue ORDER BY 1, 2, 3").fetchall(),
+            connection.execute("SELECT ContentID, MyTagID FROM djmdSongMyTag ORDER BY 1, 2").fetchall(),
+            connection.execute(SNAPSHOT_QUERIES[3]).fetchall(),
+        ]
+    finally:
+        connection.close()
+
+
+def _session(path):
+    return PipelineSession(partial(open_database, path, plain=True))
+
+
+def _start_run(session, journal, tmp_path):
+    content_list = deduplicate.dump_song_data(session.db, str(tmp_path / "songs.yaml"), str(tmp_path / "songs.json"))
+    best_songs = deduplicate.deduplicate(content_list, get_matcher([]).group(content_list))
+    assert best_songs
+    return journal.start_run(deduplicate.build_plan(session.db, best_songs), str(tmp_path / "backup"))
+
+
+def test_resumed_run_matches_uninterrupted_run(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    os.makedirs("data")
+    straight, resumed = str(tmp_path / "straight.db"), str(tmp_path / "resumed.db")
+    _library(straight)
+    _library(resumed)
+
+    with _session(straight) as session, Journal(str(tmp_path / "straight.jdb")) as journal:
+        run_id = _start_run(session, journal, tmp_path)
+        deduplicate.execute_run(session, journal, run_id, str(tmp_path / "backup"), confirm=False)
+        assert journal.latest_run()[1] == "completed"
+
+    # Stop after the playlist rewrite, then resume in a new session
+    with Journal(str(tmp_path / "resumed.jdb")) as journal:
+        with _session(resumed) as session:
+            run_id = _start_run(session, journal, tmp_path)
+            assert deduplicate.journaled_replace(session.db, journal, run_id)
+        replaced = journal.completed_batches(run_id, "replace")
+
+        with _session(resumed) as session:
+            deduplicate.execute_run(session, journal, run_id, str(tmp_path / "backup"), confirm=False)
+        assert journal.completed_batches(run_id, "replace") == replaced
+        assert journal.latest_run()[1] == "completed"
+
+    assert _outcome(resumed) == _outcome(straight)
+
+
+def test_merge_redo_is_idempotent(tmp_path):
+    path = str(tmp_path / "master.db")
+    _library(path)
+
+    with _session(path) as session, Journal(str(tmp_path / "journal.db")) as journal:
+        run_id = _start_run(session, journal, tmp_path)
+        assert deduplicate.journaled_replace(session.db, journal, run_id)
+        assert deduplicate.journaled_compact(session.db, journal, run_id)
+        assert deduplicate.journaled_merge(session.db, journal, run_id)
+        merged = _snapshot(path)
+
+        # A crash between the commit and the mark makes the step run again
+        with journal.connection:
+            journal.connection.execute("DELETE FROM batches WHERE step = 'merge'")
+        assert deduplicate.journaled_merge(session.db, journal, run_id)
+
+    assert _snapshot(path) == merged
+
+
+def test_rollback_restores_library_and_files(tmp_path):
+    path = str(tmp_path / "master.db")
+    music = str(tmp_path / "music")
+    _library(path, music)
+    before = _snapshot(path)
+    files = sorted(os.listdir(music))
+
+    with _session(path) as session, Journal(str(tmp_path / "journal.db")) as journal:
+        run_id = _start_run(session, journal, tmp_path)
+        assert deduplicate.journaled_replace(session.db, journal, run_id)
+        assert deduplicate.journaled_compact(session.db, journal, run_id)
+        assert deduplicate.journaled_merge(session.db, journal, run_id)
+        assert deduplicate.journaled_move(journal, run_id, str(tmp_path / "backup"), str(tmp_path / "manifest.jsonl"))
+        assert journal.moves(run_id)
+        assert sorted(os.listdir(music)) != files
+        assert _snapshot(path) != before
+
+        deduplicate.rollback_run(session, journal)
+        assert journal.latest_run()[1] == "rolled_back"
+        assert not journal.moves(run_id)
+
+    assert _snapshot(path) == before
+    assert sorted(os.listdir(music)) == files
@@ -0,0 +1,86 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pytest
+
+from lib.matching import ExactNameMatcher, NormalizedMatcher, get_matcher, merge_groups, normalize_title, split_artists
+
+
+def _song(title, artist, length=200, bpm=12800):
+    return {"Title": title, "ArtistName": artist, "FullName": f"{artist} - {title}", "Length": length, "BPM": bpm}
+
+
+@pytest.mark.parametrize("title, expected", [
+    ("Feat of Clay", ("feat of clay", frozenset())),
+    ("Ft. Lauderdale Nights", ("ft lauderdale nights", frozenset())),
+    ("The Ft Song", ("the ft song", frozenset())),
+    ("Song (feat. Bob)", ("song", frozenset({"bob"}))),
+    ("Song - feat. Bob & Al", ("song", frozenset({"bob", "al"}))),
+    ("Song ft. Bob", ("song", frozenset({"bob"}))),
+    ("Song featuring Bob", ("song", frozenset({"bob"}))),
+    ("Song (Original Mix)", ("song", frozenset())),
+    ("Song - 2011 Remaster", ("song", frozenset())),
+    ("Song (Extended Mix)", ("song extended mix", frozenset())),
+    ("Café Del Mar", ("cafe del mar", frozenset())),
+])
+def test_normalize_title(title, expected):
+    assert normalize_title(title) == expected
+
+
+def test_normalize_title_never_empties_a_title():
+    assert normalize_title("(Original Mix)")[0] == "original mix"
+
+
+def test_split_artists():
+    assert split_artists("A feat. B") == split_artists("B & A") == split_artists("A, B") == frozenset({"a", "b"})
+
+
+def test_exact_matcher_groups_identical_full_names():
+    songs = [_song("One", "A"), _song("Two", "A"), _song("One", "A"), _song("one", "A")]
+    assert ExactNameMatcher().group(songs) == [[0, 2]]
+
+
+def test_fuzzy_matcher_groups_variants():
+    songs = [
+        _song("Song (Original Mix)", "A"),
+        _song("Song", "A feat. B", length=201),
+        _song("Song (Extended Mix)", "A"),
+        _song("Song", "A", length=260),
+        _song("Song", "C"),
+    ]
+    assert NormalizedMatcher().group(songs) == [[0, 1]]
+
+
+def test_fuzzy_matcher_is_not_transitive():
+    # X matches "X & Y" and "X & Y" matches Y, but X and Y are different songs
+    songs = [_song("Intro", "X"), _song("Intro", "X & Y"), _song("Intro", "Y")]
+    groups = NormalizedMatcher().group(songs)
+    assert groups == [[0, 1]]
+    assert all(not {0, 2} <= set(group) for group in groups)
+
+
+def test_fuzzy_matcher_members_match_their_anchor():
+    songs = [_song("Intro", "X", length=0)] + [_song("Intro", artist, length=0) for artist in ("X & Y", "Y", "Y & Z", "Z")]
+    matcher = NormalizedMatcher()
+    keys = [matcher._key(song) for song in songs]
+    for group in matcher.group(songs):
+        anchor = group[0]
+        assert all(matcher.score(keys[anchor], keys[member]) >= matcher.min_score for member in group[1:])
+
+
+def test_fuzzy_matcher_bounds_unknown_length_comparisons():
+    songs = [_song("Intro", f"Artist {number}", length=0) for number in range(2000)]
+    assert NormalizedMatcher().group(songs) == []
+
+
+def test_get_matcher():
+    assert isinstance(get_matcher([]), ExactNameMatcher)
+    assert isinstance(get_matcher(["--matcher=fuzzy"]), NormalizedMatcher)
+    with pytest.raises(ValueError):
+        get_matcher(["--matcher=nope"])
+
+
+def test_merge_groups_joins_overlapping_groups():
+    assert merge_groups(6, [[0, 1], [4, 5]], [[1, 2]]) == [[0, 1, 2], [4, 5]]
@@ -0,0 +1,78 @@
+import os
+import sqlite3
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from lib.playlists import compact_playlists, remove_duplicate_entries
+from lib.session import open_database
+from lib.synthetic import SyntheticSpec, generate_database
+
+# Playlist 1 after a replacement pointed songs 20 and 40 at song 30: entry ID -> ContentID
+ENTRIES = {"1": "10", "2": "10", "3": "30", "4": "30", "5": "30", "6": "30", "7": "50"}
+# Entry ID -> ContentID before the replacement
+REMAPPED = {"4": "20", "5": "40", "6": "40"}
+
+
+def _library(tmp_path):
+    path = str(tmp_path / "master.db")
+    generate_database(path, SyntheticSpec(tracks=100, playlists=2, playlist_size=len(ENTRIES), artists=10))
+    connection = sqlite3.connect(path)
+    connection.executemany(
+        "UPDATE djmdSongPlaylist SET ContentID = ? WHERE ID = ?",
+        [(content_id, entry_id) for entry_id, content_id in ENTRIES.items()],
+    )
+    connection.commit()
+    connection.close()
+    return path
+
+
+def _entries(path, playlist_id="1"):
+    connection = sqlite3.connect(path)
+    try:
+        return connection.execute(
+            "SELECT ID, ContentID, TrackNo FROM djmdSongPlaylist WHERE PlaylistID = ? ORDER BY TrackNo", (playlist_id,)
+        ).fetchall()
+    finally:
+        connection.close()
+
+
+def _run(path, function, *args, **kwargs):
+    db = open_database(path, plain=True)
+    try:
+        result = function(db, *args, **kwargs)
+        db.commit()
+        return result
+    finally:
+        db.close()
+
+
+def test_remove_every_repeat(tmp_path):
+    path = _library(tmp_path)
+    other = _entries(path, "2")
+
+    assert _run(path, remove_duplicate_entries, ["1"]) == {"1": 4}
+    assert [entry[0] for entry in _entries(path)] == ["1", "3", "7"]
+    assert _entries(path, "2") == other
+
+
+def test_remapped_keeps_repeats_the_user_added(tmp_path):
+    path = _library(tmp_path)
+
+    # Song 10 was in the playlist twice and song 40 too, so song 30 stays twice
+    assert _run(path, remove_duplicate_entries, ["1"], remapped=REMAPPED) == {"1": 2}
+    assert [entry[0] for entry in _entries(path)] == ["1", "2", "3", "6", "7"]
+
+
+def test_remapped_without_rewritten_entries_removes_nothing(tmp_path):
+    path = _library(tmp_path)
+
+    assert _run(path, remove_duplicate_entries, ["1"], remapped={}) == {}
+    assert len(_entries(path)) == len(ENTRIES)
+
+
+def test_compact_renumbers_touched_playlists(tmp_path):
+    path = _library(tmp_path)
+
+    assert _run(path, compact_playlists, ["1"], REMAPPED) == {"1": 2}
+    assert _entries(path) == [("1", "10", 1), ("2", "10", 2), ("3", "30", 3), ("6", "30", 4), ("7", "50", 5)]
@@ -0,0 +1,103 @@
+import io
+import os
+import struct
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from lib.quality import (AudioQuality, probe_aiff, probe_file, probe_flac, probe_mp3, probe_mp4, probe_wav,
+                         quality_score)
+
+# MPEG-1 Layer III, 128 kbps, 44.1 kHz, stereo
+MP3_FRAME_HEADER = struct.pack(">I", 0xFFFB9000)
+
+
+def _probe(probe, data, file_size=None):
+    return probe(io.BytesIO(data), len(data) if file_size is None else file_size)
+
+
+def _box(box_type, payload):
+    return struct.pack(">I4s", 8 + len(payload), box_type) + payload
+
+
+def _m4a(entry_type, children):
+    # SampleEntry, then AudioSampleEntry version 0: stereo, 16-bit, 44.1 kHz
+    entry = bytes(6) + struct.pack(">H", 1) + struct.pack(">HH4sHHHHI", 0, 0, b"\0\0\0\0", 2, 16, 0, 0, 44100 << 16)
+    stsd = struct.pack(">II", 0, 1) + _box(entry_type, entry + children)
+    for container in (b"stbl", b"minf", b"mdia", b"trak", b"moov"):
+        stsd = _box(container, stsd if container != b"stbl" else _box(b"stsd", stsd))
+    return _box(b"ftyp", b"M4A " + bytes(4)) + stsd
+
+
+def test_probe_mp3_cbr():
+    data = b"ID3\x03\x00\x00\x00\x00\x00\x04" + bytes(4) + b"junk" + MP3_FRAME_HEADER + bytes(400)
+    assert _probe(probe_mp3, data) == AudioQuality("mp3", False, 44100, None, 2, 128)
+
+
+def test_probe_mp3_xing_gives_average_bitrate():
+    # 1000 frames of 1152 samples at 44.1 kHz in 836000 bytes is 256 kbps
+    xing = b"Xing" + struct.pack(">III", 3, 1000, 836000)
+    data = MP3_FRAME_HEADER + bytes(32) + xing + bytes(400)
+    assert _probe(probe_mp3, data).bitrate == 256
+
+
+def test_probe_mp3_without_frame():
+    assert _probe(probe_mp3, b"\xff\x00" * 100) is None
+
+
+def test_probe_flac():
+    packed = 96000 << 44 | (2 - 1) << 41 | (24 - 1) << 36 | 96000 * 60
+    info = bytes(10) + packed.to_bytes(8, "big") + bytes(16)
+    data = b"fLaC" + b"\x00" + (34).to_bytes(3, "big") + info
+    # 60 seconds in 30 MB is 4000 kbps
+    assert _probe(probe_flac, data, 30_000_000) == AudioQuality("flac", True, 96000, 24, 2, 4000)
+
+
+def test_probe_wav():
+    fmt = struct.pack("<HHIIHH", 1, 2, 44100, 176400, 4, 16)
+    chunks = b"LIST" + struct.pack("<I", 3) + b"abc\0" + b"fmt " + struct.pack("<I", len(fmt)) + fmt
+    data = b"RIFF" + struct.pack("<I", 4 + len(chunks)) + b"WAVE" + chunks
+    assert _probe(probe_wav, data) == AudioQuality("wav", True, 44100, 16, 2, 1411)
+
+
+def test_probe_aiff():
+    # 44100 as an 80-bit extended float
+    rate = struct.pack(">HQ", 16383 + 15, 44100 << 48)
+    comm = struct.pack(">HIH", 2, 0, 24) + rate
+    data = b"FORM" + struct.pack(">I", 4 + 8 + len(comm)) + b"AIFF" + b"COMM" + struct.pack(">I", len(comm)) + comm
+    assert _probe(probe_aiff, data) == AudioQuality("aiff", True, 44100, 24, 2, 2117)
+
+
+def test_probe_aifc_compressed_is_lossy():
+    rate = struct.pack(">HQ", 16383 + 15, 44100 << 48)
+    comm = struct.pack(">HIH", 2, 0, 16) + rate + b"ima4"
+    data = b"FORM" + struct.pack(">I", 4 + 8 + len(comm)) + b"AIFC" + b"COMM" + struct.pack(">I", len(comm)) + comm
+    quality = _probe(probe_aiff, data)
+    assert not quality.lossless and quality.bit_depth is None
+
+
+def test_probe_mp4_aac():
+    decoder_config = bytes([0x40, 0x15]) + bytes(3) + struct.pack(">II", 320000, 256000)
+    es_descriptor = struct.pack(">HB", 1, 0) + bytes([0x04, len(decoder_config)]) + decoder_config
+    esds = _box(b"esds", bytes(4) + bytes([0x03, len(es_descriptor)]) + es_descriptor)
+    assert _probe(probe_mp4, _m4a(b"mp4a", esds)) == AudioQuality("aac", False, 44100, None, 2, 256)
+
+
+def test_probe_mp4_alac():
+    config = struct.pack(">IIBBBBBBHIII", 0, 4096, 0, 24, 40, 10, 14, 2, 255, 0, 2_000_000, 96000)
+    assert _probe(probe_mp4, _m4a(b"alac", _box(b"alac", config))) == AudioQuality("alac", True, 96000, 24, 2, 2000)
+
+
+def test_probe_file_tries_every_parser_for_unknown_extensions(tmp_path):
+    path = tmp_path / "song.bin"
+    path.write_bytes(MP3_FRAME_HEADER + bytes(400))
+    assert probe_file(str(path)).codec == "mp3"
+    assert probe_file(str(tmp_path / "missing.mp3")) is None
+
+
+def test_quality_score_ranks_lossless_above_lossy():
+    mp3 = AudioQuality("mp3", False, 44100, None, 2, 320)
+    cd = AudioQuality("flac", True, 44100, 16, 2, 900)
+    hires = AudioQuality("flac", True, 96000, 24, 2, 3000)
+    assert quality_score(mp3) == 320
+    assert quality_score(mp3) < quality_score(cd) < quality_score(hires)
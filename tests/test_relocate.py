@@ -0,0 +1,71 @@
+import json
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from lib.relocate import Relocator
+
+
+def _write(path, content):
+    with open(path, "w") as f:
+        f.write(content)
+
+
+def test_names_differing_in_case_are_taken(tmp_path):
+    destination = tmp_path / "backup"
+    destination.mkdir()
+    _write(destination / "Track.mp3", "old")
+
+    relocator = Relocator(str(destination))
+    assert os.path.basename(relocator.reserve_name("track.MP3")) == "track (1).MP3"
+    assert os.path.basename(relocator.reserve_name("TRACK.mp3")) == "TRACK (2).mp3"
+
+
+def test_move_never_overwrites_a_file_created_after_the_listing(tmp_path):
+    source_folder = tmp_path / "music"
+    source_folder.mkdir()
+    destination = tmp_path / "backup"
+    relocator = Relocator(str(destination))
+
+    _write(destination / "song.mp3", "late")
+    _write(source_folder / "song.mp3", "new")
+    result = relocator.move(str(source_folder / "song.mp3"))
+
+    assert result.error is None
+    assert os.path.basename(result.destination) == "song (1).mp3"
+    assert (destination / "song.mp3").read_text() == "late"
+    assert (destination / "song (1).mp3").read_text() == "new"
+    assert not (source_folder / "song.mp3").exists()
+
+
+def test_cross_device_copy_never_overwrites(tmp_path):
+    source = tmp_path / "song.mp3"
+    _write(source, "new")
+    destination = tmp_path / "backup"
+    relocator = Relocator(str(destination))
+    relocator.destination_device = -1  # Force the copy path
+    _write(destination / "song.mp3", "late")
+
+    result = relocator.move(str(source))
+
+    assert result.method == "copy"
+    assert (destination / "song.mp3").read_text() == "late"
+    assert (destination / "song (1).mp3").read_text() == "new"
+    assert not source.exists()
+
+
+def test_move_all_writes_a_manifest_line_per_file(tmp_path):
+    sources = []
+    for number in range(5):
+        path = tmp_path / f"{number}.mp3"
+        _write(path, str(number))
+        sources.append(str(path))
+    sources.append(str(tmp_path / "missing.mp3"))
+    manifest = tmp_path / "manifest.jsonl"
+
+    results = Relocator(str(tmp_path / "backup")).move_all(sources, str(manifest))
+
+    lines = [json.loads(line) for line in manifest.read_text().splitlines()]
+    assert len(results) == len(lines) == 6
+    assert sum(line["error"] == "not found" for line in lines) == 1
@@ -0,0 +1,47 @@
+import os
+import sqlite3
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from lib.scan_cache import ScanCache
+from lib.session import open_database
+from lib.synthetic import SyntheticSpec, generate_database
+
+
+def _refresh(library, cache_path):
+    db = open_database(library, plain=True)
+    try:
+        with ScanCache(cache_path) as cache:
+            return cache.refresh(db)
+    finally:
+        db.close()
+
+
+def test_refresh_reuses_unchanged_songs_and_sees_joined_changes(tmp_path):
+    library = str(tmp_path / "master.db")
+    cache_path = str(tmp_path / "song_cache.db")
+    generate_database(library, SyntheticSpec(tracks=200, playlists=5, playlist_size=20, artists=20))
+
+    first = _refresh(library, cache_path)
+    assert len(first.changed_ids) == len(first.content_list)
+    assert not _refresh(library, cache_path).changed_ids
+
+    # Renaming an artist leaves djmdContent alone but changes the songs' FullName
+    with sqlite3.connect(library) as connection:
+        artist_id = connection.execute("SELECT ArtistID FROM djmdContent WHERE ArtistID IS NOT NULL LIMIT 1").fetchone()[0]
+        song_ids = {row[0] for row in connection.execute("SELECT ID FROM djmdContent WHERE ArtistID = ?", (artist_id,))}
+        connection.execute(
+            "UPDATE djmdArtist SET Name = 'Renamed', rb_local_usn = rb_local_usn + 1 WHERE ID = ?", (artist_id,)
+        )
+
+    result = _refresh(library, cache_path)
+    assert result.changed_ids == song_ids
+    assert {song["ID"] for song in result.content_list if song["ArtistName"] == "Renamed"} == song_ids
+
+    # Removing a MyTag link re-extracts the song
+    with sqlite3.connect(library) as connection:
+        link = connection.execute("SELECT ID, ContentID FROM djmdSongMyTag LIMIT 1").fetchone()
+        connection.execute("DELETE FROM djmdSongMyTag WHERE ID = ?", (link[0],))
+
+    assert _refresh(library, cache_path).changed_ids == {link[1]}